@@ -0,0 +1,75 @@
+"""Address normalization cost: raw usaddress tagging vs the memoized normalizer.
+
+The corpus is public US addresses (government buildings, landmarks, stadiums)
+with the formatting variations Netbox users tend to type.
+
+    python -m benchmarks.address_normalize --repeat 50
+"""
+import time
+import argparse
+from helpers.address import AddressNormalizer, parse_address
+
+CORPUS = [
+    '1600 Pennsylvania Ave NW Washington DC 20500',
+    '1 Infinite Loop Cupertino CA 95014',
+    '350 5th Ave New York NY 10118',
+    '233 S Wacker Dr Chicago IL 60606',
+    '400 Broad St Seattle WA 98109',
+    '4059 Mt Lee Dr Hollywood CA 90068',
+    '1 Microsoft Way Redmond WA 98052',
+    '1 Apple Park Way Cupertino CA 95014',
+    '200 Santa Monica Pier Santa Monica CA 90401',
+    '10 Downing Pl Houston TX 77002',
+    '600 Montgomery St San Francisco CA 94111',
+    '1000 Vin Scully Ave Los Angeles CA 90012',
+    '333 W 35th St Chicago IL 60616',
+    '4 Yawkey Way Boston MA 02215',
+    '1 Rocket Rd Hawthorne CA 90250',
+    '2 15th St NW Washington DC 20024',
+    '700 Clark Ave St. Louis MO 63102',
+    '1 AT&T Way Arlington TX 76011',
+    '100 Universal City Plaza Universal City CA 91608',
+    '151 3rd St San Francisco CA 94103',
+    '1 Lincoln Financial Field Way Philadelphia PA 19148',
+    '6000 N Terminal Pkwy Atlanta GA 30320',
+    '3600 Las Vegas Blvd S Las Vegas NV 89109',
+    '2700 Pennsylvania Ave Santa Monica CA 90404',
+    '3333 Scott Blvd Santa Clara CA 95054',
+    '6280 America Center Dr San Jose CA 95002',
+    '1 Independence Mall Philadelphia PA 19106',
+    '11 Wall St New York NY 10005',
+    '405 Lexington Ave New York NY 10174',
+    '700 E Pratt St Baltimore MD 21202',
+]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    # Netbox events for the same sites keep arriving with the same addresses
+    events = [f' {address}  ' if i % 3 else address for i in range(args.repeat) for address in CORPUS]
+
+    normalizer = AddressNormalizer()
+    elapsed, _ = timed(normalizer.warm)
+    print(f'model warm-up    {elapsed * 1000:>9.2f} ms')
+
+    elapsed, _ = timed(lambda: [parse_address(address) for address in events])
+    print(f'uncached         {len(events) / elapsed:>9.0f} addresses/s')
+
+    elapsed, _ = timed(lambda: [normalizer.normalize(address) for address in events])
+    print(f'lru              {len(events) / elapsed:>9.0f} addresses/s  {normalizer.stats()}')
+
+    batch = AddressNormalizer()
+    elapsed, _ = timed(lambda: batch.normalize_many(events))
+    print(f'normalize_many   {len(events) / elapsed:>9.0f} addresses/s  {batch.stats()}')
+
+
+if __name__ == '__main__':
+    main()
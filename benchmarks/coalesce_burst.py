@@ -0,0 +1,53 @@
+"""Collapse ratio and added latency of the Coalescer under a Netbox bulk edit.
+
+Simulates a CSV import touching --objects devices, each updated --updates
+times within a couple of seconds, plus a config-change storm of one
+DEVICE_CONFIG_CHANGE_DETECTED per device across a few groups. Emitted alerts
+are counted in memory, no Redis needed.
+
+    python -m benchmarks.coalesce_burst --objects 200 --updates 4 --window 0.5
+"""
+import random
+import asyncio
+import argparse
+from helpers.coalesce import Coalescer
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=4)
+    parser.add_argument('--groups', type=int, default=5)
+    parser.add_argument('--spread', type=float, default=2.0, help='seconds the burst is spread over')
+    parser.add_argument('--window', type=float, default=0.5)
+    parser.add_argument('--max-wait', type=float, default=5.0)
+    args = parser.parse_args()
+
+    emitted = []
+
+    async def emit(key, alert):
+        emitted.append((key, alert))
+        return f'{len(emitted)}-0'
+
+    coalescer = Coalescer(emit, window=args.window, max_wait=args.max_wait)
+    fields = ['hostname', 'central_subscription', 'description']
+
+    async def netbox_update(serial, n):
+        await asyncio.sleep(random.uniform(0, args.spread))
+        await coalescer.submit('cmdb:alert', {'event': 'updated', 'device_type': 'Access Point',
+                                              'serial': serial, fields[n % len(fields)]: f'value-{n}'})
+
+    async def config_change(device):
+        await asyncio.sleep(random.uniform(0, args.spread))
+        await coalescer.submit('config:alert', {'group': f'group-{device % args.groups}',
+                                                'device': 'IAP', 'cluster': 'us-2'})
+
+    await asyncio.gather(*(netbox_update(f'SN{i:06d}', n) for i in range(args.objects) for n in range(args.updates)),
+                         *(config_change(i) for i in range(args.objects)))
+    stats = coalescer.stats()
+    print(f'received {stats["received"]}  emitted {stats["emitted"]}  collapse ratio {stats["collapse_ratio"]:.1%}')
+    print(f'added latency avg {stats["avg_added_latency_ms"]:.0f} ms  max {stats["max_held_seconds"] * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""Full CX + AP configuration snapshot for many groups: sequential getters vs ConfigFetcher.
+
+A mock Central answers every /configuration/v1/... path of UrlObj after
+--latency seconds; groups whose name ends in -gone answer 404 to show partial
+results.
+
+    python -m benchmarks.config_fetch --groups 200 --parallel 8 16 32
+"""
+import time
+import argparse
+from helpers.central_utils.config_fetcher import ConfigFetcher, CX_SECTIONS, AP_SECTIONS
+from benchmarks.mock_central import MockCentral, MockConn
+
+
+def config_route(path, query, body):
+    group = path.rstrip('/').rsplit('/', 1)[-1]
+    if group.endswith('-gone'):
+        return 404, {'description': f'Group {group} not found'}
+    return 200, {'group': group, 'section': path, 'lines': [f'line {i}' for i in range(50)]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--missing', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--parallel', type=int, nargs='+', default=[8, 16, 32])
+    args = parser.parse_args()
+
+    central = MockCentral(latency=args.latency).start()
+    central.route('GET', '/configuration/v1/', config_route)
+    conn = MockConn(central.url)
+    groups = [f'group-{i}' for i in range(args.groups - args.missing)] + \
+             [f'group-{i}-gone' for i in range(args.missing)]
+    sections = list(CX_SECTIONS) + list(AP_SECTIONS)
+    calls = len(groups) * len(sections)
+
+    fetcher = ConfigFetcher(max_parallel=1)
+    start = time.perf_counter()
+    for group in groups:
+        for section in sections:
+            fetcher._getter(section)(conn, group_name=group)
+    elapsed = time.perf_counter() - start
+    print(f'sequential   {calls} calls  {elapsed:>7.2f} s  {calls / elapsed:>7.1f} calls/s')
+
+    for parallel in args.parallel:
+        fetcher = ConfigFetcher(max_parallel=parallel, timeout=10)
+        start = time.perf_counter()
+        snapshot = fetcher.fetch_sync(groups, sections, conn=conn)
+        elapsed = time.perf_counter() - start
+        failed = sum(len(e) for e in snapshot['errors'].values())
+        print(f'parallel {parallel:>3} {calls} calls  {elapsed:>7.2f} s  {calls / elapsed:>7.1f} calls/s  '
+              f'{len(snapshot["results"])} groups ok  {failed} calls failed')
+        fetcher.close()
+    central.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Footprint and diff time of ConfigSnapshotStore for thousands of groups.
+
+Groups are built from a handful of templates, as in most Central accounts, and
+every group carries its own VLAN names. A first pass records every section, a
+second pass records them again with --changed groups edited. Reports bytes
+stored against the raw size, the time to recognise unchanged sections by hash
+and the time to diff the changed ones.
+
+    python -m benchmarks.config_store --groups 5000 --backend disk
+    python -m benchmarks.config_store --groups 5000 --backend redis --redis redis://localhost:6379/0
+"""
+import time
+import random
+import argparse
+import tempfile
+from helpers.central_utils.config_store import ConfigSnapshotStore, DiskBackend, RedisBackend, canonical
+
+
+def ap_cli(template: int):
+    lines = [f'wlan ssid-profile corp-{template}', '  enable', '  type employee', f'  essid corp-{template}',
+             '  opmode wpa2-aes', f'  vlan {100 + template}']
+    return [line for i in range(20) for line in lines] + [f'ntp-server 10.{template}.0.1']
+
+
+def group_config(group: int, templates: int, edited: bool = False):
+    template = group % templates
+    vlans = {'vlans': [{'id': 100 + v, 'name': f'g{group}-vlan{v}', 'admin_state': 'up'} for v in range(24)]}
+    if edited:
+        vlans['vlans'][3]['admin_state'] = 'down'
+    cli = ap_cli(template) + (['  vlan 999'] if edited else [])
+    return {
+        'vlans': vlans,
+        'interfaces': {'interfaces': [{'name': f'1/1/{p}', 'vlan_mode': 'access', 'vlan_tag': 100 + template,
+                                       'lldp': True} for p in range(48)]},
+        'lags': {'lags': [{'name': 'lag1', 'members': ['1/1/49', '1/1/50']}]},
+        'loop-prevention': {'enable': True, 'transmit_interval': 5},
+        'properties': {'timezone': 'US/Central', 'dns_servers': ['10.0.0.53'], 'template': template},
+        'syslog': {'servers': [{'address': '10.0.0.10', 'severity': 'warning'}]},
+        'ap_cli': cli,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=5000)
+    parser.add_argument('--templates', type=int, default=20)
+    parser.add_argument('--changed', type=int, default=100)
+    parser.add_argument('--backend', choices=['disk', 'redis'], default='disk')
+    parser.add_argument('--redis', default='redis://localhost:6379/0')
+    args = parser.parse_args()
+
+    if args.backend == 'redis':
+        import redis
+        client = redis.StrictRedis.from_url(args.redis)
+        for key in client.scan_iter('configstore:bench:*', count=1000):
+            client.delete(key)
+        backend = RedisBackend(client, prefix='configstore:bench:')
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        backend = DiskBackend(tmp.name)
+    store = ConfigSnapshotStore(backend)
+
+    raw = 0
+    start = time.perf_counter()
+    for group in range(args.groups):
+        for section, config in group_config(group, args.templates).items():
+            raw += len(canonical(config))
+            store.record(f'group-{group}', section, config)
+    first = time.perf_counter() - start
+    footprint = backend.footprint()
+    print(f'first pass   {args.groups} groups  {first:>6.2f} s  raw {raw / 1e6:>7.1f} MB  '
+          f'stored {footprint["blob_bytes"] / 1e6:>6.2f} MB in {footprint["blobs"]} blobs')
+
+    edited = set(random.sample(range(args.groups), args.changed))
+    changed, start = [], time.perf_counter()
+    for group in range(args.groups):
+        for section, config in group_config(group, args.templates, group in edited).items():
+            if store.record(f'group-{group}', section, config)['changed']:
+                changed.append((f'group-{group}', section))
+    second = time.perf_counter() - start
+    print(f'second pass  {args.groups * 7} sections  {second:>6.2f} s  '
+          f'{second / (args.groups * 7) * 1e6:>6.1f} us/section  {len(changed)} changed')
+
+    start = time.perf_counter()
+    for group, section in changed:
+        store.diff(group, section)
+    elapsed = time.perf_counter() - start
+    print(f'diff         {len(changed)} sections  {elapsed / max(len(changed), 1) * 1000:>6.2f} ms/section')
+    print(f'example      {changed[0]}: {store.diff(*changed[0])}' if changed else '')
+
+
+if __name__ == '__main__':
+    main()
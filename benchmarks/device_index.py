@@ -0,0 +1,167 @@
+"""Central device index: full listing time, memory per 100k devices and lookup latency.
+
+A mock Central serves --devices APs and switches on the paginated
+/monitoring/v2 listings and the per-device /monitoring/v1 detail calls.
+Reports:
+
+    listing   time to list every device with 1 and with --parallel pages in flight
+    memory    traced bytes of the serial index, compact records against keeping
+              the devices as Central returns them, scaled to 100k devices
+    lookup    in-memory lookup, Redis lookup (with --redis) and asking Central
+              for one device at a time, per lookup
+
+With --redis the resync into the shared hash is timed and its MEMORY USAGE
+reported; use a disposable database.
+
+    python -m benchmarks.device_index --devices 100000
+    python -m benchmarks.device_index --devices 100000 --redis redis://localhost:6379/0
+"""
+import gc
+import json
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+from benchmarks.mock_central import MockCentral, MockConn
+from helpers.central_utils.device_index import DeviceIndex, DeviceRecord, DEVICE_TYPES
+
+GROUPS = [f'Branch-{i:03d}' for i in range(200)]
+MODELS = {'ap': ['AP-515', 'AP-535', 'AP-635', 'IAP-305'], 'switch': ['6100', '6200F', '6300M', '2930F']}
+
+
+def make_devices(count: int, switch_share: float, rng: random.Random) -> dict:
+    """Device type -> devices as the Central listing returns them."""
+    devices = {'ap': [], 'switch': []}
+    for i in range(count):
+        device_type = 'switch' if rng.random() < switch_share else 'ap'
+        group = rng.choice(GROUPS)
+        devices[device_type].append({
+            'serial': f'CN{i:08d}', 'name': f'{device_type}-{group.lower()}-{i}', 'group_name': group,
+            'site': f'JA {group}', 'status': 'Up' if rng.random() < 0.97 else 'Down',
+            'macaddr': ':'.join(f'{(i >> s) & 0xff:02x}' for s in (40, 32, 24, 16, 8, 0)),
+            'model': rng.choice(MODELS[device_type]), 'ip_address': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+            'firmware_version': '10.4.0.1', 'labels': [], 'swarm_id': '', 'cluster_id': '',
+            'client_count': rng.randint(0, 60), 'uptime': rng.randint(0, 10 ** 7),
+        })
+    return devices
+
+
+def mock_central(devices: dict, latency: float) -> MockCentral:
+    central = MockCentral(latency=latency)
+    by_serial = {d['serial']: (t, d) for t, listed in devices.items() for d in listed}
+    for device_type, (list_url, detail_url, list_key) in DEVICE_TYPES.items():
+        listed = devices[device_type]
+
+        def listing(path, query, body, listed=listed, list_key=list_key):
+            offset, limit = int(query.get('offset', 0)), int(query.get('limit', 100))
+            page = listed[offset:offset + limit]
+            return 200, {list_key: page, 'count': len(page), 'total': len(listed)}
+
+        def details(path, query, body, device_type=device_type):
+            found_type, device = by_serial.get(path.rsplit('/', 1)[-1], (None, None))
+            if found_type != device_type:
+                return 404, {'description': 'Device not found'}
+            return 200, device
+
+        central.route('GET', list_url, listing)
+        central.route('GET', detail_url + '/', details)
+    return central.start()
+
+
+def traced(build):
+    """Result of ``build()`` and the traced bytes still held by it."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, held
+
+
+def per_lookup(fn, serials) -> float:
+    start = time.perf_counter()
+    for serial in serials:
+        fn(serial)
+    return (time.perf_counter() - start) / len(serials)
+
+
+async def run(args):
+    rng = random.Random(1)
+    devices = make_devices(args.devices, args.switch_share, rng)
+    central = mock_central(devices, args.latency)
+    conn = MockConn(central.url)
+    print(f'{args.devices} devices: {len(devices["ap"])} APs, {len(devices["switch"])} switches, '
+          f'{args.page_size} per page, {args.latency * 1000:.0f} ms per call')
+
+    for parallel in sorted({1, args.parallel}):
+        index = DeviceIndex(None, conn, page_size=args.page_size, max_parallel_pages=parallel)
+        start = time.perf_counter()
+        records = await index.fetch_all()
+        print(f'listing  {parallel:>2} page(s) in flight per type  {time.perf_counter() - start:>7.2f} s  '
+              f'{len(records)} devices')
+
+    # Devices decoded from the listing, the way a worker would otherwise keep them
+    pages = {t: json.dumps(listed) for t, listed in devices.items()}
+    raw, raw_bytes = traced(lambda: {d['serial']: d for t in pages for d in json.loads(pages[t])})
+    compact, compact_bytes = traced(lambda: {d['serial']: DeviceRecord.from_central(t, d)
+                                             for t in pages for d in json.loads(pages[t])})
+    scale = 100000 / args.devices
+    print(f'memory   raw Central dicts    {raw_bytes * scale / 2 ** 20:>7.1f} MB per 100k devices '
+          f'({raw_bytes / args.devices:.0f} B/device)')
+    print(f'memory   compact records      {compact_bytes * scale / 2 ** 20:>7.1f} MB per 100k devices '
+          f'({compact_bytes / args.devices:.0f} B/device)')
+    del raw
+
+    index = DeviceIndex(None, conn, page_size=args.page_size)
+    index._index = compact
+    serials = rng.choices(list(compact), k=args.lookups)
+    print(f'lookup   in memory            {per_lookup(index.lookup, serials) * 1e9:>9.0f} ns')
+
+    if args.redis:
+        import redis.asyncio as aioredis
+        r = aioredis.StrictRedis.from_url(args.redis, decode_responses=True)
+        index = DeviceIndex(r, conn, key='bench:devices', page_size=args.page_size, max_parallel_pages=args.parallel)
+        start = time.perf_counter()
+        await index.resync()
+        print(f'resync   listing and Redis    {time.perf_counter() - start:>7.2f} s')
+        usage = await r.memory_usage(index.key, samples=0)
+        print(f'redis    hash                 {usage * scale / 2 ** 20:>7.1f} MB per 100k devices')
+        sample = serials[:args.remote_lookups]
+        index._index = {}
+        start = time.perf_counter()
+        for serial in sample:
+            await index.get(serial)
+        print(f'lookup   Redis                {(time.perf_counter() - start) / len(sample) * 1e6:>9.0f} us')
+        start = time.perf_counter()
+        await index.load()
+        print(f'load     from Redis           {time.perf_counter() - start:>7.2f} s')
+        await r.delete(index.key)
+        await r.close()
+
+    index = DeviceIndex(None, conn)
+    sample = serials[:args.remote_lookups]
+    start = time.perf_counter()
+    for serial in sample:
+        await asyncio.to_thread(index._get_details, serial)
+    print(f'lookup   Central per device   {(time.perf_counter() - start) / len(sample) * 1e6:>9.0f} us')
+    central.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--switch-share', type=float, default=0.2)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--parallel', type=int, default=4, help='Pages in flight per device type')
+    parser.add_argument('--latency', type=float, default=0.1, help='Seconds per mock Central call')
+    parser.add_argument('--lookups', type=int, default=1000000, help='In-memory lookups timed')
+    parser.add_argument('--remote-lookups', type=int, default=200, help='Redis and Central lookups timed')
+    parser.add_argument('--redis', help='Scratch Redis URL for the shared hash')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Rollout burst of new-device alerts: one add-device call per device vs DeviceOnboarder batches.
+
+A mock device inventory API takes --latency seconds per call. A batch holding
+a serial starting with BAD or a device without a MAC address is refused as a
+whole with a 400, like Central does, serials starting with BLK come back in
+blocked_device, and --flaky of the calls fail with a 503.
+
+    python -m benchmarks.device_onboarding --devices 500 --batch-limit 50
+"""
+import time
+import random
+import asyncio
+import argparse
+from helpers.central_utils.device_inventory import DeviceOnboarder
+from benchmarks.mock_central import MockCentral, MockConn
+
+
+def inventory_route(flaky: float):
+    def add_devices(path, query, body):
+        serials = [device['serial'] for device in body]
+        if random.random() < flaky:
+            return 503, {'description': 'Service unavailable'}
+        if any(serial.startswith('BAD') for serial in serials) or not all(device.get('mac') for device in body):
+            return 400, {'description': 'Invalid serial in request'}
+        blocked = [{'serial': serial} for serial in serials if serial.startswith('BLK')]
+        return 200, {'code': 'ATHENA_ERROR_NO_ERROR', 'extra': {'message': {'blocked_device': blocked}}}
+    return add_devices
+
+
+async def burst(onboarder, serials):
+    onboarder.start()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(onboarder.submit(serial, mac) for serial, mac in serials))
+    elapsed = time.perf_counter() - start
+    await onboarder.stop()
+    outcomes = {}
+    for result in results:
+        outcomes[result['outcome']] = outcomes.get(result['outcome'], 0) + 1
+    return elapsed, outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--batch-limit', type=int, default=50)
+    parser.add_argument('--window', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--bad', type=int, default=3)
+    parser.add_argument('--blocked', type=int, default=5)
+    parser.add_argument('--flaky', type=float, default=0.05)
+    args = parser.parse_args()
+
+    serials = [f'CN{i:08d}' for i in range(args.devices - args.bad - args.blocked)]
+    serials += [f'BAD{i:07d}' for i in range(args.bad)] + [f'BLK{i:07d}' for i in range(args.blocked)]
+    random.shuffle(serials)
+    serials = [(serial, f'20:4c:03:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}') for i, serial in enumerate(serials)]
+
+    for name, batch_limit, window in (('per-device', 1, 0), ('batched', args.batch_limit, args.window)):
+        central = MockCentral(latency=args.latency).start()
+        central.route('POST', '/platform/device_inventory/v1/devices', inventory_route(args.flaky))
+        onboarder = DeviceOnboarder(MockConn(central.url), batch_limit=batch_limit, window=window,
+                                    backoff=0.1, max_inflight=2)
+        elapsed, outcomes = asyncio.run(burst(onboarder, serials))
+        central.stop()
+        stats = onboarder.stats()
+        print(f'{name:<11} {args.devices / elapsed:>7.1f} devices/s  {stats["calls"]:>4} calls  '
+              f'{stats["splits"]:>3} splits  {stats["retries"]:>3} retries  {outcomes}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Per-stage cost of ingesting a large Netbox webhook, legacy vs single-parse.
+
+The legacy path mirrors what the receiver used to do: FastAPI parses the body
+into WebhookData, the body is decoded to str and json.loads runs again in the
+matcher. The new path verifies the HMAC over the raw bytes and parses once.
+
+    python -m benchmarks.ingest_pipeline --size-kb 500
+"""
+import json
+import hmac
+import argparse
+from helpers import fast_json
+from helpers.stage_timer import StageTimer
+
+try:
+    from pydantic import BaseModel
+except ImportError:
+    BaseModel = None
+
+SECRET = b'netbox-bench-secret'
+
+
+def device_snapshot(size_kb: int) -> dict:
+    interfaces = []
+    while len(json.dumps(interfaces)) < size_kb * 1024 // 3:
+        i = len(interfaces)
+        interfaces.append({'id': i, 'name': f'1/1/{i}', 'enabled': True, 'mtu': 9198,
+                           'description': f'uplink {i} to core', 'tags': [{'name': 'access'}, {'name': f'vlan{i % 40}'}]})
+    return {'id': 1, 'name': 'JA-AP-01', 'serial': 'CNBRHMV3HG', 'device_role': {'name': 'Access Point'},
+            'device_type': {'model': 'AP-515'}, 'custom_fields': {'central_subscription': 'advanced'},
+            'last_updated': '2023-01-01T00:00:00Z', 'interfaces': interfaces}
+
+
+def netbox_payload(size_kb: int) -> bytes:
+    prechange = device_snapshot(size_kb)
+    postchange = dict(prechange, name='JA-AP-02')
+    body = {'event': 'updated', 'model': 'device', 'username': 'admin',
+            'timestamp': '2023-01-01T00:00:00Z', 'request_id': '1b0c7e5e-6f43-4f1c-9a55-1f3b0f2a4b6e',
+            'data': postchange, 'snapshots': {'prechange': prechange, 'postchange': postchange}}
+    return json.dumps(body).encode('utf-8')
+
+
+if BaseModel:
+    class WebhookData(BaseModel):
+        event: str = None
+        model: str = None
+        username: str = None
+        data: dict = None
+        snapshots: dict = None
+
+
+def legacy(raw: bytes, signature: str, timer: StageTimer):
+    with timer.stage('model'):
+        body = json.loads(raw)
+        if BaseModel:
+            WebhookData(**body)
+    with timer.stage('hmac'):
+        hmac.compare_digest(hmac.new(SECRET, msg=raw, digestmod='sha512').hexdigest(), signature)
+    with timer.stage('parse'):
+        body = json.loads(raw.decode('utf-8'))
+    return body
+
+
+def single_parse(raw: bytes, signature: str, timer: StageTimer):
+    with timer.stage('hmac'):
+        hmac.compare_digest(hmac.new(SECRET, msg=raw, digestmod='sha512').hexdigest(), signature)
+    with timer.stage('parse'):
+        body = fast_json.loads(raw)
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-kb', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    raw = netbox_payload(args.size_kb)
+    signature = hmac.new(SECRET, msg=raw, digestmod='sha512').hexdigest()
+    print(f'payload {len(raw) / 1024:.0f} KB, json backend {fast_json.BACKEND}, pydantic {bool(BaseModel)}')
+    for name, pipeline in (('legacy', legacy), ('single', single_parse)):
+        timer = StageTimer()
+        for _ in range(args.iterations):
+            with timer.stage('total'):
+                pipeline(raw, signature, timer)
+        for stage, numbers in timer.stats().items():
+            print(f'{name:<8} {stage:<8} avg {numbers["avg_ms"]:>8.3f} ms  max {numbers["max_ms"]:>8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
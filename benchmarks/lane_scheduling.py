@@ -0,0 +1,125 @@
+"""High priority latency under a bulk flood, with and without priority lanes.
+
+Each scenario preloads --bulk bulk alerts, then writes a steady rate of high
+priority alerts while they drain. The handler sleeps --work-ms to stand in
+for a Netbox or Central call, with --concurrency in flight, like the site
+worker. Runs each scenario twice:
+
+    fifo   every alert on one stream, read with StreamConsumer, the way the
+           workers ran before lanes
+    lanes  high and bulk alerts on their lane streams, read with LaneConsumer
+
+and reports the time from XADD to handled for each lane. The second scenario
+sends high alerts faster than they can be handled, to show the bulk lane
+still gets its weighted share; bulk entries buffered for --max-wait go first
+whatever the weights, counted as aged. Use a disposable Redis database.
+
+    python -m benchmarks.lane_scheduling --redis redis://localhost:6379/0
+    python -m benchmarks.lane_scheduling --bulk 5000 --high-rate 20 --work-ms 10
+"""
+import time
+import asyncio
+import argparse
+import redis.asyncio as aioredis
+from helpers.lanes import LANES, lane_key, parse_weights
+from helpers.stream_consumer import StreamConsumer, LaneConsumer
+
+STREAM = 'bench:lane:alert'
+GROUP = 'bench'
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+async def reset(r):
+    await r.delete(*(lane_key(STREAM, lane) for lane in LANES))
+
+
+async def scenario(r, args, laned: bool, bulk: int, high_rate: float, duration: float) -> dict:
+    await reset(r)
+    stream_of = (lambda lane: lane_key(STREAM, lane)) if laned else (lambda lane: STREAM)
+    pipe = r.pipeline(transaction=False)
+    for i in range(bulk):
+        pipe.xadd(stream_of('bulk'), {'lane': 'bulk', 'key': f'bulk-{i}', 't': repr(time.time())})
+    await pipe.execute()
+    high = int(high_rate * duration)
+    waits = {'high': [], 'bulk': []}
+    finished = {}
+
+    async def handler(entry_id, fields, lane=None):
+        await asyncio.sleep(args.work_ms / 1000)
+        waits[fields['lane']].append(time.time() - float(fields['t']))
+        if len(waits[fields['lane']]) == (high if fields['lane'] == 'high' else bulk):
+            finished[fields['lane']] = time.perf_counter()
+
+    options = dict(batch_size=args.batch_size, concurrency=args.concurrency, block_ms=100,
+                   key_func=lambda fields: fields['key'])
+    if laned:
+        consumer = LaneConsumer(r, STREAM, GROUP, 'bench-1', handler, weights=parse_weights(args.weights),
+                                max_wait=args.max_wait, **options)
+    else:
+        consumer = StreamConsumer(r, STREAM, GROUP, 'bench-1', handler, **options)
+
+    async def produce():
+        start = time.perf_counter()
+        for i in range(high):
+            await asyncio.sleep(max(0.0, start + i / high_rate - time.perf_counter()))
+            await r.xadd(stream_of('high'), {'lane': 'high', 'key': f'high-{i}', 't': repr(time.time())})
+
+    async def stop_when_drained():
+        while len(finished) < 2:
+            await asyncio.sleep(0.01)
+        consumer.stop()
+
+    start = time.perf_counter()
+    await asyncio.gather(consumer.run(), produce(), stop_when_drained())
+    result = {lane: {'p50': percentile(w, 50), 'p99': percentile(w, 99), 'max': max(w),
+                     'drained': finished[lane] - start} for lane, w in waits.items()}
+    if laned:
+        result['aged'] = consumer.counters['bulk_aged']
+    await reset(r)
+    return result
+
+
+def report(name: str, mode: str, result: dict, bulk: int):
+    high, slow = result['high'], result['bulk']
+    aged = f"  {result['aged']} bulk aged" if 'aged' in result else ''
+    print(f'{name:<12} {mode:<5}  high p50 {high["p50"] * 1000:>7.0f} ms  p99 {high["p99"] * 1000:>7.0f} ms  '
+          f'max {high["max"] * 1000:>7.0f} ms   bulk max {slow["max"]:>6.2f} s  '
+          f'{bulk / slow["drained"]:>6.0f}/s{aged}')
+
+
+async def run(args):
+    r = aioredis.StrictRedis.from_url(args.redis, decode_responses=True)
+    capacity = args.concurrency / (args.work_ms / 1000)
+    # The flood takes about this long to drain at full capacity
+    flood_seconds = args.bulk / capacity
+    print(f'capacity {capacity:.0f} alerts/s ({args.concurrency} in flight, {args.work_ms:.0f} ms each), '
+          f'weights {parse_weights(args.weights)}, max wait {args.max_wait:.0f} s')
+    scenarios = (
+        ('bulk flood', args.bulk, args.high_rate, flood_seconds),
+        ('high flood', args.bulk // 10, capacity * 1.25, args.max_wait * 2),
+    )
+    for name, bulk, high_rate, duration in scenarios:
+        for mode in ('fifo', 'lanes'):
+            report(name, mode, await scenario(r, args, mode == 'lanes', bulk, high_rate, duration), bulk)
+    await r.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bulk', type=int, default=3000, help='Bulk alerts queued before the high ones')
+    parser.add_argument('--high-rate', type=float, default=10, help='High priority alerts per second')
+    parser.add_argument('--work-ms', type=float, default=20, help='Handler time per alert')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--weights', default='', help='Lane weights. Example: high=8,normal=3,bulk=1')
+    parser.add_argument('--max-wait', type=float, default=5.0)
+    parser.add_argument('--redis', default='redis://localhost:6379/0')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""Load and throughput suite for the webhook receiver and the workers.
+
+Needs a local, disposable Redis: stream and delivery keys are deleted before
+every run. Key Vault, Netbox and Central are replaced by the stand-ins in
+benchmarks/load/standins.py.
+
+    python -m benchmarks.load inprocess --requests 5000 --concurrency 50
+    python -m benchmarks.load http --requests 5000 --concurrency 50 --workers 4
+    python -m benchmarks.load startup --workers 4
+    python -m benchmarks.load scaling --scale 1 2 4 --client-processes 4
+    python -m benchmarks.load e2e --sites 200
+    python -m benchmarks.load compare [--baseline <commit>]
+
+inprocess calls the FastAPI app directly, http runs it under uvicorn in its
+own process (--workers forked processes), e2e runs the receiver, cmdb and
+site workers as processes and measures from each Netbox site webhook to the
+site call reaching Central. startup times the receiver from launch to the
+first answered request and counts its Key Vault calls; scaling repeats the
+http run for each number of workers in --scale.
+Every run is appended to benchmarks/results/load.jsonl with the commit it
+ran on; compare shows the latest run of each scenario against an earlier one.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from benchmarks.load import webhooks, results
+from benchmarks.load.client import (AsgiDriver, HttpDriver, drive, drive_processes, percentile, memory_mb,
+                                    tree_memory_mb)
+from benchmarks.load.standins import install_keyvault, NetboxStandin, CentralStandin
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+BENCH_KEYS = ('cmdb:alert', 'site:alert', 'device:alert', 'config:alert', 'device:result', 'central:sites')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def keyvault(args, netbox_url: str = 'http://127.0.0.1:1') -> dict:
+    return dict(webhooks.SECRETS, **{'redis-server': args.redis_host, 'redis-password': args.redis_password,
+                                     'netbox-url': netbox_url})
+
+
+def service_env(args, secrets: dict, log_dir: str, **extra) -> dict:
+    env = dict(os.environ,
+               AZURE_KEYVAULT_URL='https://bench.vault.azure.net/',
+               BENCH_KEYVAULT=json.dumps(secrets),
+               REDIS_PORT=str(args.redis_port), REDIS_SSL='false',
+               LOG_SINKS='file', LOG_DIR=log_dir, LOG_LEVEL=args.log_level,
+               COALESCE_WINDOW=str(args.coalesce_window),
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+
+def reset_redis(args):
+    import redis
+    r = redis.StrictRedis(host=args.redis_host, port=args.redis_port, password=args.redis_password or None)
+    patterns = ('webhook:delivery:*', '*:alert:high', '*:alert:bulk', '*:alert:dead', '*:alert:*:dead', 'address:*')
+    keys = list(BENCH_KEYS) + [k for pattern in patterns for k in r.scan_iter(pattern, count=1000)]
+    if keys:
+        r.delete(*keys)
+    r.close()
+
+
+def start_service(name: str, env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, '-m', 'benchmarks.load.service', name], cwd=ROOT, env=env)
+
+
+async def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Service exited with {process.returncode} before listening on {port}')
+        try:
+            _reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f'Nothing listening on {port} after {timeout}s')
+
+
+def stop(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def run_inprocess(args, config: dict) -> dict:
+    log_dir = tempfile.mkdtemp(prefix='bench-logs-')
+    os.environ.update({k: v for k, v in service_env(args, keyvault(args), log_dir).items()
+                       if k != 'PYTHONPATH'})
+    install_keyvault(keyvault(args))
+    from webhook_receiver.main import app
+    driver = AsgiDriver(app)
+    async with driver.lifespan():
+        await drive(driver, webhooks.webhook_mix(args.warmup, args.netbox_kb, seed=2), args.concurrency)
+        load = await drive(driver, webhooks.webhook_mix(args.requests, args.netbox_kb), args.concurrency)
+    return dict(load, **memory_mb())
+
+
+async def wait_until_serving(port: int, process: subprocess.Popen, timeout: float = 60):
+    """Wait for a receiver worker to answer, a pre-fork parent accepts connections before that."""
+    await wait_for_port(port, process, timeout)
+    driver = HttpDriver('127.0.0.1', port)
+    try:
+        # No sender headers, answered without Redis or Key Vault
+        await asyncio.wait_for(driver.request({}, b'{}'), timeout)
+    finally:
+        await driver.close()
+
+
+async def run_http(args, config: dict) -> dict:
+    log_dir = tempfile.mkdtemp(prefix='bench-logs-')
+    port = free_port()
+    receiver = start_service('webhook', service_env(args, keyvault(args), log_dir, BENCH_PORT=port,
+                                                    WEB_CONCURRENCY=args.workers))
+    try:
+        await wait_until_serving(port, receiver)
+        # Let every worker finish its startup
+        await asyncio.sleep(0.5 if args.workers > 1 else 0)
+        warmup = webhooks.webhook_mix(args.warmup, args.netbox_kb, seed=2)
+        mix = webhooks.webhook_mix(args.requests, args.netbox_kb)
+        if args.client_processes > 1:
+            await drive_processes('127.0.0.1', port, warmup, args.concurrency, args.client_processes)
+            load = await drive_processes('127.0.0.1', port, mix, args.concurrency, args.client_processes)
+        else:
+            driver = HttpDriver('127.0.0.1', port)
+            await drive(driver, warmup, args.concurrency)
+            load = await drive(driver, mix, args.concurrency)
+            await driver.close()
+        return dict(load, workers=args.workers, **tree_memory_mb(receiver.pid))
+    finally:
+        stop([receiver])
+
+
+async def run_startup(args, config: dict) -> dict:
+    """Import time of the receiver module, time from launch to the first answered request and Key Vault calls."""
+    log_dir = tempfile.mkdtemp(prefix='bench-logs-')
+    env = service_env(args, keyvault(args), log_dir)
+    imports, ready, calls = [], [], []
+    for i in range(args.repeat):
+        timed = subprocess.run([sys.executable, '-c', 'import time; start = time.perf_counter(); '
+                                'import webhook_receiver.main; print(time.perf_counter() - start)'],
+                               cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        imports.append(float(timed.stdout.strip().splitlines()[-1]))
+
+        call_log = os.path.join(log_dir, f'keyvault-{i}.log')
+        port = free_port()
+        start = time.perf_counter()
+        receiver = start_service('webhook', dict(env, BENCH_PORT=str(port), WEB_CONCURRENCY=str(args.workers),
+                                                 BENCH_KEYVAULT_LATENCY=str(args.keyvault_latency),
+                                                 BENCH_KEYVAULT_LOG=call_log))
+        try:
+            await wait_until_serving(port, receiver)
+            ready.append(time.perf_counter() - start)
+            # Workers that were not the first to answer finish their startup too
+            await asyncio.sleep(1)
+            with open(call_log) as f:
+                calls.append(sum(1 for _ in f))
+        finally:
+            stop([receiver])
+    return {
+        'workers': args.workers,
+        'import_ms': round(percentile(imports, 50) * 1000, 1),
+        'ready_p50_ms': round(percentile(ready, 50) * 1000, 1),
+        'ready_max_ms': round(max(ready) * 1000, 1),
+        'keyvault_calls': max(calls),
+    }
+
+
+async def run_scaling(args, config: dict) -> dict:
+    """The http scenario for each number of workers, with speedup and efficiency against the first."""
+    runs = {}
+    for workers in args.scale:
+        args.workers = workers
+        runs[f'workers_{workers}'] = await run_http(args, config)
+    base = next(iter(runs.values()))
+    base_workers = args.scale[0]
+    for run in runs.values():
+        run['speedup'] = round(run['req_per_s'] / base['req_per_s'], 2) if base['req_per_s'] else 0.0
+        run['efficiency'] = round(run['speedup'] * base_workers / run['workers'], 2)
+    return runs
+
+
+async def run_e2e(args, config: dict) -> dict:
+    log_dir = tempfile.mkdtemp(prefix='bench-logs-')
+    netbox = NetboxStandin(latency=args.netbox_latency).start()
+    central = CentralStandin(latency=args.central_latency).start()
+    creds = central.creds_file(os.path.join(log_dir, 'central.json'))
+    secrets = keyvault(args, netbox.url)
+    port = free_port()
+    common = dict(CENTRAL_CREDS_FILE=creds, CENTRAL_RATE_PER_SECOND=args.central_rate, CENTRAL_DAILY_LIMIT=0)
+    processes = {
+        'webhook': start_service('webhook', service_env(args, secrets, log_dir, BENCH_PORT=port, **common)),
+        'cmdb': start_service('cmdb', service_env(args, secrets, log_dir, METRICS_PORT=free_port(), **common)),
+        'site': start_service('site', service_env(args, secrets, log_dir, METRICS_PORT=free_port(), **common)),
+    }
+    try:
+        await wait_for_port(port, processes['webhook'])
+        driver = HttpDriver('127.0.0.1', port)
+        names = [f'Bench Site {i}' for i in range(args.sites)]
+        deliveries = [webhooks.netbox_webhook(webhooks.netbox_site('created', name)) for name in names]
+        sent = {}
+        queue = list(zip(names, deliveries))
+        latencies, statuses = [], {}
+
+        async def sender():
+            while queue:
+                name, (headers, body) = queue.pop()
+                sent[f'JA {name}'] = time.time()
+                start = time.perf_counter()
+                status = await driver.request(headers, body)
+                latencies.append(time.perf_counter() - start)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(args.concurrency)))
+        send_seconds = time.perf_counter() - start
+        deadline = time.monotonic() + args.timeout
+        while len(set(central.arrivals) & set(sent)) < len(sent) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await driver.close()
+        elapsed = time.perf_counter() - start
+        e2e = [central.arrivals[name][0][1] - sent[name] for name in sent if name in central.arrivals]
+        return {
+            'requests': len(names),
+            'req_per_s': round(len(names) / send_seconds, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'statuses': statuses,
+            'completed': len(e2e),
+            'events_per_s': round(len(e2e) / elapsed, 1),
+            'e2e_p50_ms': round(percentile(e2e, 50) * 1000, 1),
+            'e2e_p99_ms': round(percentile(e2e, 99) * 1000, 1),
+            'memory': {name: memory_mb(process.pid) for name, process in processes.items()},
+        }
+    finally:
+        stop(processes.values())
+        netbox.stop()
+        central.stop()
+
+
+SCENARIOS = {'inprocess': run_inprocess, 'http': run_http, 'e2e': run_e2e, 'startup': run_startup,
+             'scaling': run_scaling}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenario', choices=list(SCENARIOS) + ['compare'])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=1, help='Receiver worker processes (WEB_CONCURRENCY)')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 2, 4], help='Worker counts for scaling')
+    parser.add_argument('--client-processes', type=int, default=1,
+                        help='Client processes sending the http load, one client tops out before several workers')
+    parser.add_argument('--repeat', type=int, default=5, help='Receiver launches timed by startup')
+    parser.add_argument('--keyvault-latency', type=float, default=0.05, help='Seconds per Key Vault call')
+    parser.add_argument('--sites', type=int, default=200)
+    parser.add_argument('--netbox-kb', type=int, default=20, help='Size of Netbox device update snapshots')
+    parser.add_argument('--coalesce-window', type=float, default=0.0)
+    parser.add_argument('--central-rate', type=float, default=1000)
+    parser.add_argument('--central-latency', type=float, default=0.02)
+    parser.add_argument('--netbox-latency', type=float, default=0.005)
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for e2e events')
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--redis-password', default='')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--baseline', help='Commit to compare against, default the previous run')
+    parser.add_argument('--no-store', action='store_true', help='Do not append the result to the results file')
+    args = parser.parse_args()
+
+    if args.scenario == 'compare':
+        results.compare(args.baseline)
+        return
+    config = {k: v for k, v in vars(args).items() if k not in ('scenario', 'redis_password', 'baseline', 'no_store')}
+    if args.scenario != 'startup':
+        reset_redis(args)
+    result = asyncio.run(SCENARIOS[args.scenario](args, config))
+    print(json.dumps(result, indent=2))
+    if not args.no_store:
+        record = results.store(args.scenario, config, result)
+        print(f'Stored as {record["scenario"]} at {record["commit"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Drivers sending webhooks to the receiver in-process (ASGI) or over HTTP, and load statistics."""
+import os
+import time
+import asyncio
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+
+class AsgiDriver(object):
+    """Call an ASGI app directly, without a server or sockets."""
+    def __init__(self, app, path: str = '/webhook'):
+        self.app = app
+        self.path = path
+
+    @asynccontextmanager
+    async def lifespan(self):
+        """Run the app's startup handlers, then its shutdown handlers on exit."""
+        started, shutdown, stopped = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        failures = []
+
+        async def receive():
+            if not started.is_set():
+                return {'type': 'lifespan.startup'}
+            await shutdown.wait()
+            return {'type': 'lifespan.shutdown'}
+
+        async def send(message):
+            if message['type'].endswith('.failed'):
+                failures.append(message.get('message'))
+            if message['type'].startswith('lifespan.startup'):
+                started.set()
+            elif message['type'].startswith('lifespan.shutdown'):
+                stopped.set()
+
+        task = asyncio.create_task(self.app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, receive, send))
+        await started.wait()
+        if failures:
+            raise RuntimeError(f'Application startup failed: {failures[0]}')
+        try:
+            yield self
+        finally:
+            shutdown.set()
+            await stopped.wait()
+            await task
+
+    async def request(self, headers: dict, body: bytes):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+            'scheme': 'http', 'path': self.path, 'raw_path': self.path.encode(), 'root_path': '',
+            'query_string': b'', 'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 5000),
+            'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()] +
+                       [(b'content-length', str(len(body)).encode())],
+        }
+        sent = False
+        done = asyncio.Event()
+        status = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                done.set()
+
+        await self.app(scope, receive, send)
+        done.set()
+        return status[0] if status else 0
+
+    async def close(self):
+        pass
+
+
+class HttpDriver(object):
+    """Minimal HTTP/1.1 keep-alive client, one connection per concurrent sender."""
+    def __init__(self, host: str, port: int, path: str = '/webhook'):
+        self.host = host
+        self.port = port
+        self.path = path
+        self._idle = []
+
+    async def _connection(self):
+        if self._idle:
+            return self._idle.pop()
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, headers: dict, body: bytes):
+        reader, writer = await self._connection()
+        head = [f'POST {self.path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(body)}']
+        head += [f'{k}: {v}' for k, v in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        if length:
+            await reader.readexactly(length)
+        self._idle.append((reader, writer))
+        return int(status_line.split()[1]) if status_line else 0
+
+    async def close(self):
+        for _reader, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def send_all(driver, webhooks: list, concurrency: int):
+    """Send every webhook with ``concurrency`` senders, return (latencies, status counts)."""
+    queue = list(reversed(webhooks))
+    latencies, statuses = [], {}
+
+    async def sender():
+        while queue:
+            _kind, headers, body = queue.pop()
+            start = time.perf_counter()
+            status = await driver.request(headers, body)
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    return latencies, statuses
+
+
+def summarize(latencies: list, statuses: dict, elapsed: float) -> dict:
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'req_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(max(latencies, default=0) * 1000, 3),
+        'statuses': statuses,
+    }
+
+
+async def drive(driver, webhooks: list, concurrency: int) -> dict:
+    """Send every webhook with ``concurrency`` senders and summarise the run.
+
+    :param webhooks: [(kind, headers, raw body)] as built by :func:`webhook_mix`.
+    :return: requests, seconds, req_per_s, p50_ms, p99_ms, max_ms and status counts.
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    latencies, statuses = await send_all(driver, webhooks, concurrency)
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def _drive_http(host: str, port: int, webhooks: list, concurrency: int):
+    async def run():
+        driver = HttpDriver(host, port)
+        try:
+            return await send_all(driver, webhooks, concurrency)
+        finally:
+            await driver.close()
+    return asyncio.run(run())
+
+
+async def drive_processes(host: str, port: int, webhooks: list, concurrency: int, processes: int) -> dict:
+    """Like :func:`drive` over HTTP, with the senders split across ``processes`` client processes.
+
+    One Python client tops out before a receiver running on several cores does.
+    """
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as pool:
+        # Start the client processes before the clock does
+        await asyncio.gather(*(loop.run_in_executor(pool, time.sleep, 0.05) for _ in range(processes)))
+        start = time.perf_counter()
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(pool, _drive_http, host, port, webhooks[i::processes],
+                                 max(1, concurrency // processes))
+            for i in range(processes)))
+        elapsed = time.perf_counter() - start
+    latencies, statuses = [], {}
+    for part_latencies, part_statuses in parts:
+        latencies.extend(part_latencies)
+        for status, count in part_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return summarize(latencies, statuses, elapsed)
+
+
+def memory_mb(pid: int = None) -> dict:
+    """Current and peak resident memory of a process in MB (Linux /proc, else peak of this process)."""
+    try:
+        with open(f'/proc/{pid or os.getpid()}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return {'rss_mb': round(int(fields['VmRSS'].split()[0]) / 1024, 1),
+                'peak_mb': round(int(fields['VmHWM'].split()[0]) / 1024, 1)}
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return {'rss_mb': None, 'peak_mb': round(peak, 1)}
+
+
+def child_pids(pid: int) -> list:
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def tree_memory_mb(pid: int) -> dict:
+    """:func:`memory_mb` summed over a process and its children, for the pre-fork receiver."""
+    pids = [pid] + child_pids(pid)
+    usage = [memory_mb(p) for p in pids]
+    if any(u['rss_mb'] is None for u in usage):
+        return memory_mb(pid)
+    return {'rss_mb': round(sum(u['rss_mb'] for u in usage), 1),
+            'peak_mb': round(sum(u['peak_mb'] for u in usage), 1), 'processes': len(pids)}
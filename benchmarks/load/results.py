@@ -0,0 +1,76 @@
+"""Load suite results, appended per run and compared across commits."""
+import os
+import json
+import time
+import subprocess
+
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), '..', 'results', 'load.jsonl')
+# Metrics compared between runs and whether higher is better
+COMPARED = {'req_per_s': True, 'p50_ms': False, 'p99_ms': False, 'e2e_p50_ms': False, 'e2e_p99_ms': False,
+            'rss_mb': False, 'peak_mb': False, 'import_ms': False, 'ready_p50_ms': False, 'ready_max_ms': False,
+            'keyvault_calls': False, 'speedup': True, 'efficiency': True}
+
+
+def git_revision() -> str:
+    """Short commit id of the working tree, with +dirty when it has local changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True).stdout.strip()
+        return f'{commit}+dirty' if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def flatten(result: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def store(scenario: str, config: dict, result: dict, path: str = RESULTS_FILE) -> dict:
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_revision(), 'scenario': scenario,
+              'config': config, 'result': result}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return record
+
+
+def load(path: str = RESULTS_FILE) -> list:
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def compare(baseline: str = None, path: str = RESULTS_FILE):
+    """Print the latest run of every scenario against ``baseline`` (a commit), or the run before it."""
+    records = load(path)
+    for scenario in dict.fromkeys(r['scenario'] for r in records):
+        runs = [r for r in records if r['scenario'] == scenario]
+        current = runs[-1]
+        if baseline:
+            before = [r for r in runs[:-1] if r['commit'].startswith(baseline)]
+        else:
+            before = runs[:-1]
+        if not before:
+            print(f'{scenario}: no earlier run to compare {current["commit"]} with')
+            continue
+        previous = before[-1]
+        print(f'{scenario}: {previous["commit"]} ({previous["time"]}) -> {current["commit"]} ({current["time"]})')
+        old, new = flatten(previous['result']), flatten(current['result'])
+        for key in new:
+            metric = key.rsplit('.', 1)[-1]
+            if metric not in COMPARED or not isinstance(old.get(key), (int, float)) or not new[key]:
+                continue
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            better = (change > 0) == COMPARED[metric]
+            flag = '' if abs(change) < 5 else ('  better' if better else '  WORSE')
+            print(f'  {key:<28} {old[key]:>10} -> {new[key]:>10}  {change:>+7.1f}%{flag}')
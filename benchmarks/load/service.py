@@ -0,0 +1,34 @@
+"""Run one service against the Key Vault stand-in, for the load suite.
+
+    BENCH_KEYVAULT='{"redis-server": "localhost", ...}' python -m benchmarks.load.service cmdb
+
+webhook is served on BENCH_PORT by WEB_CONCURRENCY worker processes; cmdb, site and device run their
+worker loop. Everything else is configured through the services' usual
+environment variables.
+"""
+import os
+import sys
+import json
+import runpy
+from benchmarks.load.standins import install_keyvault
+
+# site is not importable as a package, it shadows the standard library module
+WORKERS = {'cmdb': 'cmdb/main.py', 'site': 'site/main.py', 'device': 'device/main.py'}
+
+
+def main():
+    service = sys.argv[1]
+    install_keyvault(json.loads(os.environ['BENCH_KEYVAULT']),
+                     latency=float(os.environ.get('BENCH_KEYVAULT_LATENCY', 0)),
+                     call_log=os.environ.get('BENCH_KEYVAULT_LOG'))
+    if service == 'webhook':
+        from webhook_receiver.main import serve
+        serve(host='127.0.0.1', port=int(os.environ.get('BENCH_PORT', 5000)), log_level='warning')
+    elif service in WORKERS:
+        runpy.run_path(WORKERS[service], run_name='__main__')
+    else:
+        sys.exit(f'Unknown service {service}, expected webhook or one of {", ".join(WORKERS)}')
+
+
+if __name__ == '__main__':
+    main()
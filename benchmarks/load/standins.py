@@ -0,0 +1,187 @@
+"""Key Vault, Netbox and Central stand-ins for running the services locally.
+
+Key Vault is replaced in-process: :func:`install_keyvault` puts fake
+``azure.identity`` and ``azure.keyvault.secrets`` modules in front of the real
+ones before a service is imported. Netbox and Central are local HTTP servers
+built on class:`MockCentral`.
+"""
+import os
+import sys
+import json
+import time
+import types
+import threading
+from benchmarks.mock_central import MockCentral
+
+
+def install_keyvault(secrets: dict, latency: float = 0.0, call_log: str = None):
+    """Serve ``secrets`` to every SecretClient created from now on in this process.
+
+    :param secrets: Secret name -> value.
+    :param latency: Seconds each get_secret call takes, to mimic Key Vault.
+    :param call_log: File every get_secret call is appended to as "pid name",
+        so calls can be counted across processes.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+
+    class KeyVaultSecret(object):
+        def __init__(self, name, value):
+            self.name = name
+            self.value = value
+
+    class SecretClient(object):
+        calls = 0
+
+        def __init__(self, vault_url=None, credential=None, **kwargs):
+            self.vault_url = vault_url
+
+        def get_secret(self, name, version=None, **kwargs):
+            SecretClient.calls += 1
+            if call_log:
+                with open(call_log, 'a') as f:
+                    f.write(f'{os.getpid()} {name}\n')
+            if latency:
+                time.sleep(latency)
+            if name not in secrets:
+                raise ResourceNotFoundError(f'A secret with (name/id) {name} was not found in this key vault')
+            return KeyVaultSecret(name, secrets[name])
+
+    class DefaultAzureCredential(object):
+        def __init__(self, **kwargs):
+            pass
+
+    identity = types.ModuleType('azure.identity')
+    identity.DefaultAzureCredential = DefaultAzureCredential
+    keyvault = types.ModuleType('azure.keyvault')
+    keyvault_secrets = types.ModuleType('azure.keyvault.secrets')
+    keyvault_secrets.SecretClient = SecretClient
+    keyvault.secrets = keyvault_secrets
+    sys.modules.update({'azure.identity': identity, 'azure.keyvault': keyvault,
+                        'azure.keyvault.secrets': keyvault_secrets})
+    return SecretClient
+
+
+class NetboxStandin(object):
+    """Netbox REST API answering object lookups by name, and paginated listings, from a dict."""
+    def __init__(self, latency: float = 0.005):
+        self.objects = {}
+        self.server = MockCentral(latency=latency)
+        self.server.route('GET', '/api/', self._lookup)
+
+    @property
+    def url(self):
+        return self.server.url
+
+    def add(self, model: str, obj: dict):
+        """Serve ``obj`` for ``model`` (Example: dcim/sites) lookups by its name."""
+        self.objects[(model, obj['name'])] = obj
+
+    def _lookup(self, path, query, body):
+        model = path[len('/api/'):].strip('/')
+        if 'name' not in query:
+            return self._list(model, query)
+        obj = self.objects.get((model, query.get('name')))
+        results = [obj] if obj else []
+        return 200, {'count': len(results), 'next': None, 'previous': None, 'results': results}
+
+    def _list(self, model, query):
+        objects = [obj for (obj_model, _), obj in self.objects.items() if obj_model == model]
+        offset, limit = int(query.get('offset', 0)), int(query.get('limit', 50))
+        end = offset + limit
+        next_url = f'{self.url}/api/{model}/?limit={limit}&offset={end}' if end < len(objects) else None
+        return 200, {'count': len(objects), 'next': next_url, 'previous': None, 'results': objects[offset:end]}
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop()
+
+
+class CentralStandin(object):
+    """Central site API that records when each site call arrives.
+
+    ``arrivals`` maps site name -> list of (method, epoch seconds), which the
+    load suite uses for end-to-end latency. ``addresses`` keeps the
+    site_address of every site, which site listings return.
+    """
+    def __init__(self, latency: float = 0.02, rate_per_second: int = 0):
+        self.sites = {}
+        self.addresses = {}
+        self._names = {}
+        self.arrivals = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.server = MockCentral(rate_per_second=rate_per_second, latency=latency)
+        self.server.route('GET', '/central/v2/sites', self._list)
+        self.server.route('POST', '/central/v2/sites', self._create)
+        self.server.route('PATCH', '/central/v2/sites/', self._update)
+        self.server.route('DELETE', '/central/v2/sites/', self._delete)
+
+    @property
+    def url(self):
+        return self.server.url
+
+    def _arrived(self, method, name):
+        with self._lock:
+            self.arrivals.setdefault(name, []).append((method, time.time()))
+
+    def _list(self, path, query, body):
+        with self._lock:
+            sites = [dict(self.addresses.get(name, {}), site_id=site_id, site_name=name)
+                     for name, site_id in self.sites.items()]
+        offset, limit = int(query.get('offset', 0)), int(query.get('limit', 100))
+        return 200, {'sites': sites[offset:offset + limit], 'total': len(sites), 'count': len(sites)}
+
+    def _create(self, path, query, body):
+        name = body.get('site_name')
+        with self._lock:
+            site_id = self._next_id
+            self._next_id += 1
+            self.sites[name] = site_id
+            self._names[site_id] = name
+            self.addresses[name] = body.get('site_address') or {}
+        self._arrived('POST', name)
+        return 200, {'site_id': site_id, 'site_name': name}
+
+    def _name(self, path):
+        site_id = int(path.rstrip('/').rsplit('/', 1)[-1])
+        with self._lock:
+            return self._names.get(site_id)
+
+    def _update(self, path, query, body):
+        name = self._name(path)
+        if name is None:
+            return 404, {'description': 'Site not found'}
+        with self._lock:
+            self.addresses[name] = (body or {}).get('site_address') or self.addresses.get(name, {})
+        self._arrived('PATCH', name)
+        return 200, {'site_id': self.sites[name], 'site_name': name}
+
+    def _delete(self, path, query, body):
+        name = self._name(path)
+        if name is None:
+            return 404, {'description': 'Site not found'}
+        with self._lock:
+            self._names.pop(self.sites.pop(name, None), None)
+            self.addresses.pop(name, None)
+        self._arrived('DELETE', name)
+        return 200, {}
+
+    def creds_file(self, path: str, account: str = 'us-2'):
+        """Write a pycentral credentials file pointing at this stand-in."""
+        creds = {account: {'base_url': self.url, 'customer_id': 'bench', 'client_id': 'bench',
+                           'client_secret': 'bench', 'username': 'bench', 'password': 'bench',
+                           'token': {'access_token': 'bench-access-token', 'refresh_token': 'bench-refresh-token'}},
+                 'ssl_verify': False}
+        with open(path, 'w') as f:
+            json.dump(creds, f)
+        return path
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop()
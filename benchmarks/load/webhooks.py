@@ -0,0 +1,145 @@
+"""Correctly signed Central and Netbox webhooks of realistic sizes."""
+import json
+import hmac
+import time
+import uuid
+import base64
+import random
+import hashlib
+from benchmarks.ingest_pipeline import device_snapshot
+
+CUSTOMER_ID = 'bench'
+CENTRAL_TOKEN = 'bench-central-webhook-token'
+NETBOX_SECRET = 'bench-netbox-webhook-secret'
+
+# Key Vault contents the services need besides the Redis and Netbox locations
+SECRETS = {
+    f'central-{CUSTOMER_ID}-webhooktoken': CENTRAL_TOKEN,
+    'netbox-secret': NETBOX_SECRET,
+    'netbox-token': 'bench-netbox-api-token',
+}
+
+
+def sign_central(raw: bytes, service: str, delivery: str, timestamp: str, token: str = CENTRAL_TOKEN) -> str:
+    signed = hmac.new(token.encode('utf-8'), msg=raw, digestmod=hashlib.sha256)
+    signed.update((service + delivery + timestamp).encode('utf-8'))
+    return base64.b64encode(signed.digest()).decode()
+
+
+def central_webhook(body: dict) -> tuple:
+    """Return (headers, raw body) of a signed Central delivery with a fresh delivery id."""
+    raw = json.dumps(body).encode('utf-8')
+    service, delivery, timestamp = 'Alerts', str(uuid.uuid4()), str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Central-Customer-Id': CUSTOMER_ID,
+        'X-Central-Service': service,
+        'X-Central-Delivery-Id': delivery,
+        'X-Central-Delivery-Timestamp': timestamp,
+        'X-Central-Signature': sign_central(raw, service, delivery, timestamp),
+    }
+    return headers, raw
+
+
+def netbox_webhook(body: dict) -> tuple:
+    """Return (headers, raw body) of a signed Netbox delivery."""
+    raw = json.dumps(body).encode('utf-8')
+    signature = hmac.new(NETBOX_SECRET.encode(), msg=raw, digestmod='sha512').hexdigest()
+    return {'Content-Type': 'application/json', 'X-Hook-Signature': signature}, raw
+
+
+def central_alert(alert_type: str, serial: str, group: str) -> dict:
+    dev_type = 'SWITCH' if alert_type == 'New Switch connected' else 'IAP'
+    return {
+        'id': str(uuid.uuid4()),
+        'nid': 1102,
+        'alert_type': alert_type,
+        'setting_id': f'{CUSTOMER_ID}-1-{random.randint(1, 99)}',
+        'device_id': serial,
+        'description': f'{alert_type} with serial {serial} in group {group}',
+        'state': 'Open',
+        'severity': 'Minor',
+        'operation': 'create',
+        'timestamp': int(time.time()),
+        'webhook': str(uuid.uuid4()),
+        'cluster_hostname': 'internal-ui.central.arubanetworks.com',
+        'details': {
+            'group_name': group,
+            'serial': serial,
+            'dev_type': dev_type,
+            '_rule_number': '0',
+            'conn_status': 'Connected',
+            'labels': 'bench',
+            'params': 'serial,group_name,dev_type',
+            'time': time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime()),
+        },
+        'text': f'{alert_type} {serial}',
+    }
+
+
+def central_config_change(group: str) -> dict:
+    body = central_alert('DEVICE_CONFIG_CHANGE_DETECTED', 'CONFIG', group)
+    body['details'] = {'group_name': group, 'dev_type': 'IAP', '_rule_number': '0'}
+    return body
+
+
+def netbox_device_update(size_kb: int, serial: str) -> dict:
+    prechange = device_snapshot(size_kb)
+    prechange['serial'] = serial
+    postchange = dict(prechange, name=f'JA-{serial}')
+    return {'event': 'updated', 'model': 'device', 'username': 'admin', 'timestamp': '2023-01-01T00:00:00Z',
+            'request_id': str(uuid.uuid4()), 'data': postchange,
+            'snapshots': {'prechange': prechange, 'postchange': postchange}}
+
+
+def netbox_site(event: str, name: str) -> dict:
+    site = {'id': random.randint(1, 10 ** 6), 'name': name, 'slug': name.lower().replace(' ', '-'),
+            'status': {'value': 'active'}, 'region': {'name': 'Texas'}, 'time_zone': 'America/Chicago',
+            'physical_address': f'{random.randint(100, 9999)} Main St\r\nAustin, TX 78701',
+            'shipping_address': '', 'latitude': None, 'longitude': None, 'tags': [],
+            'custom_fields': {}, 'last_updated': '2023-01-01T00:00:00Z'}
+    return {'event': event, 'model': 'site', 'username': 'admin', 'timestamp': '2023-01-01T00:00:00Z',
+            'request_id': str(uuid.uuid4()), 'data': site,
+            'snapshots': {'prechange': None if event == 'created' else site, 'postchange': site}}
+
+
+# Share of each kind of webhook in a generated mix
+MIX = (
+    ('central:new_ap', 0.35),
+    ('central:new_switch', 0.05),
+    ('central:config_change', 0.10),
+    ('netbox:device_update', 0.30),
+    ('netbox:site', 0.20),
+)
+
+
+def webhook_mix(count: int, netbox_kb: int = 20, seed: int = 1) -> list:
+    """Build ``count`` signed webhooks in the proportions of :data:`MIX`.
+
+    Every delivery has its own delivery id or request id and its own serial
+    or site, so none of them is de-duplicated or coalesced.
+
+    :return: [(kind, headers, raw body)]
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    # Building a snapshot is the slow part, reuse one per size and change the serial
+    snapshot = netbox_device_update(netbox_kb, 'TEMPLATE')
+    webhooks = []
+    for i, kind in enumerate(rng.choices(kinds, weights, k=count)):
+        serial = f'BN{i:08d}'
+        match kind:
+            case 'central:new_ap':
+                headers, raw = central_webhook(central_alert('New AP detected', serial, f'group-{i % 50}'))
+            case 'central:new_switch':
+                headers, raw = central_webhook(central_alert('New Switch connected', serial, f'group-{i % 50}'))
+            case 'central:config_change':
+                headers, raw = central_webhook(central_config_change(f'group-{i}'))
+            case 'netbox:device_update':
+                body = dict(snapshot, request_id=str(uuid.uuid4()), data=dict(snapshot['data'], serial=serial))
+                headers, raw = netbox_webhook(body)
+            case 'netbox:site':
+                headers, raw = netbox_webhook(netbox_site('created', f'Bench Site {i}'))
+        webhooks.append((kind, headers, raw))
+    return webhooks
@@ -0,0 +1,72 @@
+"""Throughput cost of per-request logging, legacy sinks vs helpers.log_setup.
+
+The legacy configuration is the five synchronous sinks each service used to
+add, with headers and the full body logged at INFO on every request. The new
+configuration is setup_logging() with enqueued sinks and sampled, truncated
+payload logging.
+
+    python -m benchmarks.logging_overhead --requests 2000 --body-kb 50
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from loguru import logger
+from helpers.log_setup import setup_logging, log_payload, scrub_headers
+
+HEADERS = {'Content-Type': 'application/json', 'X-Hook-Signature': 'f' * 128, 'User-Agent': 'python-requests'}
+
+
+def legacy_sinks(log_dir):
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level='WARNING')
+    logger.add(f'{log_dir}/webhook.log')
+    logger.add(f'{log_dir}/webhook_retention.log', retention="5 days")
+    logger.add(f'{log_dir}/webhook_rotation.log', rotation="1 MB")
+    logger.add(f'{log_dir}/webhook_compressed.log', compression="zip")
+
+
+def legacy_request(body):
+    logger.info('Full header information')
+    logger.info(HEADERS)
+    logger.info('Encoded body information')
+    logger.info(body)
+    logger.info('Netbox webhook inbound')
+
+
+def new_request(body):
+    log_payload('Full header information', scrub_headers(HEADERS))
+    log_payload('Encoded body information', body)
+    logger.info('Netbox webhook inbound')
+
+
+def run(name, request, body, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        request(body)
+    elapsed = time.perf_counter() - start
+    logger.complete()
+    drained = time.perf_counter() - start
+    print(f'{name:<8} {requests / elapsed:>10.0f} req/s on the request path, '
+          f'{requests / drained:>10.0f} req/s including sink drain')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--body-kb', type=int, default=50)
+    args = parser.parse_args()
+    body = b'{"event": "updated", "data": "' + b'x' * (args.body_kb * 1024) + b'"}'
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        legacy_sinks(log_dir)
+        run('legacy', legacy_request, body, args.requests)
+        os.environ.setdefault('LOG_SINKS', 'file')
+        setup_logging('webhook', log_dir=log_dir)
+        run('new', new_request, body, args.requests)
+        logger.remove()
+
+
+if __name__ == '__main__':
+    main()
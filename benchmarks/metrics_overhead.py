@@ -0,0 +1,44 @@
+"""Per-request cost of the Prometheus instrumentation on the webhook path.
+
+Times a request's worth of instrumentation (four stage observations and one
+alert counter) against the same StageTimer without histograms, and the cost
+of a full scrape.
+
+    python -m benchmarks.metrics_overhead --requests 100000
+"""
+import time
+import argparse
+from helpers import metrics
+from helpers.stage_timer import StageTimer
+
+STAGES = ('read', 'hmac', 'match', 'enqueue')
+
+
+def per_request(timer, count, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        for stage in STAGES:
+            with timer.stage(stage):
+                pass
+        if count:
+            metrics.count_alert('central', 'New AP detected', {'key': 'device:alert'})
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100000)
+    args = parser.parse_args()
+
+    bare = per_request(StageTimer(), False, args.requests)
+    instrumented = per_request(StageTimer(observe=metrics.stage_observer('bench')), True, args.requests)
+    start = time.perf_counter()
+    body, _content_type = metrics.render()
+    scrape = time.perf_counter() - start
+    print(f'stage timer only   {bare * 1e6:>6.2f} us/request')
+    print(f'with prometheus    {instrumented * 1e6:>6.2f} us/request  (+{(instrumented - bare) * 1e6:.2f} us)')
+    print(f'scrape             {scrape * 1000:>6.2f} ms  {len(body)} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Local stand-in for the Aruba Central API, shared by the benchmarks.
+
+Enforces a per-second quota (answering 429 with Central's X-RateLimit headers
+once it is used up) and records how many calls it accepted each second.
+Routes are registered as callables returning (status, json body).
+"""
+import json
+import time
+import threading
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class MockCentral(object):
+    def __init__(self, rate_per_second: int = 0, latency: float = 0.0, port: int = 0):
+        """
+        :param rate_per_second: Calls accepted per second, 0 for no limit.
+        :param latency: Seconds every call takes.
+        :param port: Port to listen on, 0 picks a free one.
+        """
+        self.rate_per_second = rate_per_second
+        self.latency = latency
+        self.routes = []
+        self.accepted = {}
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def route(self, method: str, prefix: str, fn):
+        """Answer ``method`` calls whose path starts with ``prefix`` with ``fn(path, query, body)``."""
+        self.routes.append((method, prefix, fn))
+
+    def _admit(self):
+        second = int(time.time())
+        with self._lock:
+            used = self.accepted.get(second, 0)
+            if self.rate_per_second and used >= self.rate_per_second:
+                self.throttled += 1
+                return False, 0
+            self.accepted[second] = used + 1
+            return True, self.rate_per_second - used - 1
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _dispatch(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                allowed, remaining = mock._admit()
+                limit_headers = {'X-RateLimit-Limit-second': str(mock.rate_per_second or 1000),
+                                 'X-RateLimit-Remaining-second': str(max(remaining, 0))}
+                if not allowed:
+                    return self._reply(429, {'message': 'API rate limit exceeded'},
+                                       dict(limit_headers, **{'Retry-After': '1'}))
+                if mock.latency:
+                    time.sleep(mock.latency)
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                for route_method, prefix, fn in mock.routes:
+                    if route_method == method and url.path.startswith(prefix):
+                        status, payload = fn(url.path, query, json.loads(body) if body else None)
+                        return self._reply(status, payload, limit_headers)
+                return self._reply(200, {}, limit_headers)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PATCH(self):
+                self._dispatch('PATCH')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def max_per_second(self):
+        with self._lock:
+            return max(self.accepted.values(), default=0)
+
+
+class MockConn(object):
+    """Minimal pycentral-style connection: ``command`` returns {'code', 'msg', 'headers'}."""
+    def __init__(self, base_url: str, rate_limiter=None):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.rate_limiter = rate_limiter
+
+    def _command(self, apiMethod, apiPath, apiData=None, apiParams=None, **kwargs):
+        resp = self.session.request(apiMethod, self.base_url + apiPath, json=apiData, params=apiParams)
+        try:
+            msg = resp.json()
+        except ValueError:
+            msg = resp.text
+        return {'code': resp.status_code, 'msg': msg, 'headers': dict(resp.headers)}
+
+    def get(self):
+        """Serve as its own connection provider."""
+        return self
+
+    def command(self, *args, **kwargs):
+        if self.rate_limiter is None:
+            return self._command(*args, **kwargs)
+        return self.rate_limiter.call(lambda: self._command(*args, **kwargs))
@@ -0,0 +1,141 @@
+"""Bulk site reconciliation against local Netbox and Central stand-ins.
+
+Netbox gets --sites sites with distinct street addresses. Central starts in
+sync with it and then drifts: --drift of the sites are split between missing
+from Central, having a different address in Central and existing only in
+Central, and as many again differ from Netbox only in case and whitespace,
+which must not cost a call. Reports the time spent listing both sides,
+parsing the addresses, diffing and making the calls, checks that a second
+plan comes back empty and compares the calls made with replaying one
+webhook per site.
+
+Central calls go through CentralRateLimiter when --redis is given, so
+--quota (calls per second accepted by the stand-in) can be set; without
+Redis the stand-in is not rate limited.
+
+    python -m benchmarks.site_reconcile --sites 10000 --drift 0.05
+    python -m benchmarks.site_reconcile --sites 10000 --quota 20 --redis redis://localhost:6379/0
+"""
+import time
+import random
+import asyncio
+import argparse
+import pynetbox
+from benchmarks.address_normalize import CORPUS
+from benchmarks.mock_central import MockConn
+from benchmarks.load.standins import NetboxStandin, CentralStandin
+from helpers.address import parse_address
+from helpers.central_utils.site_reconcile import SiteReconciler, SITE_PREFIX, COUNTRY, diff_sites
+
+
+def street_address(i: int) -> str:
+    street = CORPUS[i % len(CORPUS)].split(' ', 1)[1]
+    return f'{100 + i // len(CORPUS)} {street}'
+
+
+def central_address(raw: str) -> dict:
+    return dict(parse_address(raw), country=COUNTRY)
+
+
+def seed(netbox: NetboxStandin, central: CentralStandin, sites: int, drift: float, rng: random.Random) -> dict:
+    """Fill both stand-ins and return how many sites of each kind of drift were made."""
+    for i in range(sites):
+        netbox.add('dcim/sites', {'id': i + 1, 'name': f'Branch {i:05d}', 'physical_address': street_address(i)})
+    names = [f'Branch {i:05d}' for i in range(sites)]
+    rng.shuffle(names)
+    per_kind = int(sites * drift) // 3
+    missing = set(names[:per_kind])
+    moved = set(names[per_kind:2 * per_kind])
+    cosmetic = set(names[2 * per_kind:5 * per_kind])
+    for i in range(sites):
+        name = f'Branch {i:05d}'
+        if name in missing:
+            continue
+        address = central_address(street_address(sites + i if name in moved else i))
+        if name in cosmetic:
+            address = {k: f'  {v.upper()} ' for k, v in address.items()}
+        central.sites[SITE_PREFIX + name] = i + 1
+        central._names[i + 1] = SITE_PREFIX + name
+        central.addresses[SITE_PREFIX + name] = address
+    for j in range(per_kind):
+        site_id = sites + j + 1
+        central.sites[f'{SITE_PREFIX}Closed {j:05d}'] = site_id
+        central._names[site_id] = f'{SITE_PREFIX}Closed {j:05d}'
+        central.addresses[f'{SITE_PREFIX}Closed {j:05d}'] = central_address(street_address(j))
+    # Sites not managed from Netbox are left alone
+    central.sites['Lab'] = sites + per_kind + 1
+    central._names[sites + per_kind + 1] = 'Lab'
+    central._next_id = sites + per_kind + 2
+    return {'create': per_kind, 'update': per_kind, 'delete': per_kind, 'cosmetic': len(cosmetic)}
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return time.perf_counter() - start, result
+
+
+async def run(args):
+    netbox = NetboxStandin(latency=args.netbox_latency).start()
+    central = CentralStandin(latency=args.central_latency, rate_per_second=args.quota).start()
+    expected = seed(netbox, central, args.sites, args.drift, random.Random(1))
+    limiter = None
+    if args.redis:
+        import redis
+        from helpers.central_utils.rate_limit import CentralRateLimiter
+        r = redis.StrictRedis.from_url(args.redis, decode_responses=True)
+        r.delete('central:ratelimit:bench')
+        rate = args.quota or 1000
+        limiter = CentralRateLimiter(r, customer='bench', rate=rate, burst=max(1, int(rate)), daily_limit=0)
+    conn = MockConn(central.url, limiter)
+    nb = pynetbox.api(netbox.url, token='bench')
+    reconciler = SiteReconciler(nb, conn, max_parallel_calls=args.parallel,
+                                netbox_page_size=args.page_size, page_size=args.page_size)
+
+    list_s, (netbox_sites, central_sites) = await timed(asyncio.gather(reconciler.netbox_sites(),
+                                                                       reconciler.central_sites()))
+    parse_s, (desired, invalid) = await timed(asyncio.to_thread(reconciler.desired_sites, netbox_sites))
+    start = time.perf_counter()
+    plan = diff_sites(desired, central_sites, skipped=invalid)
+    diff_s = time.perf_counter() - start
+    planned = {kind: len(plan[kind]) for kind in ('create', 'update', 'delete')}
+    print(f'{args.sites} Netbox sites, {len(central_sites)} managed Central sites, drift {expected}')
+    print(f'list   {list_s:>8.2f} s   both sides, {args.page_size} per page')
+    print(f'parse  {parse_s:>8.2f} s   {len(desired)} addresses, {len(invalid)} invalid')
+    print(f'diff   {diff_s * 1000:>8.1f} ms  plan {planned}, {plan["unchanged"]} unchanged')
+
+    apply_s, done = await timed(reconciler.apply(plan))
+    calls = sum(planned.values())
+    print(f'apply  {apply_s:>8.2f} s   {calls} calls, {calls / apply_s if apply_s else 0:.1f}/s, '
+          f'{len(done["failed"])} failed, {central.server.throttled} x 429')
+
+    central_calls = sum(central.server.accepted.values())
+    check_s, again = await timed(reconciler.run(dry_run=True))
+    left = {kind: again[kind] for kind in ('create', 'update', 'delete')}
+    total = list_s + parse_s + diff_s + apply_s
+    print(f'total  {total:>8.2f} s   second plan {left} in {check_s:.2f} s')
+    print(f'Central calls: {central_calls} reconciling, {args.sites} replaying one webhook per site')
+    ok = planned == {k: expected[k] for k in planned} and not any(left.values()) and not done['failed']
+    print('converged' if ok else 'NOT converged')
+    netbox.stop()
+    central.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sites', type=int, default=10000)
+    parser.add_argument('--drift', type=float, default=0.05, help='Share of sites created, updated or deleted')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--parallel', type=int, default=4, help='Central calls in flight at once')
+    parser.add_argument('--quota', type=int, default=0, help='Central calls per second, needs --redis')
+    parser.add_argument('--redis', help='Redis URL for the shared rate limiter bucket')
+    parser.add_argument('--netbox-latency', type=float, default=0.05)
+    parser.add_argument('--central-latency', type=float, default=0.05)
+    args = parser.parse_args()
+    if args.quota and not args.redis:
+        parser.error('--quota needs --redis, calls are only paced by the rate limiter')
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Watched-field snapshot diff vs DeepDiff(ignore_order=True) on large devices.
+
+The postchange snapshot renames the device, changes its Central subscription
+and reorders its interfaces, the kind of edit that makes an order-insensitive
+DeepDiff expensive.
+
+    python -m benchmarks.snapshot_diff --size-kb 100 500
+"""
+import time
+import argparse
+from helpers.snapshot_diff import DEVICE_WATCH, diff_fields, full_diff
+from benchmarks.ingest_pipeline import device_snapshot
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - start) / iterations, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-kb', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--iterations', type=int, default=3)
+    args = parser.parse_args()
+
+    for size_kb in args.size_kb:
+        prechange = device_snapshot(size_kb)
+        postchange = dict(prechange, name='JA-AP-02', interfaces=list(reversed(prechange['interfaces'])),
+                          custom_fields={'central_subscription': 'foundation'})
+        watched, changed = timed(lambda: diff_fields(prechange, postchange, DEVICE_WATCH), 1000)
+        deep, _ = timed(lambda: full_diff(prechange, postchange), args.iterations)
+        print(f'{size_kb:>5} KB  watched {watched * 1e6:>8.1f} us  deepdiff {deep * 1000:>10.1f} ms  changed {changed}')
+
+
+if __name__ == '__main__':
+    main()
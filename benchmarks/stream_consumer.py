@@ -0,0 +1,64 @@
+"""Sustained consumer throughput against a local Redis.
+
+Preloads a stream with site events and drains it with StreamConsumer, once
+the way the cmdb worker used to run (one entry per read, no concurrency) and
+once batched and concurrent. The handler sleeps in a thread to stand in for a
+blocking Netbox call.
+
+    python -m benchmarks.stream_consumer --events 2000 --netbox-ms 20
+"""
+import time
+import asyncio
+import argparse
+import redis.asyncio as aioredis
+from helpers.stream_consumer import StreamConsumer
+
+STREAM = 'bench:cmdb:alert'
+GROUP = 'bench'
+
+
+async def drain(r, events, batch_size, concurrency, netbox_ms):
+    await r.delete(STREAM)
+    pipe = r.pipeline(transaction=False)
+    for i in range(events):
+        pipe.xadd(STREAM, {'event': 'updated', 'model': 'site', 'name': f'Branch {i}'})
+    await pipe.execute()
+
+    async def handler(entry_id, fields):
+        await asyncio.to_thread(time.sleep, netbox_ms / 1000)
+
+    consumer = StreamConsumer(r, STREAM, GROUP, 'bench-1', handler, batch_size=batch_size,
+                              concurrency=concurrency, block_ms=100)
+
+    async def stop_when_drained():
+        while consumer.counters['processed'] < events:
+            await asyncio.sleep(0.01)
+        consumer.stop()
+
+    start = time.perf_counter()
+    await asyncio.gather(consumer.run(), stop_when_drained())
+    elapsed = time.perf_counter() - start
+    await r.delete(STREAM)
+    return events / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--netbox-ms', type=float, default=20)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--redis', default='redis://localhost:6379/0')
+    args = parser.parse_args()
+
+    r = aioredis.StrictRedis.from_url(args.redis, decode_responses=True)
+    serial_events = min(args.events, 200)
+    rate = await drain(r, serial_events, 1, 1, args.netbox_ms)
+    print(f'serial   {rate:>8.0f} events/s ({serial_events} events)')
+    rate = await drain(r, args.events, args.batch_size, args.concurrency, args.netbox_ms)
+    print(f'batched  {rate:>8.0f} events/s ({args.events} events, batch {args.batch_size}, concurrency {args.concurrency})')
+    await r.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""Size and encode/decode cost of stream entries, flat versus the envelope.
+
+Compares, for the alerts the receiver and the cmdb worker write, the flat
+string field map used before helpers/envelope.py with the envelope using a
+msgpack body and using the JSON fallback. Bytes are the field names and
+values sent with XADD. With --redis the entries are also written to a scratch
+stream and MEMORY USAGE per entry is reported, which includes the field names
+Redis shares between entries with the same fields.
+
+    python -m benchmarks.stream_envelope --entries 20000
+    python -m benchmarks.stream_envelope --redis redis://localhost:6379/0
+"""
+import time
+import argparse
+from helpers import envelope
+
+ALERTS = {
+    'new_ap': ('device:alert', {'group': 'Branch-Template', 'serial': 'CNF7JSS9L1', 'device': 'IAP',
+                                'cluster': 'internal-us-2'}),
+    'config_change': ('config:alert', {'group': 'Branch-Template', 'device': 'SWITCH',
+                                       'cluster': 'internal-us-2'}),
+    'device_update': ('cmdb:alert', {'event': 'updated', 'device_type': 'Access Point', 'serial': 'CNF7JSS9L1',
+                                     'hostname': 'ap-branch-0042',
+                                     'central_subscription': {'tier': 'foundation', 'expires': '2027-06-30',
+                                                              'tags': ['branch', 'retail', 'us-east']}}),
+    'site_created': ('cmdb:alert', {'event': 'created', 'model': 'site', 'name': 'Branch 0042',
+                                    'physical_address': '1600 Amphitheatre Pkwy, Mountain View, CA 94043'}),
+    'site_forward': ('site:alert', {'event': 'created', 'name': 'Branch 0042', 'address': '1600 Amphitheatre Pkwy',
+                                    'city': 'Mountain View', 'state': 'CA', 'zipcode': '94043'}),
+}
+
+
+def entry_bytes(fields: dict) -> int:
+    size = 0
+    for name, value in fields.items():
+        size += len(name)
+        size += len(value) if isinstance(value, (bytes, str)) else len(str(value))
+    return size
+
+
+def as_read(fields: dict) -> dict:
+    """Fields as a decode_responses=True client with surrogateescape returns them."""
+    return {k: v.decode('utf-8', 'surrogateescape') if isinstance(v, bytes) else str(v) for k, v in fields.items()}
+
+
+def per_entry(fn, entries: int) -> float:
+    start = time.perf_counter()
+    for _ in range(entries):
+        fn()
+    return (time.perf_counter() - start) / entries
+
+
+def formats():
+    """(name, encode(stream, alert), decode(fields, stream)) for each format."""
+    flat = ('flat', lambda stream, alert: envelope.flatten(alert), lambda fields, stream: dict(fields))
+    yield flat
+    if envelope.msgpack:
+        yield 'envelope/msgpack', envelope.encode, envelope.decode
+    codec, envelope.msgpack = envelope.msgpack, None
+    try:
+        yield 'envelope/json', envelope.encode, envelope.decode
+    finally:
+        envelope.msgpack = codec
+
+
+def redis_usage(url: str, fields: dict, entries: int) -> float:
+    import redis
+    r = redis.Redis.from_url(url)
+    key = 'bench:envelope'
+    r.delete(key)
+    for start in range(0, entries, 1000):
+        pipe = r.pipeline(transaction=False)
+        for _ in range(min(1000, entries - start)):
+            pipe.xadd(key, fields)
+        pipe.execute()
+    usage = r.memory_usage(key, samples=0)
+    r.delete(key)
+    r.close()
+    return usage / entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=20000, help='Entries timed per alert and format')
+    parser.add_argument('--redis', help='Scratch Redis URL for MEMORY USAGE per entry')
+    args = parser.parse_args()
+
+    header = f'{"alert":<14} {"format":<17} {"bytes":>6} {"encode us":>10} {"decode us":>10}'
+    print(header + (f' {"redis B/entry":>14}' if args.redis else ''))
+    for name, (stream, alert) in ALERTS.items():
+        for fmt, encode, decode in formats():
+            fields = encode(stream, alert)
+            read = as_read(fields)
+            encode_s = per_entry(lambda: encode(stream, alert), args.entries)
+            decode_s = per_entry(lambda: decode(read, stream), args.entries)
+            line = f'{name:<14} {fmt:<17} {entry_bytes(fields):>6} {encode_s * 1e6:>10.2f} {decode_s * 1e6:>10.2f}'
+            if args.redis:
+                line += f' {redis_usage(args.redis, fields, args.entries):>14.1f}'
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Allocations and time of reading and signature checking a webhook body.
+
+Feeds a signed Central webhook to a Starlette request in chunks, the way
+uvicorn delivers it, and compares three paths:
+
+    decode    request.body(), decoded to str, concatenated with the headers
+              and encoded again before the HMAC (the original receiver)
+    buffered  request.body(), HMAC over the raw bytes
+    streamed  helpers.signature.read_signed, HMAC updated per chunk
+
+for a genuine delivery and for one from an unknown customer, which the
+streamed path turns away before reading the body. Peak traced memory is per
+request, measured with tracemalloc.
+
+    python -m benchmarks.webhook_signature --size-kb 100 1000 --chunk-kb 64
+"""
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+import tracemalloc
+from starlette.requests import Request
+from benchmarks.load import webhooks
+from helpers.signature import CENTRAL_HEADERS, BodyTooLarge, central_hmac, central_signature, read_signed
+
+TOKENS = {webhooks.CUSTOMER_ID: webhooks.CENTRAL_TOKEN}
+MAX_BODY_BYTES = 10_000_000
+
+
+def make_request(headers: dict, parts: list) -> Request:
+    index = 0
+
+    async def receive():
+        nonlocal index
+        index += 1
+        # A fresh chunk per read, as the server allocates it
+        chunk = memoryview(parts[index - 1]).tobytes()
+        return {'type': 'http.request', 'body': chunk, 'more_body': index < len(parts)}
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/webhook', 'query_string': b'',
+             'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+    return Request(scope, receive)
+
+
+def signed_headers(headers) -> tuple:
+    return headers['X-Central-Signature'], (headers['X-Central-Service'] + headers['X-Central-Delivery-Id'] +
+                                            headers['X-Central-Delivery-Timestamp'])
+
+
+async def decode(request):
+    body = await request.body()
+    token = TOKENS[request.headers['X-Central-Customer-Id']]
+    signature, combined = signed_headers(request.headers)
+    message = (body.decode('utf-8') + combined).encode('utf-8')
+    digest = base64.b64encode(hmac.new(token.encode(), msg=message, digestmod=hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(signature, digest)
+
+
+async def buffered(request):
+    body = await request.body()
+    token = TOKENS[request.headers['X-Central-Customer-Id']]
+    signature, combined = signed_headers(request.headers)
+    mac = hmac.new(token.encode(), msg=body, digestmod=hashlib.sha256)
+    mac.update(combined.encode('utf-8'))
+    return hmac.compare_digest(signature, base64.b64encode(mac.digest()).decode())
+
+
+async def streamed(request):
+    headers = request.headers
+    if any(not headers.get(name) for name in CENTRAL_HEADERS):
+        return False
+    mac = central_hmac(TOKENS[headers['X-Central-Customer-Id']])
+    try:
+        await read_signed(request.stream(), mac, MAX_BODY_BYTES)
+    except BodyTooLarge:
+        return False
+    return hmac.compare_digest(headers['X-Central-Signature'], central_signature(mac, headers))
+
+
+async def measure(path, headers, body, chunk, requests):
+    """Seconds per request and peak bytes of one request; an unknown customer counts as rejected."""
+    parts = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+
+    async def once():
+        try:
+            return await path(make_request(headers, parts))
+        except KeyError:
+            return False
+
+    valid = await once()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    await once()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(requests):
+        await once()
+    return (time.perf_counter() - start) / requests, peak, valid
+
+
+async def run(args):
+    print(f'{"body":>8} {"case":<9} {"path":<9} {"valid":>5} {"us/request":>11} {"peak KB":>9}')
+    for size_kb in args.size_kb:
+        payload = webhooks.central_alert('New AP detected', 'bench-serial', 'bench-group')
+        payload['details']['padding'] = 'x' * (size_kb * 1024)
+        headers, body = webhooks.central_webhook(payload)
+        cases = {'genuine': headers, 'unknown': dict(headers, **{'X-Central-Customer-Id': 'unknown'})}
+        for case, case_headers in cases.items():
+            for path in (decode, buffered, streamed):
+                seconds, peak, valid = await measure(path, case_headers, body, args.chunk_kb * 1024, args.requests)
+                print(f'{len(body) // 1024:>6}KB {case:<9} {path.__name__:<9} {str(valid):>5} '
+                      f'{seconds * 1e6:>11.1f} {peak / 1024:>9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-kb', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--chunk-kb', type=int, default=64, help='Body chunk size, uvicorn reads 64KB at a time')
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
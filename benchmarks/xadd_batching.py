@@ -0,0 +1,82 @@
+"""Burst enqueue benchmark: one blocking pipeline per alert vs XaddBatcher.
+
+Fires a burst of Central alerts at once and reports req/s and latency
+percentiles for each enqueue strategy against a local Redis.
+
+    python -m benchmarks.xadd_batching --alerts 500 --redis redis://localhost:6379/0
+"""
+import time
+import asyncio
+import argparse
+import statistics
+import redis
+import redis.asyncio as aioredis
+from helpers.stream_batcher import XaddBatcher
+
+STREAM = 'bench:config:alert'
+ALERT = {'group': 'JA-Branch-01', 'device': 'IAP', 'cluster': 'us-2'}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, latencies, elapsed):
+    print(f'{name:<10} {len(latencies) / elapsed:>10.0f} req/s  '
+          f'p50 {statistics.median(latencies) * 1000:>7.2f} ms  '
+          f'p99 {percentile(latencies, 99) * 1000:>7.2f} ms')
+
+
+async def run_sync(url, alerts):
+    r = redis.StrictRedis.from_url(url, decode_responses=True)
+
+    async def handle():
+        start = time.perf_counter()
+        pipe = r.pipeline()
+        pipe.xadd(STREAM, ALERT, id='*')
+        pipe.execute()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(handle() for _ in range(alerts)))
+    elapsed = time.perf_counter() - start
+    r.close()
+    return latencies, elapsed
+
+
+async def run_batched(url, alerts, max_batch, max_delay):
+    r = aioredis.StrictRedis.from_url(url, decode_responses=True, max_connections=20)
+    batcher = XaddBatcher(r, max_batch=max_batch, max_delay=max_delay)
+    batcher.start()
+
+    async def handle():
+        start = time.perf_counter()
+        await batcher.xadd(STREAM, ALERT)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(handle() for _ in range(alerts)))
+    elapsed = time.perf_counter() - start
+    await batcher.stop()
+    await r.close()
+    return latencies, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alerts', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--redis', default='redis://localhost:6379/0')
+    parser.add_argument('--max-batch', type=int, default=100)
+    parser.add_argument('--max-delay', type=float, default=0.002)
+    args = parser.parse_args()
+
+    for _ in range(args.rounds):
+        report('sync', *await run_sync(args.redis, args.alerts))
+        report('batched', *await run_batched(args.redis, args.alerts, args.max_batch, args.max_delay))
+    redis.StrictRedis.from_url(args.redis).delete(STREAM)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
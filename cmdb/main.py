@@ -1,52 +1,61 @@
 import os
 import sys
 import asyncio
-import redis
-import time
+import redis.asyncio as aioredis
 import socket
 from azure.keyvault.secrets import SecretClient
 from azure.identity import DefaultAzureCredential
-import usaddress
-import operator
 import pynetbox
 from loguru import logger
+from helpers.secret_cache import SecretCache
+from helpers.log_setup import setup_logging
+from helpers.stream_consumer import LaneConsumer
+from helpers.lanes import parse_weights, lane_stream
+from helpers.netbox_cache import NetboxCache
+from helpers.address import AddressNormalizer, AddressError
+from helpers.coalesce import IDENTITY_FIELDS
+from helpers import envelope
+from helpers.stage_timer import StageTimer
+from helpers import metrics
 
 consumer=socket.gethostname()
 consumer_group = 'cmdb'
 stream_key = f'{consumer_group}:alert'
 
 # Loguru settings
-logger.remove()
-logger.add(sys.stderr, format="{time} {level} {message}")
-logger.add(f'/logs/{consumer}.log')
-logger.add(f'/logs/{consumer}_retention.log', retention="5 days")
-logger.add(f'/logs/{consumer}_rotation.log', rotation="1 MB")
-logger.add(f'/logs/{consumer}_compressed.log', compression="zip")
+setup_logging(consumer)
 logger.info(f'The Consumer name is {consumer} within {consumer_group} and listening to {stream_key}')
 
 # Azure Key vault authentication
 VAULT_URL = os.environ["AZURE_KEYVAULT_URL"]
 credential = DefaultAzureCredential()
 client = SecretClient(vault_url=VAULT_URL, credential=credential)
+secrets = SecretCache(client)
 
 # Redis settings
-r_host = client.get_secret('redis-server')
-r_password = client.get_secret('redis-password')
-r = redis.StrictRedis(host=r_host.value, port=6380, charset='utf-8',
-                      password=r_password.value, ssl=True, decode_responses=True)
+r_host = secrets.get('redis-server')
+r_password = secrets.get('redis-password')
+# Azure Cache for Redis listens for TLS on 6380
+r_port = int(os.environ.get('REDIS_PORT', 6380))
+r_ssl = os.environ.get('REDIS_SSL', 'true').lower() in ('1', 'true', 'yes')
+# surrogateescape keeps the binary body of stream envelopes intact
+r = aioredis.StrictRedis(host=r_host, port=r_port, encoding='utf-8', encoding_errors='surrogateescape',
+                         password=r_password, ssl=r_ssl, decode_responses=True)
 
 # Netbox settings
-netbox_url = client.get_secret('netbox-url')
-netbox_token = client.get_secret('netbox-token')
+netbox_url = secrets.get('netbox-url')
+netbox_token = secrets.get('netbox-token')
 nb = pynetbox.api(
-    netbox_url.value,
-    token=netbox_token.value
+    netbox_url,
+    token=netbox_token
 )
 nb.http_session.verify = False
+netbox_cache = NetboxCache(nb, ttl=int(os.environ.get('NETBOX_CACHE_TTL', 300)))
 
-@logger.catch
-def get_message_from_response(response):
-    return response[0][1][0]
+# Address parsing results, shared between replicas through Redis
+address_normalizer = AddressNormalizer(redis_client=r)
+
+timer = StageTimer(observe=metrics.stage_observer(consumer_group))
 
 @logger.catch
 async def process_ap_message(msg):
@@ -58,42 +67,39 @@ async def process_ap_message(msg):
                 
             }
 
-@logger.catch
-async def process_message(msg):
+# Not wrapped in logger.catch: a failure must leave the message pending to be retried
+async def process_message(msg, msg_id=None, ingested=None):
     logger.info(msg)
     match msg:
         case {'event': 'deleted', 'device_type': device_type, 'serial': serial_number}:
             logger.info(f'{device_type} with {serial_number} was deleted.')
             device_info = {
-                'event': 'updated',
+                'event': 'deleted',
                 'device Type': device_type,
                 'serial': serial_number,
-                updated_key: updated_value,
             }
             return device_info
         case {'event': 'updated', 'device_type': device_type, 'serial': serial_number}:
             logger.info(f'{device_type} with {serial_number} was updated.')
-            updated_key = list(msg.keys())[-1]
-            logger.info(updated_key)
-            updated_value = msg[next(reversed(msg))]
-            logger.info(updated_value)
+            # Coalesced alerts can carry several changed fields
+            updated = {k: v for k, v in msg.items() if k not in IDENTITY_FIELDS and k != 'coalesced'}
+            logger.info(updated)
             device_info = {
                 'event': 'updated',
                 'device Type': device_type,
                 'serial': serial_number,
-                updated_key: updated_value,
-            }
+            } | updated
             return device_info
         case {'event': 'created', 'device_type': device_type, 'serial': serial_number}:
             logger.info(f'{device_type} with {serial_number} was created.')
             device_info = {
-                'event': 'updated',
+                'event': 'created',
                 'device Type': device_type,
                 'serial': serial_number,
-                updated_key: updated_value,
             }
             return device_info
         case {'event': 'deleted', 'model': 'site', 'name': name}:
+            netbox_cache.invalidate('dcim.sites', name)
             site_info = {
                 'event': 'deleted',
                 'model': 'site',
@@ -103,100 +109,27 @@ async def process_message(msg):
             logger.info(site_info)
             return site_info
         case {'event': event, 'model': 'site', 'name': name}:
-            address = []
-            api_attr = f'dcim.sites'
-            obj_fltr = 'name'
-            site = dict(operator.attrgetter(api_attr)(nb).get(**{obj_fltr: name}))
-            physical_address = site['physical_address']
+            if 'physical_address' in msg:
+                physical_address = msg['physical_address']
+                netbox_cache.count_snapshot()
+            else:
+                # Anything cached before this webhook was received is outdated
+                site = await netbox_cache.get('dcim.sites', name, not_before=ingested or stream_id_time(msg_id))
+                physical_address = site['physical_address']
+            logger.info(f'Netbox calls avoided {netbox_cache.stats()}')
             try:
-
-                address = usaddress.tag(physical_address)[0]
-                logger.info(address)
-                address_list = []
-
-                breaktags = [
-                    'AddressNumber',
-                    'StreetNamePreDirectional',
-                    'StreetNamePostType',
-                    'PlaceName',
-                    'StateName',
-                    'ZipCode',
-                    'CountryName'
-                ]
-
-                multibreak = {
-                    'AddressNumberPrefix': ['AddressNumber']
-                }
-
-                parsed = []
-                address_field = ''
-
-                address_items = list(address.items())
-
-                for k, v in address_items:
-
-                    if address_field == '':
-                        address_field = k
-
-                    if k in breaktags:
-
-                        breaktags.remove(k)
-
-                        if k in multibreak:
-                            for mb in multibreak[k]:
-                                if mb in multibreak:
-                                    multibreak.remove(mb)
-
-                        address_list = [i for i in address_list if i]
-
-                        if address_list:
-                            address_list = ' '.join(address_list)
-                            parsed.append(address_list)
-                            address['Parsed_' + address_field] = address_list
-                            address_field = k
-
-                        address_list = [v]
-
-                    else:
-
-                        address_list.append(v)
-
-                address_list = [i for i in address_list if i]
-
-                if address_list:
-                    address_list = ' '.join(address_list)
-                    parsed.append(address_list)
-                    address['Parsed_' + address_field] = address_list
-
-            # Add combined version of address
-
-                address['Parsed_Address_Complete'] = '\n'.join(parsed)
-
-            # Do a little cleanup, just to be nice
-
-                for k in address:
-                    address[k] = address[k].strip()
-
-            # Update addr
-
-                addr = '\r'.join(parsed)
-
-            except KeyError as e:
-
-                address['Error'] = 'Validation Key Error: ' + e.message
-
-            site_address = addr
-            logger.info(site_address)
-            site_city = f"{address['PlaceName']}"
-            site_state = f"{address['StateName']}"
-            site_zipcode = f"{address['ZipCode']}"
+                address = await address_normalizer.anormalize(physical_address)
+            except AddressError as e:
+                logger.error(e)
+                return None
+            logger.info(address)
             site_info = {
                 'event': event,
                 'name': name,
-                'address': site_address,
-                'city': site_city,
-                'state': site_state,
-                'zipcode': site_zipcode,
+                'address': address['address'],
+                'city': address['city'],
+                'state': address['state'],
+                'zipcode': address['zipcode'],
                 'worker': 'site'
             }
             logger.info(site_info)
@@ -205,47 +138,58 @@ async def process_message(msg):
             logger.info("Dead end")
             return f"{'DeadEnd'}::{'group'}"
 
-@logger.catch
-async def send_message_to_worker(msg_info):
+def stream_id_time(msg_id):
+    # Stream ids start with the epoch milliseconds Redis added the entry at
+    return int(msg_id.split('-')[0]) / 1000 if msg_id else None
+
+# Not wrapped in logger.catch: a failed XADD must leave the message pending
+async def send_message_to_worker(msg_info, lane='normal'):
     alert_info = msg_info
     worker_key = alert_info.pop('worker')
     logger.info(worker_key)
     logger.info(alert_info)
-    pipe = r.pipeline()
-    alert_id = pipe.xadd(f'{worker_key}:alert', alert_info, id='*')
-    pipe.execute()  
+    # The alert keeps the lane the receiver put it in
+    alert_id = await r.xadd(lane_stream(f'{worker_key}:alert', lane),
+                            envelope.stream_fields(f'{worker_key}:alert', alert_info), id='*',
+                            maxlen=int(os.environ.get('STREAM_MAXLEN', 100000)), approximate=True)
     logger.info(f"alert {alert_id} sent")
-    
-@logger.catch
-async def worker():
-    try:
-        r.xgroup_create(stream_key, consumer_group, mkstream=True)
-    except:
-        print('Group already exists!')
-
-    while True:
-        try:
-            response = r.xreadgroup(consumer_group, consumer, {stream_key: '>'}, count=1, block=0)
-
-            if response:
-                msg = get_message_from_response(response)
-                msg_id = msg[1]
-                logger.info(msg_id)
-                msg_info = await process_message(msg_id)
-                logger.info(msg_info)
-                if msg_info:
-                    alert = await send_message_to_worker(msg_info)
-                    logger.info(alert)
-            
-            r.xack(stream_key, consumer_group, msg[0])
-            logger.info("Stream message ID {} read and processed successfuly by {}".format(msg[0],consumer))
-            r.xdel(stream_key, msg[0])
-            return {'result': 'ok'}
 
+async def handle_message(msg_id, entry, lane='normal'):
+    logger.info(msg_id)
+    with timer.stage('process'):
+        msg_info = await process_message(entry.body, msg_id, entry.ts / 1000 if entry.ts else None)
+    logger.info(msg_info)
+    outcome = metrics.match_outcome(msg_info)
+    # Device results have no worker to go to yet, only site results are forwarded
+    if isinstance(msg_info, dict) and 'worker' in msg_info:
+        with timer.stage('forward'):
+            await send_message_to_worker(msg_info, lane)
+    metrics.count_message(consumer_group, outcome)
 
-        except Exception as e:
-            print(str(e))
-            time.sleep(1)
+@logger.catch
+async def worker():
+    address_normalizer.warm()
+    stream = LaneConsumer(
+        r, stream_key, consumer_group, consumer, handle_message,
+        weights=parse_weights(os.environ.get('LANE_WEIGHTS')),
+        max_wait=float(os.environ.get('LANE_MAX_WAIT', 5)),
+        batch_size=int(os.environ.get('CONSUMER_BATCH_SIZE', 50)),
+        max_deliveries=int(os.environ.get('CONSUMER_MAX_DELIVERIES', 5)),
+        claim_idle_ms=int(os.environ.get('CONSUMER_CLAIM_IDLE_MS', 60000)),
+        maxlen=int(os.environ.get('STREAM_MAXLEN', 100000)),
+        concurrency=int(os.environ.get('CONSUMER_CONCURRENCY', 16)),
+        key_func=lambda entry: entry.key,
+        decode=lambda fields: envelope.decode(fields, stream_key),
+    )
+    stream.install_signal_handlers()
+    metrics.export_lane_consumer(stream)
+    metrics.export_stats('netbox_cache', netbox_cache.stats, counters=tuple(netbox_cache.counters))
+    metrics.export_stats('address_normalizer', address_normalizer.stats, counters=tuple(address_normalizer.counters))
+    metrics.export_stats('secret_cache', secrets.stats, counters=tuple(secrets.counters))
+    metrics.start_metrics_server()
+    await stream.run()
+    logger.debug(f'Secret cache stats {secrets.stats()}')
+    await r.close()
 
 if __name__ == '__main__':
     asyncio.run(worker())
@@ -0,0 +1,134 @@
+import os
+import asyncio
+from azure.keyvault.secrets import SecretClient
+from azure.identity import DefaultAzureCredential
+import redis
+import redis.asyncio as aioredis
+import socket
+from loguru import logger
+from helpers.central_utils.connection import central_connection
+from helpers.central_utils.device_inventory import DeviceOnboarder
+from helpers.central_utils.device_index import DeviceIndex
+from helpers.central_utils.rate_limit import CentralRateLimiter
+from helpers.secret_cache import SecretCache
+from helpers.log_setup import setup_logging
+from helpers.stream_consumer import StreamConsumer
+from helpers.stage_timer import StageTimer
+from helpers import metrics
+from helpers import envelope
+
+VAULT_URL = os.environ["AZURE_KEYVAULT_URL"]
+credential = DefaultAzureCredential()
+client = SecretClient(vault_url=VAULT_URL, credential=credential)
+secrets = SecretCache(client)
+
+# Loguru settings
+setup_logging('device')
+
+consumer=socket.gethostname()
+consumer_group = 'device'
+stream_key = f'{consumer_group}:alert'
+result_key = f'{consumer_group}:result'
+logger.info(f'The Consumer name is {consumer} within {consumer_group} and listening to {stream_key}')
+
+STREAM_MAXLEN = int(os.environ.get('STREAM_MAXLEN', 100000))
+DEVICE_BATCH_LIMIT = int(os.environ.get('DEVICE_BATCH_LIMIT', 50))
+
+# Redis settings
+r_host = secrets.get('redis-server')
+r_password = secrets.get('redis-password')
+# Azure Cache for Redis listens for TLS on 6380
+r_port = int(os.environ.get('REDIS_PORT', 6380))
+r_ssl = os.environ.get('REDIS_SSL', 'true').lower() in ('1', 'true', 'yes')
+# surrogateescape keeps the binary body of stream envelopes intact
+r = aioredis.StrictRedis(host=r_host, port=r_port, encoding='utf-8', encoding_errors='surrogateescape',
+                         password=r_password, ssl=r_ssl, decode_responses=True)
+
+# Central calls of every replica share one token bucket in Redis
+central_connection.use_rate_limiter(CentralRateLimiter(
+    redis.StrictRedis(host=r_host, port=r_port, password=r_password, ssl=r_ssl, decode_responses=True),
+    customer=central_connection.account,
+    rate=float(os.environ.get('CENTRAL_RATE_PER_SECOND', 7)),
+    daily_limit=int(os.environ.get('CENTRAL_DAILY_LIMIT', 5000)),
+))
+
+onboarder = DeviceOnboarder(
+    central_connection,
+    batch_limit=DEVICE_BATCH_LIMIT,
+    window=float(os.environ.get('DEVICE_BATCH_WINDOW', 2.0)),
+    max_attempts=int(os.environ.get('DEVICE_MAX_ATTEMPTS', 3)),
+)
+
+# Serial -> type, name, group, site and status of every AP and switch, shared by the replicas
+device_index = DeviceIndex(r, central_connection)
+
+timer = StageTimer(observe=metrics.stage_observer(consumer_group))
+
+async def process_message(msg, msg_id):
+    logger.info(msg)
+    match msg:
+        case {'serial': serial}:
+            # Central adds a device by serial and MAC, the index knows it when the alert does not
+            mac = msg.get('macaddr')
+            if not mac:
+                record = await device_index.get(serial)
+                mac = record.macaddr if record is not None else ''
+            with timer.stage('onboard'):
+                result = await onboarder.submit(serial, mac)
+            metrics.count_message(consumer_group, result['outcome'])
+            if result['outcome'] == 'failed':
+                # Leave the entry pending, it is retried and eventually dead-lettered
+                raise RuntimeError(f"Adding {serial} failed: {result['reason']}")
+            await r.xadd(result_key, dict(msg, **result, source_id=msg_id), maxlen=STREAM_MAXLEN, approximate=True)
+            try:
+                await device_index.apply_alert(msg)
+            except Exception as e:
+                # The device is onboarded, the next resync will catch the index up
+                logger.warning(f'Device index update for {serial} failed: {e}')
+            return f"Device {serial} {result['outcome']} {result['reason']}".rstrip()
+
+async def handle_message(msg_id, entry):
+    logger.info(msg_id)
+    msg_info = await process_message(entry.body, msg_id)
+    logger.info(msg_info if msg_info else 'Match fell through')
+
+async def keep_device_index(interval: int):
+    try:
+        await device_index.load()
+    except Exception as e:
+        logger.error(f'Device index load failed: {e}')
+    await device_index.resync_forever(interval)
+
+@logger.catch
+async def worker():
+    onboarder.start()
+    # Loading can take a full listing of Central, alerts are handled meanwhile
+    index_task = asyncio.create_task(keep_device_index(int(os.environ.get('DEVICE_INDEX_RESYNC', 21600))))
+    stream = StreamConsumer(
+        r, stream_key, consumer_group, consumer, handle_message,
+        # Read and hold a full add-device batch at once
+        batch_size=int(os.environ.get('CONSUMER_BATCH_SIZE', DEVICE_BATCH_LIMIT)),
+        concurrency=int(os.environ.get('CONSUMER_CONCURRENCY', DEVICE_BATCH_LIMIT)),
+        max_deliveries=int(os.environ.get('CONSUMER_MAX_DELIVERIES', 5)),
+        claim_idle_ms=int(os.environ.get('CONSUMER_CLAIM_IDLE_MS', 60000)),
+        maxlen=STREAM_MAXLEN,
+        decode=lambda fields: envelope.decode(fields, stream_key),
+        # Alerts wait for the daily Central quota to reset instead of using up their deliveries
+        hold_off=lambda: asyncio.to_thread(central_connection.rate_limiter.quota_reset_in),
+    )
+    stream.install_signal_handlers()
+    metrics.export_consumer(stream)
+    metrics.export_stats('device_onboarder', onboarder.stats, counters=tuple(onboarder.counters))
+    metrics.export_stats('device_index', device_index.stats, counters=tuple(device_index.counters))
+    metrics.export_stats('central_rate_limiter', central_connection.rate_limiter.stats,
+                         counters=tuple(central_connection.rate_limiter.counters))
+    metrics.start_metrics_server()
+    await stream.run()
+    await onboarder.stop()
+    index_task.cancel()
+    logger.info(f'Device onboarding stats {onboarder.stats()}')
+    logger.info(f'Device index stats {device_index.stats()}')
+    await r.close()
+
+if __name__ == '__main__':
+    asyncio.run(worker())
@@ -0,0 +1,171 @@
+import hashlib
+from collections import OrderedDict
+import usaddress
+from loguru import logger
+from helpers import fast_json
+
+# A new line of the Central site address starts at each of these usaddress labels
+BREAK_TAGS = (
+    'AddressNumber',
+    'StreetNamePreDirectional',
+    'StreetNamePostType',
+    'PlaceName',
+    'StateName',
+    'ZipCode',
+    'CountryName',
+)
+
+
+class AddressError(ValueError):
+    """The address could not be tagged or is missing city, state or zip code."""
+
+
+def normalize_key(raw: str) -> str:
+    return ' '.join(str(raw).split())
+
+
+def parse_address(raw: str) -> dict:
+    """Tag a US street address and split it into the fields Central expects.
+
+    :param raw: Free form address. Example: 1600 Pennsylvania Ave NW Washington DC 20500
+    :type raw: str
+    :raises AddressError: The address can't be tagged or lacks city, state or zip code.
+    :return: address (lines joined by \\r), city, state and zipcode.
+    :rtype: dict
+    """
+    try:
+        tagged = usaddress.tag(raw)[0]
+    except usaddress.RepeatedLabelError as e:
+        raise AddressError(f'Ambiguous address {raw!r}: {e}')
+    breaktags = set(BREAK_TAGS)
+    parsed = []
+    current = []
+    for label, value in tagged.items():
+        # Each break tag only starts a new line the first time it shows up
+        if label in breaktags:
+            breaktags.discard(label)
+            current = [v for v in current if v]
+            if current:
+                parsed.append(' '.join(current).strip())
+            current = [value]
+        else:
+            current.append(value)
+    current = [v for v in current if v]
+    if current:
+        parsed.append(' '.join(current).strip())
+    try:
+        return {
+            'address': '\r'.join(parsed),
+            'city': tagged['PlaceName'].strip(),
+            'state': tagged['StateName'].strip(),
+            'zipcode': tagged['ZipCode'].strip(),
+        }
+    except KeyError as e:
+        raise AddressError(f'Validation Key Error: {e} missing from {raw!r}')
+
+
+class AddressNormalizer(object):
+    """Memoized :func:`parse_address` with an optional shared Redis tier.
+
+    Results are kept in a bounded in-process LRU keyed on the whitespace
+    normalized address. With ``redis_client`` set, misses are looked up in Redis
+    before running the CRF tagger, so replicas and restarts reuse each other's
+    work.
+    """
+    def __init__(self, maxsize: int = 4096, redis_client=None, redis_ttl: int = 86400,
+                 prefix: str = 'address:'):
+        """
+        :param maxsize: Entries kept in the in-process LRU.
+        :param redis_client: Optional instance of class:`redis.asyncio.Redis`.
+        :param redis_ttl: Seconds a parsed address is kept in Redis.
+        :param prefix: Redis key prefix.
+        """
+        self.maxsize = maxsize
+        self.redis = redis_client
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self._lru = OrderedDict()
+        self.counters = {'hits': 0, 'redis_hits': 0, 'misses': 0, 'errors': 0}
+
+    def warm(self):
+        """Run the tagger once so the CRF model is loaded before the first event."""
+        parse_address('1600 Pennsylvania Ave NW Washington DC 20500')
+
+    def _remember(self, key, result):
+        self._lru[key] = result
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def _cached(self, key):
+        result = self._lru.get(key)
+        if result is not None:
+            self._lru.move_to_end(key)
+            self.counters['hits'] += 1
+        return result
+
+    def _parse(self, key):
+        self.counters['misses'] += 1
+        try:
+            result = parse_address(key)
+        except AddressError:
+            self.counters['errors'] += 1
+            raise
+        self._remember(key, result)
+        return result
+
+    def normalize(self, raw: str) -> dict:
+        """Parse an address using the in-process LRU only. See :func:`parse_address`."""
+        key = normalize_key(raw)
+        return self._cached(key) or self._parse(key)
+
+    def _redis_key(self, key):
+        return self.prefix + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    async def anormalize(self, raw: str) -> dict:
+        """Parse an address through the LRU, then Redis, then the tagger."""
+        key = normalize_key(raw)
+        result = self._cached(key)
+        if result:
+            return result
+        if self.redis is not None:
+            try:
+                stored = await self.redis.get(self._redis_key(key))
+            except Exception as e:
+                logger.warning(f'Address cache lookup failed: {e}')
+                stored = None
+            if stored:
+                self.counters['redis_hits'] += 1
+                result = fast_json.loads(stored)
+                self._remember(key, result)
+                return result
+        result = self._parse(key)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._redis_key(key), fast_json.dumps(result), ex=self.redis_ttl)
+            except Exception as e:
+                logger.warning(f'Address cache store failed: {e}')
+        return result
+
+    def normalize_many(self, raws) -> list:
+        """Parse many addresses, tagging each distinct address only once.
+
+        :param raws: Iterable of free form addresses.
+        :return: One result per input, in order. Addresses that fail to parse
+            give an :class:`AddressError` instance instead of a dict.
+        :rtype: list
+        """
+        results = {}
+        out = []
+        for raw in raws:
+            key = normalize_key(raw)
+            if key not in results:
+                try:
+                    results[key] = self.normalize(key)
+                except AddressError as e:
+                    results[key] = e
+            out.append(results[key])
+        return out
+
+    def stats(self) -> dict:
+        return dict(self.counters, size=len(self._lru))
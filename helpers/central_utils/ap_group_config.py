@@ -1,15 +1,25 @@
 import logging
 from pycentral.url_utils import ConfigurationUrl, urlJoin
 from pycentral.base_utils import console_logger
-from central_utils.url_util import UrlObj
+from helpers.central_utils.url_util import UrlObj
+from helpers.central_utils.connection import central_connection
 
 urls = UrlObj()
 logger = console_logger("CONFIGURATION")
 
 class APConfiguration(object):
     """A Python class to manage AP configuration.
+
+    ``conn`` may be omitted on every method, the shared connection from
+    :data:`central_connection` is used instead.
     """
-    def get_ap_configuration(self, conn, group_name: str):
+    def __init__(self, conn_provider=central_connection):
+        self.conn_provider = conn_provider
+
+    def _conn(self, conn):
+        return conn if conn is not None else self.conn_provider.get()
+
+    def get_ap_configuration(self, conn=None, group_name: str = None):
         """Get existing AP settings
 
         :param conn: Instance of class:`pycentral.ArubaCentralBase` to make an API call.
@@ -20,10 +30,10 @@ class APConfiguration(object):
         :rtype: dict
         """
         path = urlJoin(urls.AP_CONFIGURATION["GET"], group_name)
-        resp = conn.command(apiMethod="GET", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="GET", apiPath=path)
         return resp
 
-    def replace_ap_configuration(self, conn, group_name: str, ap_configuration_data: dict):
+    def replace_ap_configuration(self, conn=None, group_name: str = None, ap_configuration_data: dict = None):
         """Update Existing AP Settings
 
         :param conn: Instance of class:`pycentral.ArubaCentralBase` to make an API call.
@@ -47,5 +57,5 @@ class APConfiguration(object):
         """
         path = urlJoin(urls.AP_CONFIGURATION["REPLACE"], group_name)
         data = ap_configuration_data
-        resp = conn.command(apiMethod="POST", apiPath=path, apiData=data)
+        resp = self._conn(conn).command(apiMethod="POST", apiPath=path, apiData=data)
         return resp
\ No newline at end of file
@@ -0,0 +1,113 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pycentral.base_utils import console_logger
+from helpers.central_utils.ap_group_config import APConfiguration
+from helpers.central_utils.cx_group_config import CXConfiguration
+from helpers.central_utils.connection import central_connection
+from helpers.central_utils.rate_limit import bulk_priority
+
+logger = console_logger("CONFIG_FETCHER")
+
+# Section name -> getter on class:`CXConfiguration`
+CX_SECTIONS = {
+    'vlans': 'get_vlan_configuration',
+    'interfaces': 'get_int_configuration',
+    'lags': 'get_lag_configuration',
+    'loop-prevention': 'get_loop_configuration',
+    'properties': 'get_prop_configuration',
+    'syslog': 'get_syslog_configuration',
+}
+# Section name -> getter on class:`APConfiguration`
+AP_SECTIONS = {
+    'ap_cli': 'get_ap_configuration',
+}
+
+
+class ConfigFetcher(object):
+    """Fetch CX and AP group configuration for many groups and sections at once.
+
+    Every (group, section) pair is one Central call. Calls run on a dedicated
+    thread pool of ``max_parallel`` threads, so no more than that many are in
+    flight however many groups are requested, and each call is given
+    ``timeout`` seconds. A failed or timed out call is reported under
+    ``errors`` and does not stop the others; a timed out call still holds its
+    thread until the HTTP request returns. Calls run at bulk priority, so
+    with a rate limiter in place event-driven calls keep their headroom.
+    """
+    def __init__(self, conn_provider=central_connection, max_parallel: int = 8, timeout: float = 30):
+        """
+        :param conn_provider: Object with a ``get()`` method returning a Central connection.
+        :param max_parallel: Calls in flight at once.
+        :param timeout: Seconds allowed for each call.
+        """
+        self.conn_provider = conn_provider
+        self.max_parallel = max_parallel
+        self.timeout = timeout
+        self.cx = CXConfiguration(conn_provider)
+        self.ap = APConfiguration(conn_provider)
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='config-fetch')
+        self.counters = {'calls': 0, 'errors': 0, 'timeouts': 0}
+
+    def _getter(self, section: str):
+        if section in CX_SECTIONS:
+            return getattr(self.cx, CX_SECTIONS[section])
+        if section in AP_SECTIONS:
+            return getattr(self.ap, AP_SECTIONS[section])
+        raise ValueError(f'Unknown configuration section {section}')
+
+    async def _call(self, conn, group: str, section: str, getter):
+        loop = asyncio.get_running_loop()
+        # run_in_executor does not carry context variables such as the request priority
+        ctx = contextvars.copy_context()
+        self.counters['calls'] += 1
+        try:
+            resp = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, ctx.run, lambda: getter(conn, group_name=group)),
+                self.timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            return group, section, None, f'Timed out after {self.timeout}s'
+        except Exception as e:
+            self.counters['errors'] += 1
+            return group, section, None, repr(e)
+        if resp.get('code') != 200:
+            self.counters['errors'] += 1
+            return group, section, None, f"{resp.get('code')}: {resp.get('msg')}"
+        return group, section, resp.get('msg'), None
+
+    async def fetch(self, group_names: list, sections: list = None, conn=None) -> dict:
+        """Fetch ``sections`` for every group in ``group_names`` concurrently.
+
+        :param group_names: Central group names.
+        :param sections: Keys of :data:`CX_SECTIONS` and/or :data:`AP_SECTIONS`. Default all CX sections.
+        :param conn: Instance of class:`pycentral.ArubaCentralBase`. Default the shared connection.
+        :return: {'results': {group: {section: config}}, 'errors': {group: {section: error}}}.
+            A group only appears under 'results' for the sections that were fetched.
+        :rtype: dict
+        """
+        sections = list(sections or CX_SECTIONS)
+        getters = {section: self._getter(section) for section in sections}
+        conn = conn if conn is not None else self.conn_provider.get()
+        with bulk_priority():
+            done = await asyncio.gather(*(self._call(conn, group, section, getters[section])
+                                          for group in group_names for section in sections))
+        results, errors = {}, {}
+        for group, section, config, error in done:
+            if error is None:
+                results.setdefault(group, {})[section] = config
+            else:
+                errors.setdefault(group, {})[section] = error
+        if errors:
+            logger.warning(f'{sum(len(e) for e in errors.values())} of {len(done)} configuration calls failed')
+        return {'results': results, 'errors': errors}
+
+    def fetch_sync(self, group_names: list, sections: list = None, conn=None) -> dict:
+        """:meth:`fetch` for callers without an event loop."""
+        return asyncio.run(self.fetch(group_names, sections, conn))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return dict(self.counters)
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import zlib
+import difflib
+import hashlib
+from urllib.parse import quote
+from pycentral.base_utils import console_logger
+
+logger = console_logger("CONFIG_STORE")
+
+
+def canonical(config) -> bytes:
+    """Serialize a configuration so equal configs always give the same bytes."""
+    return json.dumps(config, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def flatten(config, prefix: str = '') -> dict:
+    """Flatten nested dicts and lists into dotted path -> scalar value."""
+    if isinstance(config, dict):
+        items = config.items()
+    elif isinstance(config, list):
+        items = enumerate(config)
+    else:
+        return {prefix: config}
+    flat = {}
+    for k, v in items:
+        flat.update(flatten(v, f'{prefix}.{k}' if prefix else str(k)))
+    if not flat and prefix:
+        flat[prefix] = config
+    return flat
+
+
+def diff_configs(old, new) -> dict:
+    """Line-level diff for CLI configs (lists of strings), key-level diff otherwise.
+
+    :return: {'lines': [unified diff lines]} or
+        {'added': {path: value}, 'removed': {path: value}, 'changed': {path: (old, new)}}
+    :rtype: dict
+    """
+    if isinstance(old, list) and isinstance(new, list) and all(isinstance(x, str) for x in old + new):
+        return {'lines': list(difflib.unified_diff(old, new, 'previous', 'current', lineterm='', n=1))}
+    old_flat, new_flat = flatten(old), flatten(new)
+    return {
+        'added': {k: new_flat[k] for k in new_flat.keys() - old_flat.keys()},
+        'removed': {k: old_flat[k] for k in old_flat.keys() - new_flat.keys()},
+        'changed': {k: (old_flat[k], new_flat[k]) for k in old_flat.keys() & new_flat.keys()
+                    if old_flat[k] != new_flat[k]},
+    }
+
+
+class DiskBackend(object):
+    """Blobs and history files under a local directory."""
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'history'), exist_ok=True)
+
+    def _blob_path(self, digest: str):
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def _history_path(self, group: str, section: str):
+        return os.path.join(self.root, 'history', quote(group, safe=''), quote(section, safe='') + '.json')
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put_blob(self, digest: str, data: bytes):
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            self._write(path, data)
+
+    def get_blob(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), 'rb') as f:
+            return f.read()
+
+    def history(self, group: str, section: str) -> list:
+        try:
+            with open(self._history_path(group, section), 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return []
+
+    def push_history(self, group: str, section: str, entry: dict, keep: int):
+        history = [entry] + self.history(group, section)
+        self._write(self._history_path(group, section), json.dumps(history[:keep]).encode('utf-8'))
+
+    def all_histories(self):
+        base = os.path.join(self.root, 'history')
+        for group in os.listdir(base):
+            for name in os.listdir(os.path.join(base, group)):
+                if name.endswith('.json'):
+                    with open(os.path.join(base, group, name), 'rb') as f:
+                        yield json.loads(f.read())
+
+    def blob_digests(self):
+        base = os.path.join(self.root, 'blobs')
+        for fan in os.listdir(base):
+            for digest in os.listdir(os.path.join(base, fan)):
+                if not digest.endswith('.tmp'):
+                    yield digest
+
+    def delete_blob(self, digest: str):
+        os.remove(self._blob_path(digest))
+
+    def footprint(self) -> dict:
+        blobs = list(self.blob_digests())
+        size = sum(os.path.getsize(self._blob_path(d)) for d in blobs)
+        return {'blobs': len(blobs), 'blob_bytes': size}
+
+
+class RedisBackend(object):
+    """Blobs as Redis strings and history as Redis lists."""
+    def __init__(self, redis_client, prefix: str = 'configstore:'):
+        """
+        :param redis_client: Instance of class:`redis.StrictRedis` without decode_responses.
+        :param prefix: Key prefix for blobs and history lists.
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def _history_key(self, group: str, section: str):
+        return f'{self.prefix}history:{group}:{section}'
+
+    def put_blob(self, digest: str, data: bytes):
+        self.redis.set(f'{self.prefix}blob:{digest}', data, nx=True)
+
+    def get_blob(self, digest: str) -> bytes:
+        data = self.redis.get(f'{self.prefix}blob:{digest}')
+        if data is None:
+            raise KeyError(digest)
+        return data
+
+    def history(self, group: str, section: str) -> list:
+        return [json.loads(e) for e in self.redis.lrange(self._history_key(group, section), 0, -1)]
+
+    def push_history(self, group: str, section: str, entry: dict, keep: int):
+        key = self._history_key(group, section)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lpush(key, json.dumps(entry))
+        pipe.ltrim(key, 0, keep - 1)
+        pipe.execute()
+
+    def all_histories(self):
+        for key in self.redis.scan_iter(f'{self.prefix}history:*', count=1000):
+            yield [json.loads(e) for e in self.redis.lrange(key, 0, -1)]
+
+    def blob_digests(self):
+        start = len(f'{self.prefix}blob:')
+        for key in self.redis.scan_iter(f'{self.prefix}blob:*', count=1000):
+            yield key.decode('utf-8')[start:] if isinstance(key, bytes) else key[start:]
+
+    def delete_blob(self, digest: str):
+        self.redis.delete(f'{self.prefix}blob:{digest}')
+
+    def footprint(self) -> dict:
+        digests = list(self.blob_digests())
+        pipe = self.redis.pipeline(transaction=False)
+        for digest in digests:
+            pipe.strlen(f'{self.prefix}blob:{digest}')
+        return {'blobs': len(digests), 'blob_bytes': sum(pipe.execute()) if digests else 0}
+
+
+class ConfigSnapshotStore(object):
+    """History of group configuration sections, stored as deduplicated blobs.
+
+    Each section config is serialized canonically, hashed with SHA-256 and
+    stored zlib-compressed once under its hash, however many groups share it.
+    Every (group, section) keeps a short history of (digest, time) entries, so
+    an unchanged section is recognised by comparing hashes without loading or
+    comparing the config, and a changed one can be diffed against the previous
+    snapshot.
+    """
+    def __init__(self, backend, history_size: int = 10, compression_level: int = 6):
+        """
+        :param backend: class:`DiskBackend` or class:`RedisBackend`.
+        :param history_size: Snapshots kept per group and section.
+        :param compression_level: zlib level used for blobs.
+        """
+        self.backend = backend
+        self.history_size = history_size
+        self.compression_level = compression_level
+        self.counters = {'unchanged': 0, 'changed': 0, 'new': 0, 'blobs_stored': 0}
+
+    def put(self, config) -> str:
+        """Store ``config`` if its content is not stored yet and return its digest."""
+        data = canonical(config)
+        digest = hashlib.sha256(data).hexdigest()
+        self.backend.put_blob(digest, zlib.compress(data, self.compression_level))
+        self.counters['blobs_stored'] += 1
+        return digest
+
+    def load(self, digest: str):
+        return json.loads(zlib.decompress(self.backend.get_blob(digest)))
+
+    def history(self, group: str, section: str) -> list:
+        """Snapshots of a section, newest first, as dicts with 'digest' and 'time'."""
+        return self.backend.history(group, section)
+
+    def record(self, group: str, section: str, config) -> dict:
+        """Record the current config of a group section.
+
+        :return: {'changed': bool, 'digest': str, 'previous': str or None}.
+            'changed' is False when the config hashes the same as the latest snapshot.
+        :rtype: dict
+        """
+        data = canonical(config)
+        digest = hashlib.sha256(data).hexdigest()
+        history = self.backend.history(group, section)
+        previous = history[0]['digest'] if history else None
+        if digest == previous:
+            self.counters['unchanged'] += 1
+            return {'changed': False, 'digest': digest, 'previous': previous}
+        self.backend.put_blob(digest, zlib.compress(data, self.compression_level))
+        self.counters['blobs_stored'] += 1
+        self.backend.push_history(group, section, {'digest': digest, 'time': time.time()}, self.history_size)
+        self.counters['changed' if previous else 'new'] += 1
+        return {'changed': previous is not None, 'digest': digest, 'previous': previous}
+
+    def record_many(self, results: dict) -> dict:
+        """Record every section of a class:`ConfigFetcher` result.
+
+        :param results: {group: {section: config}}, the 'results' of ConfigFetcher.fetch.
+        :return: {group: {section: record result}}
+        :rtype: dict
+        """
+        return {group: {section: self.record(group, section, config) for section, config in sections.items()}
+                for group, sections in results.items()}
+
+    def diff(self, group: str, section: str, old: str = None, new: str = None) -> dict:
+        """Diff two snapshots of a section, by default the latest against the one before it.
+
+        :return: See :func:`diff_configs`; empty when there is nothing to compare.
+        :rtype: dict
+        """
+        if old is None or new is None:
+            history = self.backend.history(group, section)
+            if len(history) < 2:
+                return {}
+            new = new or history[0]['digest']
+            old = old or history[1]['digest']
+        if old == new:
+            return {}
+        return diff_configs(self.load(old), self.load(new))
+
+    def prune(self) -> int:
+        """Delete blobs no history refers to any more, returning how many were deleted.
+
+        Run it while nothing is recording, a blob written just before its
+        history entry would otherwise be deleted.
+        """
+        referenced = {entry['digest'] for history in self.backend.all_histories() for entry in history}
+        removed = 0
+        for digest in list(self.backend.blob_digests()):
+            if digest not in referenced:
+                self.backend.delete_blob(digest)
+                removed += 1
+        if removed:
+            logger.info(f'Pruned {removed} unreferenced configuration blobs')
+        return removed
+
+    def stats(self) -> dict:
+        return dict(self.counters)
@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from pycentral.base import ArubaCentralBase
+from pycentral.base_utils import console_logger
+from pycentral.workflows.workflows_utils import get_file_contents
+from helpers.metrics import observe_call
+
+logger = console_logger("CONNECTION")
+
+# Central access tokens are valid for two hours
+DEFAULT_TOKEN_LIFETIME = 7200
+
+
+class PooledCentralBase(ArubaCentralBase):
+    """ArubaCentralBase that keeps one HTTP session and refreshes its token once.
+
+    pycentral opens a new ``requests.Session`` for every call, so each API call
+    pays for a fresh TCP/TLS handshake. This class reuses a pooled keep-alive
+    session, refreshes the access token ``refresh_margin`` seconds before it
+    expires and makes concurrent callers that hit an expired token share a
+    single refresh.
+    """
+    def __init__(self, central_info, token_store=None, logger=None, ssl_verify=True,
+                 pool_size: int = 20, refresh_margin: int = 300, rate_limiter=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.refresh_margin = refresh_margin
+        self.rate_limiter = rate_limiter
+        self._token_lock = threading.Lock()
+        self._token_time = time.monotonic()
+        super().__init__(central_info=central_info, token_store=token_store,
+                         logger=logger, ssl_verify=ssl_verify)
+        self._token_time = time.monotonic()
+
+    def requestUrl(self, url, data={}, method="GET", headers={}, params={}, files={}):
+        req = requests.Request(method=method, url=url, headers=headers, files=files,
+                               params=params, data=data)
+        prepped = self.session.prepare_request(req)
+        settings = self.session.merge_environment_settings(prepped.url, {}, None, self.ssl_verify, None)
+        return self.session.send(prepped, **settings)
+
+    def _access_token(self):
+        token = self.central_info.get("token") or {}
+        return token.get("access_token")
+
+    def _token_lifetime(self):
+        token = self.central_info.get("token") or {}
+        return int(token.get("expires_in") or DEFAULT_TOKEN_LIFETIME)
+
+    def handleTokenExpiry(self):
+        seen = self._access_token()
+        with self._token_lock:
+            if self._access_token() != seen:
+                # Another caller refreshed while we were waiting
+                return
+            super().handleTokenExpiry()
+            self._token_time = time.monotonic()
+
+    def ensure_fresh_token(self):
+        age = time.monotonic() - self._token_time
+        if age > self._token_lifetime() - self.refresh_margin:
+            logger.info("Refreshing Central token before it expires")
+            self.handleTokenExpiry()
+
+    def command(self, *args, **kwargs):
+        self.ensure_fresh_token()
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            if self.rate_limiter is None:
+                resp = super().command(*args, **kwargs)
+            else:
+                resp = self.rate_limiter.call(lambda: super(PooledCentralBase, self).command(*args, **kwargs))
+            status = resp.get('code', 'error') if isinstance(resp, dict) else 'error'
+            return resp
+        finally:
+            method = kwargs.get('apiMethod') or (args[0] if args else '')
+            observe_call('central', method, status, time.perf_counter() - start)
+
+
+class CentralConnectionProvider(object):
+    """Process-lifetime Aruba Central connection.
+
+    The credentials file is read and the connection built on the first call to
+    :meth:`get`; every later call returns the same connection.
+    """
+    def __init__(self, filename: str = None, account: str = None, pool_size: int = 20,
+                 refresh_margin: int = 300, rate_limiter=None):
+        """
+        :param filename: pycentral credentials file. Default $CENTRAL_CREDS_FILE or /creds/central.json
+        :param account: Account within the credentials file. Default $CENTRAL_ACCOUNT or us-2
+        :param rate_limiter: Optional class:`CentralRateLimiter` every call goes through.
+        """
+        self.filename = filename or os.environ.get('CENTRAL_CREDS_FILE', '/creds/central.json')
+        self.account = account or os.environ.get('CENTRAL_ACCOUNT', 'us-2')
+        self.pool_size = pool_size
+        self.refresh_margin = refresh_margin
+        self.rate_limiter = rate_limiter
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        input_args = get_file_contents(filename=self.filename)
+        if self.account not in input_args:
+            raise KeyError(f'Account {self.account} not found in {self.filename}')
+        return PooledCentralBase(central_info=input_args[self.account],
+                                 token_store=input_args.get("token_store"),
+                                 ssl_verify=input_args.get("ssl_verify", True),
+                                 pool_size=self.pool_size,
+                                 refresh_margin=self.refresh_margin,
+                                 rate_limiter=self.rate_limiter)
+
+    def get(self) -> PooledCentralBase:
+        """Return the shared connection, building it on first use.
+
+        :return: Instance of class:`PooledCentralBase` to make API calls.
+        :rtype: class:`PooledCentralBase`
+        """
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = self._build()
+        return self._conn
+
+    def use_rate_limiter(self, rate_limiter):
+        """Send every call of the shared connection through ``rate_limiter``."""
+        self.rate_limiter = rate_limiter
+        if self._conn is not None:
+            self._conn.rate_limiter = rate_limiter
+
+    def reset(self):
+        """Drop the connection so the next :meth:`get` re-reads the credentials file."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.session.close()
+            self._conn = None
+
+
+central_connection = CentralConnectionProvider()
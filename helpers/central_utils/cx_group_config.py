@@ -1,84 +1,94 @@
 import logging
 from pycentral.url_utils import ConfigurationUrl, urlJoin
 from pycentral.base_utils import console_logger
-from central_utils.url_util import UrlObj
+from helpers.central_utils.url_util import UrlObj
+from helpers.central_utils.connection import central_connection
 
 urls = UrlObj()
 logger = console_logger("CONFIGURATION")
 
 class CXConfiguration(object):
     """A Python class to manage CX configuration.
+
+    ``conn`` may be omitted on every method, the shared connection from
+    :data:`central_connection` is used instead.
     """
-    def get_vlan_configuration(self, conn, group_name: str):
+    def __init__(self, conn_provider=central_connection):
+        self.conn_provider = conn_provider
+
+    def _conn(self, conn):
+        return conn if conn is not None else self.conn_provider.get()
+
+    def get_vlan_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_VLAN["GET"], group_name)
-        resp = conn.command(apiMethod="GET", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="GET", apiPath=path)
         return resp
 
-    def replace_vlan_configuration(self, conn, group_name: str):
+    def replace_vlan_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_VLAN["POST"], group_name)
-        resp = conn.command(apiMethod="POST", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="POST", apiPath=path)
         return resp
 
-    def get_int_configuration(self, conn, group_name: str):
+    def get_int_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_INT["GET"], group_name)
-        resp = conn.command(apiMethod="GET", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="GET", apiPath=path)
         return resp
 
-    def replace_int_configuration(self, conn, group_name: str):
+    def replace_int_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_INT["POST"], group_name)
-        resp = conn.command(apiMethod="POST", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="POST", apiPath=path)
         return resp
 
-    def get_lag_configuration(self, conn, group_name: str):
+    def get_lag_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_LAG["GET"], group_name)
-        resp = conn.command(apiMethod="GET", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="GET", apiPath=path)
         return resp
 
-    def replace_lag_configuration(self, conn, group_name: str):
+    def replace_lag_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_LAG["POST"], group_name)
-        resp = conn.command(apiMethod="POST", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="POST", apiPath=path)
         return resp
 
-    def get_loop_configuration(self, conn, group_name: str):
+    def get_loop_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_LOOP["GET"], group_name)
-        resp = conn.command(apiMethod="GET", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="GET", apiPath=path)
         return resp
 
-    def replace_loop_configuration(self, conn, group_name: str):
+    def replace_loop_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_LOOP["POST"], group_name)
-        resp = conn.command(apiMethod="POST", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="POST", apiPath=path)
         return resp
 
-    def get_prop_configuration(self, conn, group_name: str):
+    def get_prop_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_PROP["GET"], group_name)
-        resp = conn.command(apiMethod="GET", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="GET", apiPath=path)
         return resp
 
-    def replace_prop_configuration(self, conn, group_name: str):
+    def replace_prop_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_PROP["POST"], group_name)
-        resp = conn.command(apiMethod="POST", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="POST", apiPath=path)
         return resp
 
-    def get_syslog_configuration(self, conn, group_name: str):
+    def get_syslog_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_SYSLOG["GET"], group_name)
-        resp = conn.command(apiMethod="GET", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="GET", apiPath=path)
         return resp
 
-    def replace_syslog_configuration(self, conn, group_name: str):
+    def replace_syslog_configuration(self, conn=None, group_name: str = None):
 
         path = urlJoin(urls.CX_SYSLOG["POST"], group_name)
-        resp = conn.command(apiMethod="POST", apiPath=path)
+        resp = self._conn(conn).command(apiMethod="POST", apiPath=path)
         return resp
 
     
@@ -0,0 +1,290 @@
+import sys
+import asyncio
+from pycentral.base_utils import console_logger
+from helpers.central_utils.url_util import UrlObj
+from helpers.central_utils.rate_limit import bulk_priority
+
+urls = UrlObj()
+logger = console_logger("DEVICE_INDEX")
+
+# Device type -> (listing url, detail url, key of the device list in a listing page)
+DEVICE_TYPES = {
+    'ap': (urls.AP['GET_ALL'], urls.AP['DETAILS'], 'aps'),
+    'switch': (urls.SW['GET_ALL'], urls.SW['DETAILS'], 'switches'),
+}
+# Device type named by the ``device`` field of a Central device alert
+ALERT_DEVICE_TYPES = {'IAP': 'ap', 'AP': 'ap', 'SWITCH': 'switch', 'CX': 'switch', 'MAS': 'switch'}
+# Record field -> field of a Central device or a device alert carrying it
+ALERT_FIELDS = {'group': ('group', 'group_name'), 'site': ('site',), 'status': ('status',),
+                'name': ('name',), 'model': ('model',), 'macaddr': ('macaddr',)}
+SEPARATOR = '\x1f'
+
+
+class DeviceRecord(object):
+    """What the workers need to know about one Central device."""
+    __slots__ = ('type', 'name', 'group', 'site', 'status', 'macaddr', 'model')
+    FIELDS = __slots__
+
+    def __init__(self, type: str, name: str = '', group: str = '', site: str = '', status: str = '',
+                 macaddr: str = '', model: str = ''):
+        # Groups, sites, statuses and models repeat across thousands of devices, keep one copy of each
+        self.type = sys.intern(type)
+        self.name = name
+        self.group = sys.intern(group)
+        self.site = sys.intern(site)
+        self.status = sys.intern(status)
+        self.macaddr = macaddr
+        self.model = sys.intern(model)
+
+    @classmethod
+    def from_central(cls, device_type: str, device: dict):
+        return cls(device_type, device.get('name') or '', device.get('group_name') or '',
+                   device.get('site') or '', device.get('status') or '', device.get('macaddr') or '',
+                   device.get('model') or '')
+
+    def pack(self) -> str:
+        """Record as stored in the Redis hash."""
+        return SEPARATOR.join(getattr(self, field) for field in self.FIELDS)
+
+    @classmethod
+    def unpack(cls, packed: str):
+        return cls(*packed.split(SEPARATOR))
+
+    def replace(self, **fields):
+        return DeviceRecord(**dict(self.as_dict(), **fields))
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __eq__(self, other):
+        return isinstance(other, DeviceRecord) and self.pack() == other.pack()
+
+    def __repr__(self):
+        return f'DeviceRecord({self.as_dict()})'
+
+
+class DeviceIndex(object):
+    """Serial number to device record index of the APs and switches in Aruba Central.
+
+    A full resync lists every AP and switch, with the pages after the first
+    of each fetched concurrently, and replaces both the in-memory index and
+    the Redis hash every replica shares. Between resyncs the index follows
+    the device alerts (:meth:`apply_alert`), and serials nobody has seen yet
+    are looked up in Redis, then in Central. Changes made by other replicas
+    reach this replica's memory at the next resync.
+    """
+    def __init__(self, redis_client, conn_provider, key: str = 'central:devices',
+                 page_size: int = 1000, max_parallel_pages: int = 4, write_chunk: int = 5000):
+        """
+        :param redis_client: Instance of class:`redis.asyncio.Redis` with decode_responses=True.
+        :param conn_provider: Object with a ``get()`` method returning a Central connection.
+        :param key: Redis hash holding serial -> packed class:`DeviceRecord`.
+        :param page_size: Devices requested per page.
+        :param max_parallel_pages: Pages fetched at once after the first, per device type.
+        :param write_chunk: Fields written to Redis per HSET during a resync.
+        """
+        self.redis = redis_client
+        self.conn_provider = conn_provider
+        self.key = key
+        self.page_size = page_size
+        self.max_parallel_pages = max_parallel_pages
+        self.write_chunk = write_chunk
+        self._index = {}
+        # serial -> (record, changed fields) of the changes made while a resync runs,
+        # which win over what the listing returned
+        self._changed = None
+        self.counters = {'hits': 0, 'redis_hits': 0, 'misses': 0, 'not_found': 0,
+                         'alerts_applied': 0, 'resyncs': 0}
+
+    def _get_page(self, device_type: str, offset: int) -> dict:
+        url, _, _ = DEVICE_TYPES[device_type]
+        params = {'calculate_total': True, 'offset': offset, 'limit': self.page_size}
+        resp = self.conn_provider.get().command(apiMethod='GET', apiPath=url, apiParams=params)
+        if resp.get('code') != 200:
+            raise RuntimeError(f'Listing {device_type}s at offset {offset} failed: {resp}')
+        return resp['msg']
+
+    async def fetch_type(self, device_type: str) -> dict:
+        """List every device of one type, fetching the pages after the first concurrently.
+
+        :param device_type: ap or switch
+        :return: serial -> class:`DeviceRecord`
+        :rtype: dict
+        """
+        _, _, list_key = DEVICE_TYPES[device_type]
+        first = await asyncio.to_thread(self._get_page, device_type, 0)
+        pages = [first]
+        total = first.get('total') or len(first.get(list_key, []))
+        semaphore = asyncio.Semaphore(self.max_parallel_pages)
+
+        async def fetch(offset):
+            async with semaphore:
+                return await asyncio.to_thread(self._get_page, device_type, offset)
+
+        pages += await asyncio.gather(*(fetch(offset) for offset in range(self.page_size, total, self.page_size)))
+        return {d['serial']: DeviceRecord.from_central(device_type, d)
+                for page in pages for d in page.get(list_key, []) if d.get('serial')}
+
+    async def fetch_all(self) -> dict:
+        """List every AP and switch in Central, both types at once.
+
+        :return: serial -> class:`DeviceRecord`
+        :rtype: dict
+        """
+        index = {}
+        for devices in await asyncio.gather(*(self.fetch_type(t) for t in DEVICE_TYPES)):
+            index.update(devices)
+        return index
+
+    def _merge_changes(self, index: dict, changed: dict):
+        for serial, (record, fields) in changed.items():
+            if record is None:
+                index.pop(serial, None)
+            elif fields is not None and serial in index:
+                # An alert only knows some fields, the listing has the rest
+                index[serial] = index[serial].replace(**fields)
+            else:
+                index[serial] = record
+
+    async def resync(self):
+        """Rebuild the index from Central and replace the shared Redis copy."""
+        self._changed = {}
+        try:
+            with bulk_priority():
+                index = await self.fetch_all()
+            # Alerts applied during the listing are newer than what it returned
+            self._merge_changes(index, self._changed)
+            self._changed = {}
+            staging = f'{self.key}:staging'
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(staging)
+            serials = list(index)
+            for start in range(0, len(serials), self.write_chunk):
+                pipe.hset(staging, mapping={s: index[s].pack() for s in serials[start:start + self.write_chunk]})
+            if index:
+                pipe.rename(staging, self.key)
+            else:
+                pipe.delete(self.key)
+            await pipe.execute()
+            late = self._changed
+        finally:
+            self._changed = None
+        # Alerts applied while the hash was written went to the hash it replaced
+        self._merge_changes(index, late)
+        for serial in late:
+            if serial in index:
+                await self.redis.hset(self.key, serial, index[serial].pack())
+            else:
+                await self.redis.hdel(self.key, serial)
+        self._index = index
+        self.counters['resyncs'] += 1
+        logger.info(f'Device index loaded with {len(index)} devices')
+
+    async def load(self):
+        """Load the shared index from Redis, or from Central if no replica has built it yet."""
+        stored = await self.redis.hgetall(self.key)
+        if stored:
+            self._index = {serial: DeviceRecord.unpack(packed) for serial, packed in stored.items()}
+            logger.info(f'Device index loaded from Redis with {len(self._index)} devices')
+        else:
+            await self.resync()
+
+    def lookup(self, serial: str):
+        """Record of ``serial`` if this replica knows it, without any I/O.
+
+        :rtype: DeviceRecord or None
+        """
+        record = self._index.get(serial)
+        if record is not None:
+            self.counters['hits'] += 1
+        return record
+
+    def _get_details(self, serial: str):
+        conn = self.conn_provider.get()
+        for device_type, (_, detail_url, _) in DEVICE_TYPES.items():
+            resp = conn.command(apiMethod='GET', apiPath=f'{detail_url}/{serial}')
+            if resp.get('code') == 200 and isinstance(resp.get('msg'), dict) and resp['msg'].get('serial'):
+                return DeviceRecord.from_central(device_type, resp['msg'])
+        return None
+
+    async def get(self, serial: str):
+        """Record of ``serial``, asking Central only if no replica knows the device.
+
+        :param serial: Device serial number. Example: CNF7JSS9L1
+        :return: The record or None when Central does not know the device.
+        :rtype: DeviceRecord
+        """
+        record = self.lookup(serial)
+        if record is not None:
+            return record
+        packed = await self.redis.hget(self.key, serial)
+        if packed:
+            self.counters['redis_hits'] += 1
+            record = DeviceRecord.unpack(packed)
+            self._index[serial] = record
+            return record
+        self.counters['misses'] += 1
+        record = await asyncio.to_thread(self._get_details, serial)
+        if record is None:
+            self.counters['not_found'] += 1
+            return None
+        await self.set(serial, record)
+        return record
+
+    async def set(self, serial: str, record: DeviceRecord, fields: dict = None):
+        """Store ``record``; ``fields`` are the ones that changed when only those are known."""
+        self._index[serial] = record
+        if self._changed is not None:
+            previous = self._changed.get(serial)
+            if fields is not None and previous and previous[1] is not None:
+                fields = dict(previous[1], **fields)
+            self._changed[serial] = (record, fields)
+        await self.redis.hset(self.key, serial, record.pack())
+
+    async def remove(self, serial: str):
+        self._index.pop(serial, None)
+        if self._changed is not None:
+            self._changed[serial] = (None, None)
+        await self.redis.hdel(self.key, serial)
+
+    async def apply_alert(self, alert: dict):
+        """Fold the fields a device alert carries into the device's record.
+
+        Unknown serials get a record when the alert names the device type.
+
+        :param alert: Device alert. Example: {'serial': 'CNF7JSS9L1', 'device': 'IAP', 'group': 'Branch'}
+        :return: The updated record, or None when there was nothing to record.
+        :rtype: DeviceRecord
+        """
+        serial = alert.get('serial')
+        if not serial:
+            return None
+        fields = {}
+        for field, names in ALERT_FIELDS.items():
+            value = next((alert[name] for name in names if isinstance(alert.get(name), str) and alert[name]), None)
+            if value is not None:
+                fields[field] = value
+        current = self._index.get(serial)
+        if current is None:
+            device_type = ALERT_DEVICE_TYPES.get(str(alert.get('device', '')).upper())
+            if device_type is None:
+                return None
+            record = DeviceRecord(device_type, **fields)
+        else:
+            record = current.replace(**fields)
+            if record == current:
+                return current
+        await self.set(serial, record, fields)
+        self.counters['alerts_applied'] += 1
+        return record
+
+    async def resync_forever(self, interval: int = 21600):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.resync()
+            except Exception as e:
+                logger.error(f'Device index resync failed: {e}')
+
+    def stats(self) -> dict:
+        return dict(self.counters, devices=len(self._index))
@@ -0,0 +1,206 @@
+import asyncio
+from pycentral.base_utils import console_logger
+from helpers.central_utils.url_util import UrlObj
+from helpers.central_utils.connection import central_connection
+from helpers.central_utils.rate_limit import QuotaExhausted
+
+urls = UrlObj()
+logger = console_logger("DEVICE_INVENTORY")
+
+# Lists of the add-device response naming devices Central refused
+REJECTED_LISTS = ('invalid_device', 'blocked_device')
+
+
+def rejected_serials(msg) -> dict:
+    """Serials a successful bulk add still refused, mapped to the list they were in."""
+    extra = msg.get('extra', {}) if isinstance(msg, dict) else {}
+    details = extra.get('message', {}) if isinstance(extra, dict) else {}
+    rejected = {}
+    for reason in REJECTED_LISTS:
+        for device in (details.get(reason) or []) if isinstance(details, dict) else []:
+            serial = device.get('serial') if isinstance(device, dict) else device
+            if serial:
+                rejected[serial] = reason
+    return rejected
+
+
+class DeviceOnboarder(object):
+    """Add devices to the Central inventory in bulk.
+
+    Callers await :meth:`submit` with one device each. Devices are collected
+    until ``batch_limit`` of them are waiting or the first has waited
+    ``window`` seconds, then added with a single call to the device inventory
+    API. A batch Central refuses as a whole (a 4xx other than 429) is split in
+    half and each half retried, down to single devices, so one bad serial does
+    not fail the rest. A batch failing with a 429, a 5xx or a connection error
+    is retried whole ``max_attempts`` times with exponential backoff, so an
+    outage does not multiply the calls made against the shared quota.
+
+    Central needs the MAC address as well as the serial of every device, a
+    device without one is rejected straight away rather than sent.
+
+    Every caller gets its own outcome: ``added``, ``rejected`` (Central refused
+    the device) or ``failed`` (Central could not be reached or kept failing).
+    Once the daily Central quota is used up, :meth:`submit` raises
+    class:`QuotaExhausted` instead, nothing is retried until it resets.
+    """
+    def __init__(self, conn_provider=central_connection, batch_limit: int = 50, window: float = 2.0,
+                 max_attempts: int = 3, backoff: float = 1.0, max_inflight: int = 2):
+        """
+        :param conn_provider: Object with a ``get()`` method returning a Central connection.
+        :param batch_limit: Maximum devices per add-device call.
+        :param window: Seconds the first device of a batch may wait for company.
+        :param max_attempts: Attempts for a batch failing with a retriable error.
+        :param backoff: Seconds before the first retry, doubled for every later one.
+        :param max_inflight: Maximum batches being added at once.
+        """
+        self.conn_provider = conn_provider
+        self.batch_limit = batch_limit
+        self.window = window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._pending = {}
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._flushes = set()
+        self.counters = {'devices': 0, 'calls': 0, 'batches': 0, 'splits': 0, 'retries': 0,
+                         'added': 0, 'rejected': 0, 'failed': 0, 'quota_exhausted': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Add whatever is pending and stop the background flusher."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            await self._flush(self._take())
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def submit(self, serial: str, mac: str, **fields) -> dict:
+        """Queue a device and wait for the outcome of adding it.
+
+        Submitting a serial that is already waiting shares the pending add.
+
+        :param serial: Device serial number. Example: CNBRHMV3HG
+        :param mac: Device MAC address. Example: 20:4c:03:11:22:33
+        :param fields: Further add-device fields, such as part_number.
+        :return: {'serial': str, 'outcome': 'added' | 'rejected' | 'failed', 'reason': str}
+        :rtype: dict
+        :raises QuotaExhausted: The daily Central quota is used up.
+        """
+        if not mac:
+            # Central refuses it, asking would only split the batch it lands in
+            self.counters['devices'] += 1
+            self.counters['rejected'] += 1
+            return {'serial': serial, 'outcome': 'rejected', 'reason': 'no MAC address'}
+        if self._task is None:
+            self.start()
+        if serial in self._pending:
+            return await asyncio.shield(self._pending[serial][1])
+        future = asyncio.get_running_loop().create_future()
+        self._pending[serial] = (dict(fields, mac=mac, serial=serial), future)
+        self.counters['devices'] += 1
+        self._has_items.set()
+        if len(self._pending) >= self.batch_limit:
+            self._full.set()
+        return await asyncio.shield(future)
+
+    def _take(self):
+        serials = list(self._pending)[:self.batch_limit]
+        batch = [self._pending.pop(serial) for serial in serials]
+        if len(self._pending) < self.batch_limit:
+            self._full.clear()
+        if not self._pending:
+            self._has_items.clear()
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.batch_limit:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            await self._inflight.acquire()
+            batch = self._take()
+            if not batch:
+                self._inflight.release()
+                continue
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flush_done)
+
+    def _flush_done(self, flush):
+        self._flushes.discard(flush)
+        self._inflight.release()
+
+    async def _flush(self, batch):
+        self.counters['batches'] += 1
+        try:
+            outcomes = await self._add([device for device, _future in batch])
+        except QuotaExhausted as e:
+            # Not an outcome, the callers leave their alerts pending until the quota resets
+            self.counters['quota_exhausted'] += 1
+            logger.warning(f'Adding {len(batch)} devices held back: {e}')
+            for _device, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except Exception as e:
+            logger.error(f'Adding {len(batch)} devices failed: {e}')
+            outcomes = {device['serial']: ('failed', repr(e)) for device, _future in batch}
+        for device, future in batch:
+            outcome, reason = outcomes[device['serial']]
+            self.counters[outcome] += 1
+            if not future.done():
+                future.set_result({'serial': device['serial'], 'outcome': outcome, 'reason': reason})
+
+    def _call(self, devices):
+        return self.conn_provider.get().command(apiMethod="POST", apiPath=urls.DEVICE["ADD"], apiData=devices)
+
+    async def _add(self, devices, attempt: int = 1) -> dict:
+        """Add ``devices``, retrying them whole on retriable errors and splitting them on refusals.
+
+        :return: serial -> (outcome, reason)
+        :rtype: dict
+        """
+        self.counters['calls'] += 1
+        try:
+            # pycentral is blocking, keep it off the event loop
+            resp = await asyncio.to_thread(self._call, devices)
+            code, reason = resp.get('code'), f"{resp.get('code')}: {resp.get('msg')}"
+        except QuotaExhausted:
+            # Retrying can't help before the quota resets
+            raise
+        except Exception as e:
+            resp, code, reason = None, None, repr(e)
+        if code == 200:
+            rejected = rejected_serials(resp.get('msg'))
+            return {d['serial']: ('rejected', rejected[d['serial']]) if d['serial'] in rejected else ('added', '')
+                    for d in devices}
+        if code is None or code >= 500 or code == 429:
+            if attempt < self.max_attempts:
+                self.counters['retries'] += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+                return await self._add(devices, attempt + 1)
+            return {d['serial']: ('failed', reason) for d in devices}
+        if len(devices) > 1:
+            self.counters['splits'] += 1
+            half = len(devices) // 2
+            first, second = await asyncio.gather(self._add(devices[:half]), self._add(devices[half:]))
+            return dict(first, **second)
+        return {devices[0]['serial']: ('rejected', reason)}
+
+    def stats(self) -> dict:
+        return dict(self.counters, pending=len(self._pending))
@@ -0,0 +1,199 @@
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from pycentral.base_utils import console_logger
+
+logger = console_logger("RATE_LIMIT")
+
+# Bulk work (index reloads, reconciliation, config snapshots) sets this to
+# 'bulk' and leaves part of the shared bucket to interactive calls
+central_priority = contextvars.ContextVar('central_priority', default='interactive')
+
+
+@contextmanager
+def bulk_priority():
+    """Run the Central calls made inside the block (and threads started from it) as bulk work."""
+    token = central_priority.set('bulk')
+    try:
+        yield
+    finally:
+        central_priority.reset(token)
+
+
+class QuotaExhausted(Exception):
+    """The daily Central API quota for the customer is used up."""
+
+
+def seconds_until_quota_reset() -> float:
+    """Seconds until the daily quota keys roll over at midnight UTC."""
+    return 86400 - time.time() % 86400
+
+
+# Token bucket shared by every replica. Returns {1, 0} when the call may go
+# ahead, {0, wait_ms} when the caller has to wait and {-1, 0} once the daily
+# quota is gone. Bulk callers pass a reserve they are not allowed to dip into.
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[4])
+local daily_limit = tonumber(ARGV[5])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+if daily_limit > 0 and tonumber(redis.call('GET', KEYS[2]) or '0') + cost > daily_limit then
+    return {-1, 0}
+end
+local allowed = tokens - cost >= reserve
+if allowed then
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], 60000)
+if not allowed then
+    return {0, math.ceil((cost + reserve - tokens) * 1000 / rate)}
+end
+if daily_limit > 0 then
+    redis.call('INCRBY', KEYS[2], cost)
+    redis.call('EXPIRE', KEYS[2], 90000)
+end
+return {1, 0}
+"""
+
+
+class AdaptiveConcurrency(object):
+    """Concurrency limit that grows by one per limit's worth of successes and halves on a 429 (AIMD)."""
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= int(self.limit):
+                self._cond.wait()
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify()
+
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class CentralRateLimiter(object):
+    """Cluster-wide pacing of Aruba Central API calls.
+
+    Every call takes a token from a Redis token bucket shared by all replicas
+    (``rate`` calls per second, bursts of ``burst``) and counts against the
+    daily quota. Calls also hold a slot of an :class:`AdaptiveConcurrency`
+    limit that halves on every 429 and creeps back up on success. A 429 is
+    retried after its Retry-After (or an exponential backoff). Central's
+    X-RateLimit-Limit-second header, when present, replaces ``rate``.
+    """
+    def __init__(self, redis_client, customer: str, rate: float = 7, burst: int = 7,
+                 daily_limit: int = 5000, bulk_reserve: float = 0.3, max_retries: int = 5,
+                 concurrency: AdaptiveConcurrency = None):
+        """
+        :param redis_client: Instance of class:`redis.Redis` (synchronous, calls run in threads).
+        :param customer: Name the shared bucket is keyed on, one bucket per Central customer.
+        :param rate: Calls per second across all replicas.
+        :param burst: Bucket size.
+        :param daily_limit: Calls per day, 0 for no daily limit.
+        :param bulk_reserve: Share of the bucket bulk calls must leave for interactive ones.
+        :param max_retries: Retries of a call answered with 429.
+        """
+        self.redis = redis_client
+        self.customer = customer
+        self.rate = rate
+        self.burst = burst
+        self.daily_limit = daily_limit
+        self.bulk_reserve = bulk_reserve
+        self.max_retries = max_retries
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self._script = redis_client.register_script(TOKEN_BUCKET)
+        self.counters = {'calls': 0, 'throttled': 0, 'retries': 0, 'waited_seconds': 0.0}
+
+    def _keys(self):
+        day = time.strftime('%Y%m%d', time.gmtime())
+        return [f'central:ratelimit:{self.customer}', f'central:quota:{self.customer}:{day}']
+
+    def acquire(self, priority: str = None):
+        """Block until the shared bucket grants one call."""
+        priority = priority or central_priority.get()
+        reserve = self.burst * self.bulk_reserve if priority == 'bulk' else 0
+        while True:
+            allowed, wait_ms = self._script(keys=self._keys(),
+                                            args=[self.rate, self.burst, 1, reserve, self.daily_limit])
+            if allowed == 1:
+                return
+            if allowed == -1:
+                raise QuotaExhausted(f'Daily Central API quota of {self.daily_limit} used up for {self.customer}, '
+                                     f'it resets in {seconds_until_quota_reset():.0f}s')
+            wait = wait_ms / 1000 + random.uniform(0, 0.05)
+            self.counters['waited_seconds'] += wait
+            time.sleep(wait)
+
+    def quota_reset_in(self) -> float:
+        """Seconds until the daily quota resets when it is used up, 0 while calls are left."""
+        if not self.daily_limit:
+            return 0
+        used = int(self.redis.get(self._keys()[1]) or 0)
+        return seconds_until_quota_reset() if used >= self.daily_limit else 0
+
+    def _observe_headers(self, headers):
+        limit = headers.get('x-ratelimit-limit-second')
+        if limit and float(limit) != self.rate:
+            logger.info(f'Central reports a limit of {limit} calls per second')
+            self.rate = float(limit)
+            self.burst = max(1, int(float(limit)))
+        if headers.get('x-ratelimit-remaining-second') == '0':
+            self.concurrency.on_throttle()
+
+    def call(self, fn):
+        """Run ``fn`` (a ``conn.command`` call) within the rate limit.
+
+        :param fn: Callable returning the pycentral response dict.
+        :return: Response of the last attempt.
+        :rtype: dict
+        """
+        for attempt in range(self.max_retries + 1):
+            self.concurrency.acquire()
+            try:
+                self.acquire()
+                self.counters['calls'] += 1
+                resp = fn()
+            finally:
+                self.concurrency.release()
+            headers = {k.lower(): v for k, v in ((resp.get('headers') if isinstance(resp, dict) else None) or {}).items()}
+            self._observe_headers(headers)
+            if not isinstance(resp, dict) or resp.get('code') != 429:
+                self.concurrency.on_success()
+                return resp
+            self.counters['throttled'] += 1
+            self.concurrency.on_throttle()
+            if attempt == self.max_retries:
+                break
+            self.counters['retries'] += 1
+            retry_after = headers.get('retry-after')
+            wait = float(retry_after) if retry_after else min(30, 0.5 * 2 ** attempt)
+            time.sleep(wait + random.uniform(0, 0.25))
+        return resp
+
+    def stats(self) -> dict:
+        return dict(self.counters, rate=self.rate, concurrency_limit=round(self.concurrency.limit, 2))
@@ -0,0 +1,142 @@
+import asyncio
+from pycentral.monitoring import Sites
+from pycentral.base_utils import console_logger
+from helpers.central_utils.rate_limit import bulk_priority
+
+logger = console_logger("SITE_INDEX")
+
+
+async def list_sites(conn_provider, page_size: int = 1000, max_parallel_pages: int = 4, sites: Sites = None) -> list:
+    """List every site in Central, fetching the pages after the first concurrently.
+
+    :param conn_provider: Object with a ``get()`` method returning a Central connection.
+    :param page_size: Sites requested per page.
+    :param max_parallel_pages: Pages fetched at once after the first.
+    :return: Site records as Central returns them (site_id, site_name, address, city, ...).
+    :rtype: list
+    """
+    sites = sites or Sites()
+
+    def get_page(offset):
+        resp = sites.get_sites(conn_provider.get(), calculate_total=True, offset=offset, limit=page_size)
+        if resp.get('code') != 200:
+            raise RuntimeError(f'Listing sites at offset {offset} failed: {resp}')
+        return resp['msg']
+
+    first = await asyncio.to_thread(get_page, 0)
+    pages = [first]
+    total = first.get('total') or len(first.get('sites', []))
+    offsets = list(range(page_size, total, page_size))
+    semaphore = asyncio.Semaphore(max_parallel_pages)
+
+    async def fetch(offset):
+        async with semaphore:
+            return await asyncio.to_thread(get_page, offset)
+
+    pages += await asyncio.gather(*(fetch(offset) for offset in offsets))
+    return [s for page in pages for s in page.get('sites', [])]
+
+
+class SiteIndex(object):
+    """Site name to site id index for Aruba Central.
+
+    The index is bulk-loaded from Central with concurrent paginated calls, kept
+    in memory and mirrored to a Redis hash so every replica of the site worker
+    shares it. Callers keep it current with :meth:`set` / :meth:`remove` after
+    their own create and delete calls, and :meth:`revalidate_forever`
+    periodically reloads it from Central to pick up changes made elsewhere.
+    """
+    def __init__(self, redis_client, conn_provider, key: str = 'central:sites',
+                 page_size: int = 1000, max_parallel_pages: int = 4):
+        """
+        :param redis_client: Instance of class:`redis.asyncio.Redis` with decode_responses=True.
+        :param conn_provider: Object with a ``get()`` method returning a Central connection.
+        :param key: Redis hash holding site_name -> site_id.
+        :param page_size: Sites requested per page.
+        :param max_parallel_pages: Pages fetched at once after the first.
+        """
+        self.redis = redis_client
+        self.conn_provider = conn_provider
+        self.key = key
+        self.page_size = page_size
+        self.max_parallel_pages = max_parallel_pages
+        self.sites = Sites()
+        self._index = {}
+        self.counters = {'hits': 0, 'redis_hits': 0, 'misses': 0, 'reloads': 0}
+
+    async def fetch_all(self) -> dict:
+        """List every site in Central, fetching the remaining pages concurrently.
+
+        :return: site_name -> site_id for every site.
+        :rtype: dict
+        """
+        sites = await list_sites(self.conn_provider, self.page_size, self.max_parallel_pages, self.sites)
+        return {s['site_name']: str(s['site_id']) for s in sites}
+
+    async def reload(self):
+        """Rebuild the index from Central and replace the shared Redis copy."""
+        with bulk_priority():
+            index = await self.fetch_all()
+        staging = f'{self.key}:staging'
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(staging)
+        if index:
+            pipe.hset(staging, mapping=index)
+            pipe.rename(staging, self.key)
+        else:
+            pipe.delete(self.key)
+        await pipe.execute()
+        self._index = index
+        self.counters['reloads'] += 1
+        logger.info(f'Site index loaded with {len(index)} sites')
+
+    async def load(self):
+        """Load the shared index from Redis, or from Central if no replica has built it yet."""
+        index = await self.redis.hgetall(self.key)
+        if index:
+            self._index = index
+            logger.info(f'Site index loaded from Redis with {len(index)} sites')
+        else:
+            await self.reload()
+
+    async def get(self, site_name: str):
+        """Return the site id for ``site_name``, asking Central only if no replica knows it.
+
+        :param site_name: Central site name. Example: JA Branch 01
+        :type site_name: str
+        :return: Site id or None when the site does not exist.
+        :rtype: str
+        """
+        site_id = self._index.get(site_name)
+        if site_id:
+            self.counters['hits'] += 1
+            return site_id
+        site_id = await self.redis.hget(self.key, site_name)
+        if site_id:
+            self.counters['redis_hits'] += 1
+            self._index[site_name] = site_id
+            return site_id
+        self.counters['misses'] += 1
+        site_id = await asyncio.to_thread(self.sites.find_site_id, conn=self.conn_provider.get(), site_name=site_name)
+        if site_id:
+            await self.set(site_name, site_id)
+        return site_id
+
+    async def set(self, site_name: str, site_id):
+        self._index[site_name] = str(site_id)
+        await self.redis.hset(self.key, site_name, str(site_id))
+
+    async def remove(self, site_name: str):
+        self._index.pop(site_name, None)
+        await self.redis.hdel(self.key, site_name)
+
+    async def revalidate_forever(self, interval: int = 3600):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f'Site index revalidation failed: {e}')
+
+    def stats(self) -> dict:
+        return dict(self.counters, sites=len(self._index))
@@ -0,0 +1,247 @@
+import time
+import asyncio
+import hashlib
+from pycentral.monitoring import Sites
+from pycentral.base_utils import console_logger
+from helpers.address import AddressNormalizer, AddressError
+from helpers.central_utils.site_index import list_sites
+from helpers.central_utils.rate_limit import bulk_priority
+
+logger = console_logger("SITE_RECONCILE")
+
+# Central sites managed by the site worker are named after the Netbox site with this prefix
+SITE_PREFIX = 'JA '
+COUNTRY = 'United States'
+ADDRESS_FIELDS = ('address', 'city', 'state', 'country', 'zipcode')
+
+
+def address_digest(site_address: dict) -> bytes:
+    """Digest of an address that ignores case, line breaks and repeated whitespace."""
+    canonical = '\x1f'.join(' '.join(str(site_address.get(field) or '').split()).lower()
+                            for field in ADDRESS_FIELDS)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+
+def diff_sites(desired: dict, actual: dict, skipped=()) -> dict:
+    """Calls that bring Central from ``actual`` to ``desired``, in one pass over each side.
+
+    :param desired: Central site name -> site_address wanted in Central.
+    :param actual: Central site name -> (site_id, site_address) found in Central.
+    :param skipped: Names that exist in Netbox but have no usable address; they
+        are neither updated nor deleted.
+    :return: create [(name, site_address)], update [(site_id, name, site_address)],
+        delete [(site_id, name)] and the number of unchanged sites.
+    :rtype: dict
+    """
+    plan = {'create': [], 'update': [], 'delete': [], 'unchanged': 0}
+    for name, site_address in desired.items():
+        current = actual.get(name)
+        if current is None:
+            plan['create'].append((name, site_address))
+        elif address_digest(current[1]) != address_digest(site_address):
+            plan['update'].append((current[0], name, site_address))
+        else:
+            plan['unchanged'] += 1
+    skipped = set(skipped)
+    plan['delete'] = [(site_id, name) for name, (site_id, _) in actual.items()
+                      if name not in desired and name not in skipped]
+    return plan
+
+
+class SiteReconciler(object):
+    """Bring the Central sites managed from Netbox back in line with Netbox in bulk.
+
+    Both sides are listed with concurrent paginated calls, Netbox addresses go
+    through the same usaddress parsing as the cmdb worker, and the two sets
+    are compared locally by name and address digest. Only the sites that
+    differ cost a Central call. Central calls run as bulk work so they share
+    the rate limiter's bucket without starving the workers, and a missing or
+    truncated Netbox listing can't delete more than ``max_delete_ratio`` of
+    the managed sites.
+    """
+    def __init__(self, nb, conn_provider, normalizer: AddressNormalizer = None, site_index=None,
+                 prefix: str = SITE_PREFIX, page_size: int = 1000, netbox_page_size: int = 1000,
+                 max_parallel_pages: int = 4, max_parallel_calls: int = 4, max_delete_ratio: float = 0.2):
+        """
+        :param nb: Instance of class:`pynetbox.api`.
+        :param conn_provider: Object with a ``get()`` method returning a Central connection.
+        :param normalizer: Address parser, a fresh class:`AddressNormalizer` by default.
+        :param site_index: Optional class:`SiteIndex` kept current with the creates and deletes.
+        :param prefix: Prefix of the Central site names that are managed from Netbox.
+        :param page_size: Central sites requested per page.
+        :param netbox_page_size: Netbox sites requested per page.
+        :param max_parallel_pages: Pages fetched at once after the first, on each side.
+        :param max_parallel_calls: Central create, update and delete calls in flight at once.
+        :param max_delete_ratio: Largest share of the managed Central sites deleted in one run.
+        """
+        self.nb = nb
+        self.conn_provider = conn_provider
+        self.normalizer = normalizer or AddressNormalizer(maxsize=16384)
+        self.site_index = site_index
+        self.prefix = prefix
+        self.page_size = page_size
+        self.netbox_page_size = netbox_page_size
+        self.max_parallel_pages = max_parallel_pages
+        self.max_parallel_calls = max_parallel_calls
+        self.max_delete_ratio = max_delete_ratio
+        self.sites = Sites()
+
+    def _netbox_page(self, offset: int) -> list:
+        records = self.nb.dcim.sites.filter(limit=self.netbox_page_size, offset=offset)
+        return [(record.name, record.physical_address) for record in records]
+
+    async def netbox_sites(self) -> dict:
+        """List every Netbox site, fetching the pages concurrently.
+
+        :raises RuntimeError: Fewer sites came back than Netbox counted.
+        :return: site name -> physical address.
+        :rtype: dict
+        """
+        total = await asyncio.to_thread(self.nb.dcim.sites.count)
+        semaphore = asyncio.Semaphore(self.max_parallel_pages)
+
+        async def fetch(offset):
+            async with semaphore:
+                return await asyncio.to_thread(self._netbox_page, offset)
+
+        pages = await asyncio.gather(*(fetch(offset) for offset in range(0, total, self.netbox_page_size)))
+        sites = {name: address for page in pages for name, address in page}
+        if len(sites) < total:
+            raise RuntimeError(f'Netbox counted {total} sites but listed {len(sites)}')
+        return sites
+
+    async def central_sites(self) -> dict:
+        """List the managed Central sites.
+
+        :return: Central site name -> (site_id, site_address).
+        :rtype: dict
+        """
+        sites = await list_sites(self.conn_provider, self.page_size, self.max_parallel_pages, self.sites)
+        return {s['site_name']: (str(s['site_id']), {field: s.get(field) for field in ADDRESS_FIELDS})
+                for s in sites if s['site_name'].startswith(self.prefix)}
+
+    def desired_sites(self, netbox: dict):
+        """Central site names and addresses wanted for the Netbox sites.
+
+        :param netbox: site name -> physical address.
+        :return: Central site name -> site_address, and Central site name -> reason
+            for the sites left alone because their address is missing or can't be parsed.
+        :rtype: tuple
+        """
+        names = [name for name, raw in netbox.items() if raw and raw.strip()]
+        invalid = {f'{self.prefix}{name}': 'no physical address' for name, raw in netbox.items()
+                   if not (raw and raw.strip())}
+        desired = {}
+        for name, parsed in zip(names, self.normalizer.normalize_many(netbox[name] for name in names)):
+            if isinstance(parsed, AddressError):
+                invalid[f'{self.prefix}{name}'] = str(parsed)
+                continue
+            desired[f'{self.prefix}{name}'] = {
+                'address': parsed['address'],
+                'city': parsed['city'],
+                'state': parsed['state'],
+                'country': COUNTRY,
+                'zipcode': parsed['zipcode'],
+            }
+        return desired, invalid
+
+    async def plan(self) -> dict:
+        """List both sides, parse the Netbox addresses and diff them. See :func:`diff_sites`.
+
+        The plan also carries the ``invalid`` sites and the ``netbox`` and
+        ``central`` site counts.
+        """
+        netbox, central = await asyncio.gather(self.netbox_sites(), self.central_sites())
+        # The CRF tagger is CPU bound, keep it off the event loop
+        desired, invalid = await asyncio.to_thread(self.desired_sites, netbox)
+        for name, reason in invalid.items():
+            logger.warning(f'Leaving {name} alone: {reason}')
+        plan = diff_sites(desired, central, skipped=invalid)
+        plan.update(invalid=invalid, netbox=len(netbox), central=len(central))
+        return plan
+
+    async def _call(self, method, **kwargs):
+        resp = await asyncio.to_thread(method, conn=self.conn_provider.get(), **kwargs)
+        return resp if isinstance(resp, dict) else {'code': None, 'msg': resp}
+
+    async def _create(self, name, site_address):
+        resp = await self._call(self.sites.create_site, site_name=name, site_address=site_address)
+        if resp.get('code') == 200 and self.site_index is not None and 'site_id' in (resp.get('msg') or {}):
+            await self.site_index.set(name, resp['msg']['site_id'])
+        return resp
+
+    async def _update(self, site_id, name, site_address):
+        return await self._call(self.sites.update_site, site_id=site_id, site_name=name, site_address=site_address)
+
+    async def _delete(self, site_id, name):
+        resp = await self._call(self.sites.delete_site, site_id=site_id)
+        if resp.get('code') == 200 and self.site_index is not None:
+            await self.site_index.remove(name)
+        return resp
+
+    async def apply(self, plan: dict) -> dict:
+        """Make the create, update and delete calls of ``plan``.
+
+        :return: Calls that succeeded per kind, plus ``failed`` as a list of
+            (kind, site name, response).
+        :rtype: dict
+        """
+        done = {'create': 0, 'update': 0, 'delete': 0, 'failed': []}
+        semaphore = asyncio.Semaphore(self.max_parallel_calls)
+
+        async def run(kind, name, call):
+            async with semaphore:
+                try:
+                    resp = await call
+                except Exception as e:
+                    resp = {'code': None, 'msg': str(e)}
+            if resp.get('code') == 200:
+                done[kind] += 1
+            else:
+                logger.error(f'{kind} of {name} failed: {resp}')
+                done['failed'].append((kind, name, resp))
+
+        calls = [run('create', name, self._create(name, address)) for name, address in plan['create']]
+        calls += [run('update', name, self._update(site_id, name, address)) for site_id, name, address in plan['update']]
+        calls += [run('delete', name, self._delete(site_id, name)) for site_id, name in plan['delete']]
+        # Reconciliation must leave part of the shared bucket to the workers
+        with bulk_priority():
+            await asyncio.gather(*calls)
+        return done
+
+    async def run(self, dry_run: bool = True) -> dict:
+        """Reconcile Central with Netbox.
+
+        :param dry_run: Only work out and log the calls that would be made.
+        :return: Counts of the Netbox and managed Central sites, the calls
+            planned and, unless ``dry_run``, made. With ``dry_run`` the plan
+            itself is included.
+        :rtype: dict
+        """
+        start = time.perf_counter()
+        plan = await self.plan()
+        summary = {'netbox': plan['netbox'], 'central': plan['central'], 'unchanged': plan['unchanged'],
+                   'invalid': len(plan['invalid']), 'create': len(plan['create']), 'update': len(plan['update']),
+                   'delete': len(plan['delete']), 'delete_held': 0}
+        if len(plan['delete']) > self.max_delete_ratio * max(plan['central'], 1):
+            logger.error(f"Holding back {len(plan['delete'])} of {plan['central']} site deletes, "
+                         f"more than {self.max_delete_ratio:.0%}. Check Netbox or raise the ratio.")
+            summary['delete_held'] = len(plan['delete'])
+            plan['delete'] = []
+        summary['plan_seconds'] = round(time.perf_counter() - start, 3)
+        if dry_run:
+            for name, _ in plan['create']:
+                logger.info(f'Would create {name}')
+            for _, name, _ in plan['update']:
+                logger.info(f'Would update {name}')
+            for _, name in plan['delete']:
+                logger.info(f'Would delete {name}')
+            summary['plan'] = plan
+        else:
+            done = await self.apply(plan)
+            summary.update(created=done['create'], updated=done['update'], deleted=done['delete'],
+                           failed=len(done['failed']))
+        summary['seconds'] = round(time.perf_counter() - start, 3)
+        counts = {k: v for k, v in summary.items() if k != 'plan'}
+        logger.info(f'Site reconciliation {"dry run " if dry_run else ""}finished: {counts}')
+        return summary
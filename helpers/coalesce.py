@@ -0,0 +1,250 @@
+import time
+import uuid
+import asyncio
+from loguru import logger
+from helpers import fast_json
+
+# Fields that identify an alert rather than describe a change
+IDENTITY_FIELDS = ('event', 'model', 'device_type', 'serial', 'name', 'group', 'device', 'cluster')
+
+
+def alert_entity(key: str, alert: dict):
+    """Return the entity an alert is about, or None if it should not be coalesced.
+
+    :param key: Stream the alert goes to. Example: cmdb:alert
+    :param alert: Alert fields.
+    """
+    match key, alert:
+        case 'config:alert', {'group': group}:
+            return f'group:{group}'
+        case _, {'serial': serial}:
+            return f'serial:{serial}'
+        case 'cmdb:alert', {'model': 'site', 'name': name}:
+            return f'site:{name}'
+    return None
+
+
+def merge_alerts(current: dict, new: dict) -> dict:
+    """Merge a newer alert for the same entity into ``current``.
+
+    The newer value of every field wins and fields only present in the older
+    alert are kept, so the result carries the union of changed fields. A
+    ``created`` followed by updates stays ``created``.
+    """
+    merged = dict(current)
+    merged.update(new)
+    if current.get('event') == 'created' and new.get('event') == 'updated':
+        merged['event'] = 'created'
+    return merged
+
+
+def coalesced(alert: dict, count: int) -> dict:
+    """The alert written for a burst of ``count`` merged alerts."""
+    return dict(alert, coalesced=count) if count > 1 else alert
+
+
+class StagedAlerts(object):
+    """Copy of the alerts a class:`Coalescer` holds, in a Redis hash.
+
+    An alert answered before its merged alert is written is saved here first,
+    so a crash, a redeploy or an emit that keeps failing does not lose it.
+    Copies not removed ``orphan_after`` seconds after they were last saved are
+    claimed with ``SET NX EX`` by one replica and emitted again.
+    """
+    def __init__(self, redis_client, key: str = 'webhook:coalesce:staged', orphan_after: float = 60.0):
+        """
+        :param redis_client: Instance of class:`redis.asyncio.Redis` with decode_responses=True.
+        :param key: Redis hash holding the staged alerts, one field per held burst.
+        :param orphan_after: Seconds after which a staged alert is emitted by whoever finds it.
+        """
+        self.redis = redis_client
+        self.key = key
+        self.orphan_after = orphan_after
+
+    async def save(self, slot: str, key: str, alert: dict, count: int):
+        await self.redis.hset(self.key, slot, fast_json.dumps({'key': key, 'alert': alert, 'count': count,
+                                                                'saved': time.time()}))
+
+    async def remove(self, slot: str):
+        await self.redis.hdel(self.key, slot)
+
+    async def claim_orphans(self) -> list:
+        """Return ``(slot, key, alert, count)`` of the staged alerts left behind, claimed by this replica."""
+        now = time.time()
+        orphans = []
+        for slot, value in (await self.redis.hgetall(self.key)).items():
+            staged = fast_json.loads(value)
+            if now - staged['saved'] < self.orphan_after:
+                continue
+            # Claimed until the next sweep could retry it, a claim left by a crash expires
+            if await self.redis.set(f'{self.key}:claim:{slot}', 1, nx=True, ex=max(1, int(self.orphan_after))):
+                orphans.append((slot, staged['key'], staged['alert'], staged['count']))
+        return orphans
+
+
+class Coalescer(object):
+    """Debounce bursts of alerts for the same entity into a single alert.
+
+    Alerts for an entity are merged until no new one has arrived for ``window``
+    seconds, or ``max_wait`` seconds after the first, then ``emit(key, alert)``
+    is called once. Callers either wait for that emit and get its result, or
+    only stage the alert and return straight away while the merged alert is
+    written in the background. A failed background emit is retried ``retries``
+    times with backoff. With ``staged``, a staged alert is saved to Redis
+    before :meth:`submit` returns and an emit that still fails is left there
+    for :meth:`recover` to retry; without, it is logged and dropped.
+    """
+    def __init__(self, emit, window: float = 1.0, max_wait: float = 5.0, entity_func=alert_entity,
+                 retries: int = 3, staged: StagedAlerts = None):
+        """
+        :param emit: Coroutine function ``emit(key, alert)`` writing the merged alert.
+        :param window: Quiet period in seconds that ends a burst. 0 disables coalescing.
+        :param max_wait: Upper bound in seconds on how long an alert is held.
+        :param entity_func: ``entity_func(key, alert)`` naming the entity, None to pass through.
+        :param retries: Extra emit attempts, 0.5 s apart and doubling, before an emit fails.
+        :param staged: Optional class:`StagedAlerts` keeping staged alerts durable.
+        """
+        self.emit = emit
+        self.window = window
+        self.max_wait = max_wait
+        self.entity_func = entity_func
+        self.retries = retries
+        self.staged = staged
+        self._pending = {}
+        self._flushes = set()
+        self.counters = {'received': 0, 'emitted': 0, 'held_seconds': 0.0, 'max_held_seconds': 0.0,
+                         'emit_retries': 0, 'dropped': 0, 'deferred': 0, 'recovered': 0}
+
+    async def submit(self, key: str, alert: dict, wait: bool = True):
+        """Queue an alert.
+
+        :param key: Stream the alert goes to. Example: cmdb:alert
+        :param alert: Alert fields.
+        :param wait: Wait until the merged alert has been written. Without, an
+            alert that is coalesced is only staged, saved to ``staged`` if
+            given, and None is returned; alerts that are not coalesced are
+            still written before returning.
+        :return: The result of the emit that wrote the alert.
+        """
+        self.counters['received'] += 1
+        entity = self.entity_func(key, alert) if self.window > 0 else None
+        if entity is None:
+            self.counters['emitted'] += 1
+            return await self.emit(key, alert)
+        now = time.monotonic()
+        pending = self._pending.get((key, entity))
+        if pending is None:
+            pending = {'alert': alert, 'first': now, 'last': now, 'count': 0, 'arrived': 0.0, 'waiters': 0,
+                       'slot': uuid.uuid4().hex, 'saved': False, 'lock': asyncio.Lock(),
+                       'future': asyncio.get_running_loop().create_future()}
+            self._pending[(key, entity)] = pending
+            flush = asyncio.create_task(self._flush_when_quiet(key, entity))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        else:
+            pending['alert'] = merge_alerts(pending['alert'], alert)
+            pending['last'] = now
+        pending['count'] += 1
+        # Sum of the arrival times, each alert's hold is worked out once the burst is written
+        pending['arrived'] += now
+        if not wait:
+            if self.staged is not None:
+                # Saves run one at a time and each writes the latest merge, so the last one wins
+                async with pending['lock']:
+                    await self.staged.save(pending['slot'], key, pending['alert'], pending['count'])
+                    pending['saved'] = True
+            return None
+        pending['waiters'] += 1
+        return await asyncio.shield(pending['future'])
+
+    async def _flush_when_quiet(self, key, entity):
+        pending = self._pending[(key, entity)]
+        while True:
+            deadline = min(pending['last'] + self.window, pending['first'] + self.max_wait)
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        del self._pending[(key, entity)]
+        # Saves already merged into this burst finish before it is written
+        async with pending['lock']:
+            pass
+        if pending['count'] > 1:
+            logger.info(f'Coalesced {pending["count"]} alerts for {entity} on {key}')
+        self.counters['emitted'] += 1
+        try:
+            pending['future'].set_result(await self._emit_with_retries(key, coalesced(pending['alert'], pending['count'])))
+        except Exception as e:
+            if pending['waiters']:
+                pending['future'].set_exception(e)
+            if pending['saved']:
+                # The senders were told it was received, the saved copy is retried by recover()
+                self.counters['deferred'] += 1
+                logger.error(f'Coalesced alert for {entity} on {key} not written after {self.retries + 1} attempts, '
+                             f'left staged: {e}')
+            elif not pending['waiters']:
+                self.counters['dropped'] += 1
+                logger.error(f'Dropping coalesced alert for {entity} on {key} after {self.retries + 1} attempts: '
+                             f'{e} {pending["alert"]}')
+            return
+        # Every merged alert was held from its arrival until now, waited on or not
+        written = time.monotonic()
+        self.counters['held_seconds'] += pending['count'] * written - pending['arrived']
+        self.counters['max_held_seconds'] = max(self.counters['max_held_seconds'], written - pending['first'])
+        if pending['saved']:
+            await self._remove_staged(pending['slot'])
+
+    async def _emit_with_retries(self, key, alert):
+        delay = 0.5
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.emit(key, alert)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f'Writing coalesced alert on {key} failed, retrying in {delay}s: {e}')
+            self.counters['emit_retries'] += 1
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    async def _remove_staged(self, slot):
+        try:
+            await self.staged.remove(slot)
+        except Exception as e:
+            # Written twice at worst, once the copy is found by recover()
+            logger.warning(f'Unable to remove staged alert {slot}: {e}')
+
+    async def recover(self):
+        """Emit the staged alerts left behind by a crashed replica or a failed emit."""
+        for slot, key, alert, count in await self.staged.claim_orphans():
+            try:
+                await self.emit(key, coalesced(alert, count))
+            except Exception as e:
+                logger.error(f'Staged alert on {key} still not written, retried later: {e}')
+                continue
+            self.counters['recovered'] += 1
+            logger.info(f'Recovered staged alert on {key}')
+            await self._remove_staged(slot)
+
+    async def recover_forever(self, interval: float = None):
+        """Run :meth:`recover` every ``interval`` seconds, default half of ``orphan_after``."""
+        interval = interval or self.staged.orphan_after / 2
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.error(f'Recovering staged alerts failed: {e}')
+
+    async def flush_all(self):
+        """Emit everything still held and wait for it to be written, used on shutdown."""
+        for pending in list(self._pending.values()):
+            pending['first'] = pending['last'] = -self.max_wait
+        while self._flushes:
+            await asyncio.gather(*self._flushes)
+
+    def stats(self) -> dict:
+        received, emitted = self.counters['received'], self.counters['emitted']
+        return dict(self.counters,
+                    collapse_ratio=round(1 - emitted / received, 3) if received else 0.0,
+                    avg_added_latency_ms=round(self.counters['held_seconds'] * 1000 / received, 3) if received else 0.0)
@@ -0,0 +1,82 @@
+import time
+import hashlib
+from collections import OrderedDict
+from loguru import logger
+
+
+def body_key(sender: str, body: bytes) -> str:
+    """Delivery key for senders without a delivery id, from a hash of the raw body."""
+    return f'{sender}:{hashlib.blake2b(body, digest_size=16).hexdigest()}'
+
+
+class DeliveryDeduplicator(object):
+    """Recognise webhook deliveries that were already received.
+
+    A delivery key is claimed with ``SET NX EX`` in Redis and kept in a bounded
+    in-process set of recently claimed keys, so a retry is recognised by the
+    replica that claimed it without a round trip and by any other replica
+    through Redis. Keys are remembered for ``ttl`` seconds. The local set
+    holds at most ``max_local`` keys, the least recently claimed are dropped
+    first and are still caught by Redis. If Redis cannot be reached the
+    delivery is treated as new.
+    """
+    def __init__(self, redis_client, ttl: int = 600, max_local: int = 10000, prefix: str = 'webhook:delivery:'):
+        """
+        :param redis_client: Instance of class:`redis.asyncio.Redis`.
+        :param ttl: Seconds a delivery key is remembered.
+        :param max_local: Keys kept in memory.
+        :param prefix: Redis key prefix.
+        """
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_local = max_local
+        self.prefix = prefix
+        self._recent = OrderedDict()
+        self.counters = {'checked': 0, 'duplicates_local': 0, 'duplicates_redis': 0, 'released': 0,
+                         'redis_errors': 0}
+
+    def _remember(self, key: str):
+        self._recent[key] = time.monotonic() + self.ttl
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_local:
+            self._recent.popitem(last=False)
+
+    async def claim(self, key: str) -> bool:
+        """Claim a delivery key.
+
+        :param key: Delivery key. Example: central:<customer id>:<delivery id>
+        :return: True for a new delivery, False for a duplicate.
+        :rtype: bool
+        """
+        self.counters['checked'] += 1
+        expires = self._recent.get(key)
+        if expires is not None:
+            if expires > time.monotonic():
+                self.counters['duplicates_local'] += 1
+                return False
+            del self._recent[key]
+        try:
+            claimed = await self.redis.set(f'{self.prefix}{key}', 1, nx=True, ex=self.ttl)
+        except Exception as e:
+            self.counters['redis_errors'] += 1
+            logger.warning(f'Delivery de-duplication unavailable, treating {key} as new: {e}')
+            claimed = True
+        if not claimed:
+            # Not remembered locally, the replica that claimed it may still release it
+            self.counters['duplicates_redis'] += 1
+            return False
+        self._remember(key)
+        return True
+
+    async def release(self, key: str):
+        """Forget a claimed key, so a retry of a delivery that was not processed is accepted."""
+        self.counters['released'] += 1
+        self._recent.pop(key, None)
+        try:
+            await self.redis.delete(f'{self.prefix}{key}')
+        except Exception as e:
+            self.counters['redis_errors'] += 1
+            logger.warning(f'Unable to release delivery {key}: {e}')
+
+    def stats(self) -> dict:
+        return dict(self.counters, local=len(self._recent))
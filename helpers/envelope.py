@@ -0,0 +1,142 @@
+"""Versioned envelope for Redis stream entries.
+
+Every entry written by the receiver and the workers carries the same fields:
+
+    v     schema version. Example: 1
+    type  event type. Example: device.updated
+    key   entity the event is about. Example: serial:CN12345678
+    ts    epoch milliseconds the event was ingested
+    body  the alert itself, msgpack encoded (JSON when msgpack is not installed)
+
+Nested values such as a snapshot diff survive the round trip, and because
+every entry has the same field names Redis stores them once per stream node
+instead of once per entry. Entries written before the envelope (flat string
+field maps without ``v``) decode too, with their fields as the body, so old and
+new producers and consumers can run side by side during a rollout. Set
+STREAM_ENVELOPE=false on the producers to keep writing flat entries until
+every consumer understands the envelope.
+
+Redis clients that read envelopes with decode_responses=True must be created
+with encoding_errors='surrogateescape', so the binary body survives decoding.
+"""
+import os
+import time
+from helpers import fast_json
+from helpers.coalesce import alert_entity
+
+# msgpack is optional, like orjson in fast_json
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+VERSION = 1
+BODY_CODEC = 'msgpack' if msgpack else 'json'
+WRITE_ENVELOPE = os.environ.get('STREAM_ENVELOPE', 'true').lower() in ('1', 'true', 'yes')
+
+# Event type of alerts that do not name their event
+STREAM_EVENTS = {'config:alert': 'config.changed', 'device:alert': 'device.new'}
+
+
+class Envelope(object):
+    """A decoded stream entry. ``version`` is 0 for a flat entry written before the envelope."""
+    __slots__ = ('version', 'type', 'key', 'ts', 'body')
+
+    def __init__(self, type: str, key: str, body: dict, ts: int = None, version: int = VERSION):
+        self.version = version
+        self.type = type
+        self.key = key
+        self.ts = ts
+        self.body = body
+
+    def __repr__(self):
+        return f'Envelope(v{self.version} {self.type} {self.key} ts={self.ts} {self.body})'
+
+
+def event_type(stream: str, alert: dict) -> str:
+    """Event type of an alert. Example: site.created"""
+    event = alert.get('event')
+    if event is None:
+        return STREAM_EVENTS.get(stream, stream.split(':')[0])
+    model = alert.get('model') or ('device' if 'serial' in alert else 'site')
+    return f'{model}.{event}'
+
+
+def entity_key(stream: str, alert: dict):
+    """Entity an alert is about, as used for coalescing and per-entity ordering."""
+    entity = alert_entity(stream, alert)
+    if entity is None and alert.get('name'):
+        return f"site:{alert['name']}"
+    return entity
+
+
+def pack_body(body: dict) -> bytes:
+    if msgpack:
+        return msgpack.packb(body, default=str, use_bin_type=True)
+    return fast_json.dumps(body).encode('utf-8')
+
+
+def unpack_body(data) -> dict:
+    if isinstance(data, str):
+        data = data.encode('utf-8', 'surrogateescape')
+    # A JSON body is an object, a msgpack map never starts with '{'
+    if data[:1] == b'{':
+        return fast_json.loads(data)
+    if msgpack is None:
+        raise ValueError('Stream entry has a msgpack body but msgpack is not installed')
+    return msgpack.unpackb(data, raw=False)
+
+
+def encode(stream: str, alert: dict, type: str = None, key: str = None, ts: int = None) -> dict:
+    """Stream fields of an alert wrapped in the envelope.
+
+    :param stream: Stream the entry goes to. Example: cmdb:alert
+    :param alert: Alert fields, values may be nested.
+    :param type: Event type, derived from the alert when not given.
+    :param key: Entity key, derived from the alert when not given.
+    :param ts: Ingest time in epoch milliseconds. Default now.
+    :rtype: dict
+    """
+    return {
+        'v': VERSION,
+        'type': type or event_type(stream, alert),
+        'key': key or entity_key(stream, alert) or '',
+        'ts': ts or int(time.time() * 1000),
+        'body': pack_body(alert),
+    }
+
+
+def flatten(alert: dict) -> dict:
+    """Flat string field map of an alert, the format before the envelope."""
+    return {k: '' if v is None else v if isinstance(v, str) else fast_json.dumps(v) for k, v in alert.items()}
+
+
+def stream_fields(stream: str, alert: dict, **kwargs) -> dict:
+    """Fields to XADD for an alert: the envelope, or a flat map while STREAM_ENVELOPE=false."""
+    if WRITE_ENVELOPE:
+        return encode(stream, alert, **kwargs)
+    return flatten(alert)
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def decode(fields: dict, stream: str = None) -> Envelope:
+    """Decode a stream entry written with or without the envelope.
+
+    :param fields: Fields as returned by XREADGROUP.
+    :param stream: Stream the entry was read from, used to type and key flat entries.
+    :raises ValueError: The entry has a newer schema version than this code knows.
+    :rtype: Envelope
+    """
+    version = fields.get('v', fields.get(b'v'))
+    if version is None:
+        body = {_text(k): _text(v) for k, v in fields.items()}
+        return Envelope(event_type(stream or '', body), entity_key(stream or '', body), body, version=0)
+    version = int(version)
+    if version > VERSION:
+        raise ValueError(f'Stream entry has envelope version {version}, this code reads up to {VERSION}')
+    get = fields.get if 'body' in fields else lambda name: fields.get(name.encode())
+    return Envelope(_text(get('type')), _text(get('key')) or None, unpack_body(get('body')),
+                    ts=int(get('ts')) if get('ts') else None, version=version)
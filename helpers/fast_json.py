@@ -0,0 +1,23 @@
+import json
+
+# orjson is optional; it parses straight from bytes and is several times
+# faster than the standard library on large Netbox snapshot payloads.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+
+def loads(data):
+    """Parse JSON from ``bytes`` or ``str`` without an intermediate decode."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    if orjson:
+        return orjson.dumps(obj, default=str).decode('utf-8')
+    return json.dumps(obj, default=str)
@@ -0,0 +1,123 @@
+"""Priority lanes for the alert streams.
+
+An alert stream is split into three streams, one per lane:
+
+    high    <stream>:high   creates and deletes, such as a site just created
+    normal  <stream>        updates, the stream's original key
+    bulk    <stream>:bulk   alerts of an event type arriving faster than
+                            bulk_rate per window, such as a mass Netbox edit
+                            or import
+
+Producers pick the lane with :class:`LaneClassifier`, consumers read every
+lane with class:`helpers.stream_consumer.LaneConsumer`. An entity stays in
+the lowest lane it was put in for ``sticky`` seconds, so a delete can not
+overtake the bulk update of the same site queued before it. Set
+PRIORITY_LANES=false on the producers to write everything to the normal lane.
+"""
+import os
+import time
+from collections import deque, OrderedDict
+from helpers import envelope
+
+LANES = ('high', 'normal', 'bulk')
+DEFAULT_WEIGHTS = {'high': 8, 'normal': 3, 'bulk': 1}
+LANES_ENABLED = os.environ.get('PRIORITY_LANES', 'true').lower() in ('1', 'true', 'yes')
+# Streams whose consumers read every lane
+LANE_STREAMS = ('cmdb:alert', 'site:alert')
+HIGH_EVENTS = ('created', 'deleted', 'new')
+
+
+def lane_key(stream: str, lane: str) -> str:
+    """Stream key of a lane. Example: cmdb:alert:high"""
+    return stream if lane == 'normal' else f'{stream}:{lane}'
+
+
+def lane_stream(stream: str, lane: str) -> str:
+    """Stream key to write to in ``lane``: the lane's stream for laned streams, ``stream`` otherwise."""
+    if not LANES_ENABLED or stream not in LANE_STREAMS:
+        return stream
+    return lane_key(stream, lane)
+
+
+def parse_weights(spec: str) -> dict:
+    """Lane weights from a spec such as high=8,normal=3,bulk=1, defaults for lanes not named."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for part in (spec or '').split(','):
+        if '=' in part:
+            lane, weight = part.split('=', 1)
+            if lane.strip() not in weights:
+                raise ValueError(f'Unknown lane {lane.strip()!r} in {spec!r}')
+            weights[lane.strip()] = max(1, int(weight))
+    return weights
+
+
+class LaneClassifier(object):
+    """Pick the lane of an alert from its event type and how fast that event type arrives."""
+    def __init__(self, bulk_rate: int = 20, window: float = 10.0, sticky: float = 300.0,
+                 max_entities: int = 100000, enabled: bool = LANES_ENABLED):
+        """
+        :param bulk_rate: Alerts of one event type per ``window`` above which they go to the bulk lane.
+        :param window: Seconds the arrival rate is measured over.
+        :param sticky: Seconds an entity is kept from moving to a higher lane.
+        :param max_entities: Entities remembered for ``sticky``, the oldest are forgotten first.
+        :param enabled: False sends every alert to the normal lane.
+        """
+        self.bulk_rate = bulk_rate
+        self.window = window
+        self.sticky = sticky
+        self.max_entities = max_entities
+        self.enabled = enabled
+        self._arrivals = {}
+        self._entities = OrderedDict()
+        self.counters = {lane: 0 for lane in LANES}
+        self.counters['held_back'] = 0
+
+    def base_lane(self, stream: str, alert: dict) -> str:
+        event = envelope.event_type(stream, alert).rsplit('.', 1)[-1]
+        return 'high' if event in HIGH_EVENTS else 'normal'
+
+    def _storm(self, stream: str, alert: dict, now: float) -> bool:
+        arrivals = self._arrivals.setdefault((stream, envelope.event_type(stream, alert)), deque())
+        # A coalesced alert stands for every alert merged into it
+        for _ in range(min(int(alert.get('coalesced') or 1), self.bulk_rate + 1)):
+            arrivals.append(now)
+        while arrivals and arrivals[0] < now - self.window:
+            arrivals.popleft()
+        return len(arrivals) > self.bulk_rate
+
+    def _stick(self, entity: str, lane: str, now: float) -> str:
+        previous = self._entities.pop(entity, None)
+        if previous and now - previous[1] < self.sticky and LANES.index(previous[0]) > LANES.index(lane):
+            self.counters['held_back'] += 1
+            lane = previous[0]
+        self._entities[entity] = (lane, now)
+        while len(self._entities) > self.max_entities:
+            self._entities.popitem(last=False)
+        return lane
+
+    def classify(self, stream: str, alert: dict, now: float = None) -> str:
+        """Lane of ``alert`` on ``stream``.
+
+        :param stream: Stream the alert goes to. Example: cmdb:alert
+        :param alert: Alert fields.
+        :return: high, normal or bulk
+        :rtype: str
+        """
+        if not self.enabled:
+            return 'normal'
+        now = time.monotonic() if now is None else now
+        lane = 'bulk' if self._storm(stream, alert, now) else self.base_lane(stream, alert)
+        entity = envelope.entity_key(stream, alert)
+        if entity:
+            lane = self._stick(entity, lane, now)
+        self.counters[lane] += 1
+        return lane
+
+    def stream_for(self, stream: str, alert: dict) -> str:
+        """Stream key to write ``alert`` to: its lane's stream for laned streams, ``stream`` otherwise."""
+        if stream not in LANE_STREAMS:
+            return stream
+        return lane_key(stream, self.classify(stream, alert))
+
+    def stats(self) -> dict:
+        return dict(self.counters, entities=len(self._entities))
@@ -0,0 +1,221 @@
+"""Prometheus metrics shared by the webhook receiver and the workers.
+
+Hot paths only touch pre-created histogram and counter children. Component
+statistics (stream consumers, caches, batchers) are read from their
+``stats()`` at scrape time by :class:`StatsCollector` and cost nothing between
+scrapes.
+
+With WEB_CONCURRENCY above 1 the pre-forked receiver workers run in
+prometheus_client's multi-process mode: every process writes its samples to
+files in PROMETHEUS_MULTIPROC_DIR (a fresh temporary folder unless set) and
+a scrape adds them up, so every worker and the parent report the same
+totals. Component statistics are copied to those files by :func:`sync_stats`.
+"""
+import os
+import re
+import glob
+import asyncio
+import tempfile
+
+# prometheus_client chooses where values live when it is imported
+if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1 and not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='prometheus-')
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, start_http_server, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from loguru import logger
+
+# 100us to 10s, covers an HMAC check as well as a slow Central call
+BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+STAGE_SECONDS = Histogram('pipeline_stage_seconds', 'Time spent in each pipeline stage',
+                          ['service', 'stage'], buckets=BUCKETS)
+ALERTS = Counter('webhook_alerts', 'Webhooks received by sender, alert type or model and match outcome',
+                 ['sender', 'kind', 'outcome'])
+MESSAGES = Counter('stream_messages', 'Stream messages handled by a worker by match outcome',
+                   ['service', 'outcome'])
+CALL_SECONDS = Histogram('api_call_seconds', 'Central and Netbox API call latency',
+                         ['api', 'operation', 'status'], buckets=BUCKETS)
+
+
+def stage_observer(service: str):
+    """Return an ``observe(stage, seconds)`` function for class:`StageTimer`."""
+    children = {}
+
+    def observe(stage: str, seconds: float):
+        child = children.get(stage)
+        if child is None:
+            child = children[stage] = STAGE_SECONDS.labels(service, stage)
+        child.observe(seconds)
+    return observe
+
+
+def match_outcome(message) -> str:
+    """Outcome label of a match result: the stream it was sent to or why it was not."""
+    if isinstance(message, dict):
+        return message.get('key') or message.get('worker') or message.get('result') or 'unknown'
+    if message is None:
+        return 'error'
+    # Netbox matches that fall through return a 'DeadEnd:...' string
+    return 'Dead end'
+
+
+def count_alert(sender: str, kind, message):
+    ALERTS.labels(sender, kind or '', match_outcome(message)).inc()
+
+
+def count_message(service: str, outcome: str):
+    MESSAGES.labels(service, outcome).inc()
+
+
+def observe_call(api: str, operation: str, status, seconds: float):
+    CALL_SECONDS.labels(api, operation, str(status)).observe(seconds)
+
+
+class StatsCollector(object):
+    """Expose the numeric values of a component's ``stats()`` at scrape time.
+
+    Keys listed in ``counters`` are exported as counters, everything else as
+    gauges, each named ``<name>_<key>``.
+    """
+    def __init__(self, name: str, stats_fn, counters=(), labels: dict = None):
+        self.name = name
+        self.stats_fn = stats_fn
+        self.counters = set(counters)
+        self.labels = labels or {}
+        # Counter values already copied by sync()
+        self._synced = {}
+
+    def _values(self):
+        try:
+            stats = self.stats_fn()
+        except Exception as e:
+            logger.warning(f'Collecting {self.name} metrics failed: {e}')
+            return
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            yield key, re.sub(r'[^a-zA-Z0-9_]', '_', f'{self.name}_{key}'), value
+
+    def collect(self):
+        for key, name, value in self._values():
+            family = CounterMetricFamily if key in self.counters else GaugeMetricFamily
+            metric = family(name, f'{self.name} {key}', labels=list(self.labels))
+            metric.add_metric(list(self.labels.values()), value)
+            yield metric
+
+    def sync(self):
+        """Copy the current stats to the multi-process files, counters as increments since the last copy."""
+        for key, name, value in self._values():
+            if key in self.counters:
+                metric = _shared_metric(Counter, name, f'{self.name} {key}', list(self.labels))
+                last = self._synced.get(key, 0)
+                # A replaced component counts from zero again
+                increment = value - last if value >= last else value
+                self._synced[key] = value
+                if increment:
+                    (metric.labels(*self.labels.values()) if self.labels else metric).inc(increment)
+            else:
+                metric = _shared_metric(Gauge, name, f'{self.name} {key}', list(self.labels),
+                                        multiprocess_mode='liveall')
+                (metric.labels(*self.labels.values()) if self.labels else metric).set(value)
+
+
+# (name, labels) -> class:`StatsCollector`, one per exported component
+_exported = {}
+# Metric name -> Counter or Gauge the stats are copied to in multi-process mode
+_shared = {}
+
+
+def _shared_metric(cls, name: str, documentation: str, labelnames: list, **kwargs):
+    metric = _shared.get(name)
+    if metric is None:
+        metric = _shared[name] = cls(name, documentation, labelnames, registry=None, **kwargs)
+    return metric
+
+
+def export_stats(name: str, stats_fn, counters=(), labels: dict = None):
+    """Register a component's ``stats()`` with the default registry.
+
+    Exporting the same name and labels again, as the receiver does each time
+    its lifespan starts, points the existing collector at ``stats_fn``.
+    """
+    key = (name, tuple(sorted((labels or {}).items())))
+    collector = _exported.get(key)
+    if collector is not None:
+        collector.stats_fn = stats_fn
+        collector.counters = set(counters)
+        collector._synced = {}
+        return
+    collector = _exported[key] = StatsCollector(name, stats_fn, counters, labels)
+    if not MULTIPROCESS:
+        REGISTRY.register(collector)
+
+
+def sync_stats():
+    """Copy every exported component's stats to the multi-process files."""
+    if MULTIPROCESS:
+        for collector in list(_exported.values()):
+            collector.sync()
+
+
+async def sync_stats_forever(interval: float = None):
+    """Run :func:`sync_stats` every ``interval`` seconds, default $METRICS_SYNC_INTERVAL or 5."""
+    interval = interval or float(os.environ.get('METRICS_SYNC_INTERVAL', 5))
+    while True:
+        await asyncio.sleep(interval)
+        sync_stats()
+
+
+def export_consumer(stream):
+    """Register the counters and stream gauges (length, pending, lag) of a class:`StreamConsumer`."""
+    export_stats('stream_consumer', stream.stats, counters=tuple(stream.counters),
+                 labels={'stream': stream.stream_key, 'group': stream.group})
+
+
+def export_lane_consumer(lanes):
+    """Register every lane of a class:`LaneConsumer` and its scheduling counters."""
+    for stream in lanes.consumers.values():
+        export_consumer(stream)
+    export_stats('lane_consumer', lanes.stats, counters=tuple(lanes.counters),
+                 labels={'stream': lanes.stream_key, 'group': lanes.group})
+
+
+def scrape_registry():
+    """The default registry, or in multi-process mode one adding up the files of every process."""
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def clear_multiprocess_dir():
+    """Remove the files of an earlier run, before the first worker is forked."""
+    if MULTIPROCESS:
+        for path in glob.glob(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], '*.db')):
+            os.remove(path)
+
+
+def process_exited(pid: int):
+    """Drop the live gauges of a worker process that exited, called by the parent."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+def start_metrics_server(port: int = None):
+    """Serve /metrics from a background thread, for the workers and the pre-fork parent.
+
+    Default port $METRICS_PORT or 9100.
+    """
+    port = port or int(os.environ.get('METRICS_PORT', 9100))
+    start_http_server(port, registry=scrape_registry())
+    logger.info(f'Metrics served on port {port}')
+
+
+def render():
+    """Return the body and content type of a scrape, including this process's latest stats."""
+    sync_stats()
+    return generate_latest(scrape_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import operator
+from helpers.metrics import observe_call
+
+
+class NetboxCache(object):
+    """Read-through cache of Netbox objects keyed by model and name.
+
+    Entries expire after ``ttl`` seconds. A webhook for an object invalidates
+    every entry fetched before the webhook was received (``not_before``), so an
+    entry fetched after a burst of edits serves all the queued events of that
+    burst while older entries are never used for a newer change. Concurrent
+    lookups of the same object share one Netbox call.
+    """
+    def __init__(self, nb, ttl: int = 300, max_entries: int = 10000):
+        """
+        :param nb: Instance of class:`pynetbox.api`.
+        :param ttl: Seconds an object is served from memory.
+        :param max_entries: Oldest entries are dropped beyond this size.
+        """
+        self.nb = nb
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._inflight = {}
+        self.counters = {'snapshot': 0, 'hits': 0, 'netbox_calls': 0, 'invalidations': 0}
+
+    def put(self, model: str, name: str, obj: dict):
+        """Store an object fetched from Netbox."""
+        self._entries.pop((model, name), None)
+        self._entries[(model, name)] = (obj, time.time())
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, model: str, name: str):
+        if self._entries.pop((model, name), None) is not None:
+            self.counters['invalidations'] += 1
+
+    def count_snapshot(self):
+        """Record an event that was served straight from the webhook snapshot."""
+        self.counters['snapshot'] += 1
+
+    def _fetch(self, model: str, name: str):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            obj = operator.attrgetter(model)(self.nb).get(name=name)
+            status = 'found' if obj is not None else 'missing'
+        finally:
+            observe_call('netbox', model, status, time.perf_counter() - start)
+        return dict(obj) if obj is not None else None
+
+    async def get(self, model: str, name: str, not_before: float = None):
+        """Return a Netbox object as a dict, calling Netbox only on a miss.
+
+        :param model: pynetbox endpoint path. Example: dcim.sites
+        :type model: str
+        :param name: Object name. Example: Branch 01
+        :type name: str
+        :param not_before: Epoch seconds the cached copy must have been fetched after.
+        :type not_before: float
+        :return: Object fields or None if Netbox has no such object.
+        :rtype: dict
+        """
+        entry = self._entries.get((model, name))
+        if entry:
+            now = time.time()
+            if now - entry[1] < self.ttl and (not_before is None or entry[1] >= not_before):
+                self.counters['hits'] += 1
+                return entry[0]
+            self.invalidate(model, name)
+        inflight = self._inflight.get((model, name))
+        if inflight:
+            self.counters['hits'] += 1
+            return await asyncio.shield(inflight)
+        # pynetbox is blocking, keep it off the event loop
+        future = asyncio.ensure_future(asyncio.to_thread(self._fetch, model, name))
+        self._inflight[(model, name)] = future
+        self.counters['netbox_calls'] += 1
+        try:
+            obj = await future
+        finally:
+            self._inflight.pop((model, name), None)
+        if obj is not None:
+            self.put(model, name, obj)
+        return obj
+
+    def stats(self) -> dict:
+        served = self.counters['snapshot'] + self.counters['hits'] + self.counters['netbox_calls']
+        avoided = self.counters['snapshot'] + self.counters['hits']
+        return dict(self.counters, avoided_ratio=round(avoided / served, 3) if served else 0.0)
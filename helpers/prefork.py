@@ -0,0 +1,108 @@
+"""Pre-fork process model for serving an ASGI app on several cores.
+
+The parent binds the listening socket, runs ``before_fork`` once (for example
+to fetch the secrets every worker needs) and forks ``workers`` children. Each
+child inherits the socket and whatever ``before_fork`` loaded, then runs its
+own event loop and uvicorn server; the kernel spreads connections across them.
+Children that exit are replaced, SIGTERM and SIGINT are passed on to them and
+the parent returns once they have all shut down. ``started`` and ``on_exit``
+let the parent serve what the workers share, such as their metrics.
+"""
+import os
+import time
+import signal
+import socket
+from loguru import logger
+
+
+def bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Listening socket that forked workers can share."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, after_fork, uvicorn_options: dict):
+    import uvicorn
+    # uvicorn installs its own handlers for a graceful shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if after_fork:
+        after_fork()
+    uvicorn.Server(uvicorn.Config(app, **uvicorn_options)).run(sockets=[sock])
+
+
+def serve(app, host: str = '0.0.0.0', port: int = 5000, workers: int = 1, before_fork=None,
+          after_fork=None, started=None, on_exit=None, restart_delay: float = 1.0, **uvicorn_options):
+    """Serve ``app`` with uvicorn, in this process or in ``workers`` forked processes.
+
+    :param app: ASGI application.
+    :param workers: Number of worker processes. 1 serves from this process
+        and skips ``before_fork``, the app's lifespan does all the setup.
+    :param before_fork: Called once in the parent before the workers are forked.
+    :param after_fork: Called in every worker before its server starts.
+    :param started: Called once in the parent after the first workers are forked.
+    :param on_exit: Called in the parent with the pid of every worker that exited.
+    :param restart_delay: Seconds to wait before replacing a worker that exited.
+    :param uvicorn_options: Passed on to class:`uvicorn.Config`. Example: log_level='warning'
+    """
+    import uvicorn
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, **uvicorn_options)
+        return
+
+    sock = bind(host, port)
+    if before_fork:
+        before_fork()
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock, after_fork, uvicorn_options)
+            except BaseException as e:
+                logger.exception(f'Worker {os.getpid()} failed: {e}')
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    logger.info(f'Serving on {host}:{port} with {workers} workers')
+    if started:
+        started()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if children.pop(pid, None) is None:
+            continue
+        if on_exit:
+            on_exit(pid)
+        if not stopping:
+            logger.warning(f'Worker {pid} exited with {os.waitstatus_to_exitcode(status)}, replacing it')
+            time.sleep(restart_delay)
+            if not stopping:
+                spawn()
+    sock.close()
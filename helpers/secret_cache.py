@@ -0,0 +1,169 @@
+import time
+import asyncio
+import threading
+from loguru import logger
+from azure.core.exceptions import ResourceNotFoundError
+from helpers.log_setup import register_secret
+
+
+class SecretCache(object):
+    """Azure Key Vault secrets cached in memory with per-key TTLs.
+
+    A secret younger than its TTL is served from memory. Between the TTL and
+    ``stale_ttl`` the cached value is still served while a background thread
+    refreshes it (stale-while-revalidate), so a Key Vault throttle or outage
+    does not block callers that already have a value. Only a missing or fully
+    expired secret is fetched inline.
+    """
+    def __init__(self, client, default_ttl: int = 300, stale_ttl: int = 3600,
+                 ttls: dict = None, central_token_ttl: int = 900, negative_ttl: int = 60):
+        """
+        :param client: Instance of class:`azure.keyvault.secrets.SecretClient`.
+        :param default_ttl: Seconds a secret is considered fresh.
+        :param stale_ttl: Seconds past the TTL a stale value may still be served.
+        :param ttls: Per-secret TTL overrides, keyed by secret name.
+        :param central_token_ttl: TTL for the ``central-{cid}-webhooktoken`` secrets.
+        :param negative_ttl: Seconds an unknown secret name is remembered as missing.
+        """
+        self.client = client
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.ttls = ttls or {}
+        self.central_token_ttl = central_token_ttl
+        self.negative_ttl = negative_ttl
+        self._entries = {}
+        self._missing = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+        self.counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0,
+                         'refresh_errors': 0, 'not_found': 0}
+
+    def ttl_for(self, name: str) -> int:
+        if name in self.ttls:
+            return self.ttls[name]
+        if name.startswith('central-') and name.endswith('-webhooktoken'):
+            return self.central_token_ttl
+        return self.default_ttl
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _fetch(self, name: str):
+        value = self.client.get_secret(name).value
+        register_secret(value)
+        with self._lock:
+            self._entries[name] = (value, time.monotonic())
+            self._missing.pop(name, None)
+        return value
+
+    def _refresh(self, name: str):
+        try:
+            self._fetch(name)
+            self._count('refreshes')
+        except Exception as e:
+            # Keep serving the stale value, the next lookup will try again
+            self._count('refresh_errors')
+            logger.warning(f'Background refresh of secret {name} failed: {e}')
+        finally:
+            with self._lock:
+                self._refreshing.discard(name)
+
+    def _lookup(self, name: str):
+        """Return (value, state) where state is 'fresh', 'stale' or None."""
+        now = time.monotonic()
+        with self._lock:
+            missing_since = self._missing.get(name)
+            if missing_since is not None and now - missing_since < self.negative_ttl:
+                self.counters['not_found'] += 1
+                raise KeyError(name)
+            entry = self._entries.get(name)
+            if entry is None:
+                return None, None
+            value, fetched = entry
+            age = now - fetched
+            ttl = self.ttl_for(name)
+            if age < ttl:
+                self.counters['hits'] += 1
+                return value, 'fresh'
+            if age < ttl + self.stale_ttl:
+                self.counters['stale_hits'] += 1
+                if name not in self._refreshing:
+                    self._refreshing.add(name)
+                    threading.Thread(target=self._refresh, args=(name,), daemon=True).start()
+                return value, 'stale'
+            return None, None
+
+    def get(self, name: str) -> str:
+        """Return the value of a secret, fetching it from Key Vault only on a miss.
+
+        :param name: Key Vault secret name. Example: redis-password
+        :type name: str
+        :raises KeyError: The secret does not exist in Key Vault.
+        :return: Secret value.
+        :rtype: str
+        """
+        value, state = self._lookup(name)
+        if state:
+            return value
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(name, threading.Lock())
+        # One inline fetch per secret, concurrent callers wait for it
+        with fetch_lock:
+            value, state = self._lookup(name)
+            if state:
+                return value
+            self._count('misses')
+            try:
+                return self._fetch(name)
+            except ResourceNotFoundError:
+                with self._lock:
+                    self._missing[name] = time.monotonic()
+                raise KeyError(name)
+
+    async def aget(self, name: str) -> str:
+        """Async variant of :meth:`get` that keeps Key Vault calls off the event loop."""
+        value, state = self._lookup(name)
+        if state:
+            return value
+        return await asyncio.to_thread(self.get, name)
+
+    def central_token(self, cid: str) -> str:
+        """Return the webhook token for a Central customer, loaded on first use."""
+        return self.get(f'central-{cid}-webhooktoken')
+
+    async def acentral_token(self, cid: str) -> str:
+        return await self.aget(f'central-{cid}-webhooktoken')
+
+    def warm(self, names) -> dict:
+        """Fetch ``names`` now so later lookups are served from memory.
+
+        Secrets that do not exist in Key Vault are skipped.
+
+        :return: Secret name -> whether it was loaded.
+        :rtype: dict
+        """
+        loaded = {}
+        for name in names:
+            try:
+                self.get(name)
+                loaded[name] = True
+            except KeyError:
+                loaded[name] = False
+        return loaded
+
+    def after_fork(self, client):
+        """Continue in a forked worker with a new Key Vault client, keeping the cached secrets.
+
+        The parent's client and its HTTP connections must not be shared
+        between processes, and its locks may have been held when it forked.
+        """
+        self.client = client
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+        self._refreshing = set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, cached=len(self._entries))
@@ -0,0 +1,52 @@
+"""Field-targeted comparison of Netbox prechange/postchange snapshots.
+
+Only the paths listed in a watch list are compared, so the cost does not
+depend on how many interfaces, tags or other nested lists a device carries.
+"""
+
+# Netbox path -> alert field name, for device updates the workers act on
+DEVICE_WATCH = {
+    'name': 'hostname',
+    'custom_fields.central_subscription': 'central_subscription',
+}
+
+_MISSING = object()
+
+
+def get_path(obj, path: str):
+    """Return the value at a dotted ``path``, or a sentinel if any part is missing."""
+    for part in path.split('.'):
+        if isinstance(obj, dict):
+            obj = obj.get(part, _MISSING)
+        elif isinstance(obj, list) and part.isdigit() and int(part) < len(obj):
+            obj = obj[int(part)]
+        else:
+            return _MISSING
+        if obj is _MISSING:
+            return _MISSING
+    return obj
+
+
+def diff_fields(prechange: dict, postchange: dict, watch: dict = DEVICE_WATCH) -> dict:
+    """Compare only the watched paths of two snapshots.
+
+    :param prechange: Snapshot before the change.
+    :param postchange: Snapshot after the change.
+    :param watch: Dotted Netbox path -> name the change is reported under.
+    :return: Every watched field that changed, mapped to its new value
+        (None when the field was removed).
+    :rtype: dict
+    """
+    changed = {}
+    for path, field in watch.items():
+        old = get_path(prechange or {}, path)
+        new = get_path(postchange or {}, path)
+        if old != new:
+            changed[field] = None if new is _MISSING else new
+    return changed
+
+
+def full_diff(prechange: dict, postchange: dict):
+    """Complete DeepDiff of two snapshots, for debugging only; DeepDiff is imported on first use."""
+    from deepdiff import DeepDiff
+    return DeepDiff(prechange, postchange, ignore_order=True, exclude_paths={"root['last_updated']"})
@@ -0,0 +1,45 @@
+import time
+from contextlib import contextmanager
+
+
+class StageTimer(object):
+    """Accumulate wall-clock time per pipeline stage.
+
+    Example::
+
+        timer = StageTimer()
+        with timer.stage('parse'):
+            body = loads(raw)
+        timer.stats()  # {'parse': {'count': 1, 'total_ms': 0.4, 'avg_ms': 0.4, 'max_ms': 0.4}}
+
+    ``observe(stage, seconds)``, when given, is also called for every
+    measurement, for example to feed a histogram.
+    """
+    def __init__(self, observe=None):
+        self._stages = {}
+        self.observe = observe
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        count, total, longest = self._stages.get(name, (0, 0.0, 0.0))
+        self._stages[name] = (count + 1, total + seconds, max(longest, seconds))
+        if self.observe is not None:
+            self.observe(name, seconds)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                'count': count,
+                'total_ms': round(total * 1000, 3),
+                'avg_ms': round(total * 1000 / count, 3),
+                'max_ms': round(longest * 1000, 3),
+            }
+            for name, (count, total, longest) in self._stages.items()
+        }
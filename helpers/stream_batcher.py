@@ -0,0 +1,123 @@
+import asyncio
+from loguru import logger
+
+
+class XaddBatcher(object):
+    """Coalesce concurrent XADD calls into pipelined batches.
+
+    Callers await :meth:`xadd` and get the stream entry id back once the batch
+    holding their entry has been written by Redis. A batch is flushed when it
+    reaches ``max_batch`` entries or when its oldest entry has waited
+    ``max_delay`` seconds, whichever comes first.
+    """
+    def __init__(self, redis_client, max_batch: int = 100, max_delay: float = 0.002,
+                 max_inflight: int = 4, maxlen: int = None):
+        """
+        :param redis_client: Instance of class:`redis.asyncio.Redis`.
+        :param max_batch: Maximum number of entries per pipeline.
+        :param max_delay: Seconds the first entry of a batch may wait for company.
+        :param max_inflight: Maximum number of pipelines executing at once.
+        :param maxlen: Default approximate MAXLEN applied to every XADD.
+        """
+        self.redis = redis_client
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.maxlen = maxlen
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._pending = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._flushes = set()
+        self.counters = {'entries': 0, 'batches': 0, 'errors': 0, 'max_batch_seen': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is pending and stop the background flusher."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            await self._flush(batch)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def xadd(self, key: str, fields: dict, maxlen: int = None, approximate: bool = True) -> str:
+        """Queue an entry for ``key`` and wait until Redis has written it.
+
+        :param key: Stream key. Example: cmdb:alert
+        :type key: str
+        :param fields: Flat field map for the stream entry.
+        :type fields: dict
+        :return: Stream entry id assigned by Redis.
+        :rtype: str
+        """
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((key, fields, maxlen or self.maxlen, approximate, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if len(self._pending) < self.max_batch:
+                self._full.clear()
+            if not self._pending:
+                self._has_items.clear()
+            if not batch:
+                continue
+            try:
+                await self._inflight.acquire()
+            except asyncio.CancelledError:
+                # Hand the batch back so stop() flushes it
+                self._pending[:0] = batch
+                raise
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flush_done)
+
+    def _flush_done(self, flush):
+        self._flushes.discard(flush)
+        self._inflight.release()
+
+    async def _flush(self, batch):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, fields, maxlen, approximate, future in batch:
+            pipe.xadd(key, fields, id='*', maxlen=maxlen, approximate=approximate)
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            self.counters['errors'] += 1
+            logger.error(f'XADD batch of {len(batch)} failed: {e}')
+            results = [e] * len(batch)
+        self.counters['batches'] += 1
+        self.counters['entries'] += len(batch)
+        self.counters['max_batch_seen'] = max(self.counters['max_batch_seen'], len(batch))
+        for (key, fields, maxlen, approximate, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return dict(self.counters, pending=len(self._pending))
@@ -0,0 +1,508 @@
+import time
+import signal
+import asyncio
+import functools
+from collections import deque
+from loguru import logger
+from helpers.lanes import LANES, DEFAULT_WEIGHTS, lane_key
+
+
+class StreamConsumer(object):
+    """Long-running Redis stream consumer with batched reads and acks.
+
+    Reads up to ``batch_size`` entries per XREADGROUP, runs ``handler`` on them
+    with at most ``concurrency`` in flight and acknowledges (and deletes) the
+    successful ones with a single pipeline per batch. Entries whose handler
+    raised are left pending so they can be retried. When ``key_func`` is given,
+    entries of a batch that share a key are handled one after the other in
+    stream order, so a create is never overtaken by the delete behind it.
+
+    Entries left pending for ``claim_idle_ms`` by any consumer of the group (a
+    crashed replica, a failed handler) are taken over with XAUTOCLAIM and
+    retried. Once an entry has been delivered ``max_deliveries`` times it is
+    copied to ``dead_letter_key`` and removed from the stream instead.
+
+    While ``hold_off`` reports a wait, such as a used up daily API quota,
+    nothing is read or reclaimed, so entries that can't succeed yet don't use
+    up their deliveries.
+    """
+    def __init__(self, redis_client, stream_key: str, group: str, consumer: str, handler,
+                 batch_size: int = 50, concurrency: int = 16, block_ms: int = 2000,
+                 delete_acked: bool = True, key_func=None, claim_idle_ms: int = 60000,
+                 reclaim_interval: float = 15, max_deliveries: int = 5, dead_letter_key: str = None,
+                 maxlen: int = None, decode=None, hold_off=None):
+        """
+        :param redis_client: Instance of class:`redis.asyncio.Redis` with decode_responses=True.
+        :param stream_key: Stream to read. Example: cmdb:alert
+        :param group: Consumer group name. Example: cmdb
+        :param consumer: Consumer name within the group, usually the hostname.
+        :param handler: Coroutine function called as ``handler(entry_id, fields)``, or with the
+            decoded entry when ``decode`` is given.
+        :param batch_size: Maximum entries per XREADGROUP.
+        :param concurrency: Maximum handlers running at once.
+        :param block_ms: XREADGROUP block time, also bounds how long shutdown waits.
+        :param delete_acked: XDEL entries once they are acknowledged.
+        :param key_func: Optional ``key_func(fields)`` naming the entity an entry belongs to.
+        :param claim_idle_ms: Pending entries idle this long are reclaimed.
+        :param reclaim_interval: Seconds between XAUTOCLAIM sweeps.
+        :param max_deliveries: Deliveries after which an entry is dead-lettered.
+        :param dead_letter_key: Dead letter stream. Default ``<stream_key>:dead``.
+        :param maxlen: Approximate MAXLEN the stream is trimmed to with each ack.
+        :param decode: Optional ``decode(fields)`` applied before ``key_func`` and ``handler``.
+            Entries that fail to decode are left pending like failed ones.
+        :param hold_off: Optional coroutine function returning the seconds to wait before
+            reading or reclaiming more entries, 0 to go ahead. Checked again at least every minute.
+        """
+        self.redis = redis_client
+        self.stream_key = stream_key
+        self.group = group
+        self.consumer = consumer
+        self.handler = handler
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.delete_acked = delete_acked
+        self.key_func = key_func
+        self.claim_idle_ms = claim_idle_ms
+        self.reclaim_interval = reclaim_interval
+        self.max_deliveries = max_deliveries
+        self.dead_letter_key = dead_letter_key or f'{stream_key}:dead'
+        self.maxlen = maxlen
+        self.decode = decode
+        self.hold_off = hold_off
+        self._hold_checked = (float('-inf'), 0)
+        # Entries read ahead by class:`LaneConsumer` and not finished yet, never reclaimed
+        self.owned = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._stopping = asyncio.Event()
+        self.counters = {'processed': 0, 'failed': 0, 'batches': 0, 'reclaimed': 0, 'dead_lettered': 0}
+        self.gauges = {'length': 0, 'pending': 0, 'lag': 0}
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream_key, self.group, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+            logger.info(f'Group {self.group} already exists on {self.stream_key}')
+
+    def stop(self):
+        """Finish the current batch, acknowledge it and return from :meth:`run`."""
+        logger.info(f'Stopping consumer {self.consumer} on {self.stream_key}')
+        self._stopping.set()
+
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+    async def _hold_off_seconds(self) -> float:
+        if self.hold_off is None:
+            return 0
+        # Reads can follow each other quickly, ask at most once a second
+        now = time.monotonic()
+        if now - self._hold_checked[0] >= 1:
+            try:
+                self._hold_checked = (now, await self.hold_off())
+            except Exception as e:
+                logger.error(f'Checking whether to hold off {self.stream_key} failed: {e}')
+                self._hold_checked = (now, 0)
+        return self._hold_checked[1]
+
+    async def _wait_unless_stopped(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _held(self) -> bool:
+        """Wait up to a minute while ``hold_off`` asks to, return whether it did."""
+        seconds = await self._hold_off_seconds()
+        if seconds <= 0:
+            return False
+        logger.warning(f'Holding off reading {self.stream_key} for {seconds:.0f}s')
+        await self._wait_unless_stopped(min(seconds, 60))
+        return True
+
+    def _decode(self, entry_id, fields):
+        if self.decode is None:
+            return fields
+        try:
+            return self.decode(fields)
+        except Exception as e:
+            logger.error(f'Stream message ID {entry_id} could not be decoded: {e}')
+            return None
+
+    async def _handle(self, entry_id, fields):
+        if fields is None:
+            self.counters['failed'] += 1
+            return None
+        async with self._semaphore:
+            try:
+                await self.handler(entry_id, fields)
+                return entry_id
+            except Exception as e:
+                self.counters['failed'] += 1
+                logger.exception(f'Stream message ID {entry_id} failed: {e}')
+                return None
+
+    async def _ack(self, entry_ids):
+        if not entry_ids:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xack(self.stream_key, self.group, *entry_ids)
+        if self.delete_acked:
+            pipe.xdel(self.stream_key, *entry_ids)
+        if self.maxlen:
+            pipe.xtrim(self.stream_key, maxlen=self.maxlen, approximate=True)
+        await pipe.execute()
+
+    async def _dead_letter(self, entries, deliveries):
+        pipe = self.redis.pipeline(transaction=True)
+        for entry_id, fields in entries:
+            logger.error(f'Stream message ID {entry_id} failed {deliveries[entry_id]} times, moving it to {self.dead_letter_key}')
+            pipe.xadd(self.dead_letter_key, dict(fields, dead_letter_source=self.stream_key,
+                                                 dead_letter_id=entry_id,
+                                                 dead_letter_deliveries=deliveries[entry_id]),
+                      maxlen=self.maxlen, approximate=True)
+        ids = [entry_id for entry_id, _fields in entries]
+        pipe.xack(self.stream_key, self.group, *ids)
+        pipe.xdel(self.stream_key, *ids)
+        await pipe.execute()
+        self.counters['dead_lettered'] += len(entries)
+
+    async def _deliveries(self, entries):
+        # One range per entry, other pending ids between them must not push any out of the reply
+        pipe = self.redis.pipeline(transaction=False)
+        for entry_id, _fields in entries:
+            pipe.xpending_range(self.stream_key, self.group, min=entry_id, max=entry_id, count=1)
+        return {p['message_id']: p['times_delivered'] for pending in await pipe.execute() for p in pending}
+
+    async def keep_owned(self):
+        """Reset the idle time of the :attr:`owned` entries, so no consumer of the group reclaims them."""
+        if self.owned:
+            await self.redis.xclaim(self.stream_key, self.group, self.consumer, min_idle_time=0,
+                                    message_ids=list(self.owned), justid=True)
+
+    async def reclaim(self):
+        """Take over idle pending entries, retry them or move them to the dead letter stream."""
+        start = '0-0'
+        while not self._stopping.is_set():
+            response = await self.redis.xautoclaim(self.stream_key, self.group, self.consumer,
+                                                   min_idle_time=self.claim_idle_ms, start_id=start,
+                                                   count=self.batch_size)
+            start, claimed = response[0], response[1]
+            # Entries deleted while pending come back without fields
+            gone = [entry_id for entry_id, fields in claimed if fields is None]
+            if gone:
+                await self._ack(gone)
+            claimed = [(entry_id, fields) for entry_id, fields in claimed
+                       if fields is not None and entry_id not in self.owned]
+            if claimed:
+                self.counters['reclaimed'] += len(claimed)
+                deliveries = await self._deliveries(claimed)
+                dead = [e for e in claimed if deliveries.get(e[0], 0) > self.max_deliveries]
+                retry = [e for e in claimed if deliveries.get(e[0], 0) <= self.max_deliveries]
+                if dead:
+                    await self._dead_letter(dead, deliveries)
+                if retry:
+                    logger.info(f'Retrying {len(retry)} stream messages reclaimed by {self.consumer}')
+                    await self.process_batch(retry)
+            if start in ('0-0', b'0-0'):
+                break
+
+    async def refresh_gauges(self):
+        """Update stream length, pending entries list size and group lag."""
+        self.gauges['length'] = await self.redis.xlen(self.stream_key)
+        for group in await self.redis.xinfo_groups(self.stream_key):
+            if group['name'] == self.group:
+                self.gauges['pending'] = group['pending']
+                # lag is reported by Redis 7 and later
+                self.gauges['lag'] = group.get('lag') or 0
+        return dict(self.gauges)
+
+    async def _reclaim_forever(self):
+        while not self._stopping.is_set():
+            try:
+                # Also while held, the buffered entries are still being handled
+                await self.keep_owned()
+                if not await self._hold_off_seconds():
+                    await self.reclaim()
+                await self.refresh_gauges()
+                logger.info(f'{self.stream_key} {self.gauges} {self.counters}')
+            except Exception as e:
+                logger.error(f'Reclaiming pending messages on {self.stream_key} failed: {e}')
+            await self._wait_unless_stopped(self.reclaim_interval)
+
+    async def _handle_in_order(self, entries):
+        return [await self._handle(entry_id, fields) for entry_id, fields in entries]
+
+    async def process_batch(self, entries):
+        entries = [(entry_id, self._decode(entry_id, fields)) for entry_id, fields in entries]
+        if self.key_func:
+            groups = {}
+            for entry_id, fields in entries:
+                key = self.key_func(fields) if fields is not None else None
+                groups.setdefault(entry_id if key is None else key, []).append((entry_id, fields))
+            done = await asyncio.gather(*(self._handle_in_order(group) for group in groups.values()))
+            done = [entry_id for group in done for entry_id in group]
+        else:
+            done = await asyncio.gather(*(self._handle(entry_id, fields) for entry_id, fields in entries))
+        acked = [entry_id for entry_id in done if entry_id]
+        await self._ack(acked)
+        self.counters['processed'] += len(acked)
+        self.counters['batches'] += 1
+        logger.info(f'{len(acked)}/{len(entries)} stream messages read and processed successfuly by {self.consumer}')
+
+    async def run(self):
+        await self.ensure_group()
+        reclaimer = asyncio.create_task(self._reclaim_forever())
+        while not self._stopping.is_set():
+            if await self._held():
+                continue
+            try:
+                response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream_key: '>'},
+                                                       count=self.batch_size, block=self.block_ms)
+            except Exception as e:
+                logger.error(f'XREADGROUP on {self.stream_key} failed: {e}')
+                await asyncio.sleep(1)
+                continue
+            for _stream, entries in response or []:
+                if entries:
+                    await self.process_batch(entries)
+        await reclaimer
+        logger.info(f'Consumer {self.consumer} stopped {self.counters}')
+
+    def stats(self) -> dict:
+        return dict(self.counters, **self.gauges)
+
+
+class LaneConsumer(object):
+    """Consume the priority lanes of a stream with weighted fair scheduling.
+
+    Each lane stream (see helpers/lanes.py) has its own class:`StreamConsumer`
+    for acknowledging, reclaiming and dead-lettering. Entries are read ahead
+    into a buffer per lane of about ``batch_size`` entries and handed to the
+    handler one at a time whenever one of ``concurrency`` slots frees up, so
+    an entry in the high lane never waits behind a whole batch of bulk work.
+    Lanes with entries waiting are served in proportion to their ``weights``
+    (smooth weighted round robin). An entry buffered for ``max_wait`` seconds
+    goes next whatever its lane, so a busy high lane can not starve the
+    others. Entries sharing a ``key_func`` key are handled one after the
+    other in the order they were scheduled, across lanes.
+
+    Entries read ahead stay owned by this consumer until they are
+    acknowledged: each reclaim sweep resets their idle time with XCLAIM
+    JUSTID, so no consumer of the group reclaims them while they wait in a
+    buffer, as long as ``reclaim_interval`` is shorter than ``claim_idle_ms``.
+
+    The handler is called as ``handler(entry_id, entry, lane=lane)``.
+    """
+    def __init__(self, redis_client, stream_key: str, group: str, consumer: str, handler,
+                 lanes=LANES, weights: dict = None, batch_size: int = 50, concurrency: int = 16,
+                 block_ms: int = 2000, refill_ms: int = 50, max_wait: float = 5.0, key_func=None,
+                 decode=None, **consumer_options):
+        """
+        :param redis_client: Instance of class:`redis.asyncio.Redis` with decode_responses=True.
+        :param stream_key: Stream whose lanes are read, the normal lane's key. Example: cmdb:alert
+        :param group: Consumer group name, the same on every lane.
+        :param consumer: Consumer name within the group, usually the hostname.
+        :param handler: Coroutine function ``handler(entry_id, entry, lane=lane)``.
+        :param lanes: Lanes to read, highest priority first.
+        :param weights: Lane -> share of the handler slots while every lane has entries waiting.
+        :param batch_size: Entries read ahead per lane.
+        :param concurrency: Maximum handlers running at once, across lanes.
+        :param block_ms: XREADGROUP block time while nothing is buffered, also bounds shutdown.
+        :param refill_ms: XREADGROUP block time while a full lane waits to be read again.
+        :param max_wait: Seconds an entry may stay buffered before it is handled next.
+        :param key_func: Optional ``key_func(entry)`` naming the entity an entry belongs to.
+        :param decode: Optional ``decode(fields)`` applied as entries are read.
+        :param consumer_options: Passed on to every lane's class:`StreamConsumer`, a
+            ``hold_off`` there also holds off the reads of every lane.
+            Example: max_deliveries=5, claim_idle_ms=60000, maxlen=100000
+        """
+        self.redis = redis_client
+        self.stream_key = stream_key
+        self.group = group
+        self.consumer = consumer
+        self.lanes = tuple(lanes)
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.refill_ms = refill_ms
+        self.max_wait = max_wait
+        self.key_func = key_func
+        self.consumers = {
+            lane: StreamConsumer(redis_client, lane_key(stream_key, lane), group, consumer,
+                                 functools.partial(handler, lane=lane), batch_size=batch_size,
+                                 concurrency=concurrency, block_ms=block_ms, key_func=key_func,
+                                 decode=decode, **consumer_options)
+            for lane in self.lanes
+        }
+        self._lane_of = {c.stream_key: lane for lane, c in self.consumers.items()}
+        self._buffers = {lane: deque() for lane in self.lanes}
+        self._credit = {lane: 0 for lane in self.lanes}
+        self._acks = {lane: [] for lane in self.lanes}
+        self._ack_task = None
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        # key -> entries of that key scheduled while one of them is being handled
+        self._key_queues = {}
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self.counters = {f'{lane}_{name}': 0 for lane in self.lanes
+                         for name in ('dispatched', 'aged', 'wait_seconds')}
+
+    def stop(self):
+        """Finish the entries being handled, acknowledge them and return from :meth:`run`."""
+        logger.info(f'Stopping consumer {self.consumer} on the {self.stream_key} lanes')
+        self._stopping.set()
+        for stream in self.consumers.values():
+            stream.stop()
+        self._ready.set()
+        self._room.set()
+
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+    def _pick(self):
+        active = [lane for lane in self.lanes if self._buffers[lane]]
+        if not active:
+            return None
+        now = time.monotonic()
+        oldest = min(active, key=lambda lane: self._buffers[lane][0][2])
+        if now - self._buffers[oldest][0][2] >= self.max_wait:
+            lane = oldest
+            self.counters[f'{lane}_aged'] += 1
+        else:
+            total = 0
+            for lane in active:
+                self._credit[lane] += self.weights[lane]
+                total += self.weights[lane]
+            # Ties go to the lane listed first, the higher priority one
+            lane = max(active, key=self._credit.__getitem__)
+            self._credit[lane] -= total
+        for idle in self.lanes:
+            if not self._buffers[idle]:
+                self._credit[idle] = 0
+        entry_id, entry, buffered = self._buffers[lane].popleft()
+        self.counters[f'{lane}_dispatched'] += 1
+        self.counters[f'{lane}_wait_seconds'] += now - buffered
+        return lane, entry_id, entry
+
+    async def _read_forever(self):
+        while not self._stopping.is_set():
+            # Every lane shares the same hold_off, ask the first one
+            if await self.consumers[self.lanes[0]]._held():
+                continue
+            streams = {self.consumers[lane].stream_key: '>' for lane in self.lanes
+                       if len(self._buffers[lane]) < self.batch_size}
+            if not streams:
+                self._room.clear()
+                await self._room.wait()
+                continue
+            # A lane left out because it is full must be read again soon after it drains
+            block = self.refill_ms if len(streams) < len(self.lanes) else self.block_ms
+            try:
+                response = await self.redis.xreadgroup(self.group, self.consumer, streams,
+                                                       count=self.batch_size, block=block)
+            except Exception as e:
+                logger.error(f'XREADGROUP on the {self.stream_key} lanes failed: {e}')
+                await asyncio.sleep(1)
+                continue
+            now = time.monotonic()
+            for stream, entries in response or []:
+                lane = self._lane_of[stream.decode() if isinstance(stream, bytes) else stream]
+                stream = self.consumers[lane]
+                stream.owned.update(entry_id for entry_id, _fields in entries)
+                self._buffers[lane].extend((entry_id, stream._decode(entry_id, fields), now)
+                                           for entry_id, fields in entries)
+            if any(self._buffers.values()):
+                self._ready.set()
+
+    async def _dispatch_forever(self):
+        while not self._stopping.is_set():
+            await self._slots.acquire()
+            picked = self._pick()
+            while picked is None and not self._stopping.is_set():
+                self._ready.clear()
+                await self._ready.wait()
+                picked = self._pick()
+            if picked is None:
+                self._slots.release()
+                break
+            self._room.set()
+            lane, entry_id, entry = picked
+            key = self.key_func(entry) if self.key_func and entry is not None else None
+            if key is not None and key in self._key_queues:
+                self._key_queues[key].append(picked)
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._handle_key(key, lane, entry_id, entry))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _handle_key(self, key, lane, entry_id, entry):
+        if key is not None:
+            self._key_queues[key] = deque()
+        try:
+            while True:
+                if await self.consumers[lane]._handle(entry_id, entry):
+                    self._acks[lane].append(entry_id)
+                    self._ack_soon()
+                else:
+                    # Left pending for the reclaim sweep to retry
+                    self.consumers[lane].owned.discard(entry_id)
+                if key is None or not self._key_queues[key]:
+                    break
+                lane, entry_id, entry = self._key_queues[key].popleft()
+        finally:
+            if key is not None:
+                del self._key_queues[key]
+            self._slots.release()
+
+    def _ack_soon(self):
+        if self._ack_task is None or self._ack_task.done():
+            self._ack_task = asyncio.create_task(self._flush_acks())
+
+    async def _flush_acks(self):
+        # Acks arriving during a flush are picked up by the next pass
+        while any(self._acks.values()):
+            for lane in self.lanes:
+                entry_ids, self._acks[lane] = self._acks[lane], []
+                if not entry_ids:
+                    continue
+                stream = self.consumers[lane]
+                try:
+                    await stream._ack(entry_ids)
+                except Exception as e:
+                    # Left pending, the entries are reclaimed and retried
+                    logger.error(f'Acknowledging {len(entry_ids)} entries on {stream.stream_key} failed: {e}')
+                    continue
+                finally:
+                    stream.owned.difference_update(entry_ids)
+                stream.counters['processed'] += len(entry_ids)
+                stream.counters['batches'] += 1
+
+    async def run(self):
+        for stream in self.consumers.values():
+            await stream.ensure_group()
+        reclaimers = [asyncio.create_task(stream._reclaim_forever()) for stream in self.consumers.values()]
+        reader = asyncio.create_task(self._read_forever())
+        await self._dispatch_forever()
+        await reader
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._ack_task is not None:
+            await self._ack_task
+        await self._flush_acks()
+        await asyncio.gather(*reclaimers)
+        buffered = sum(len(buffer) for buffer in self._buffers.values())
+        if buffered:
+            logger.info(f'{buffered} read ahead entries left pending for another consumer to reclaim')
+        logger.info(f'Consumer {self.consumer} stopped {self.stats()}')
+
+    def stats(self) -> dict:
+        return dict(self.counters, **{f'{lane}_buffered': len(self._buffers[lane]) for lane in self.lanes})
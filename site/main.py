@@ -4,38 +4,66 @@ import asyncio
 from azure.keyvault.secrets import SecretClient
 from azure.identity import DefaultAzureCredential
 import redis
-import time
+import redis.asyncio as aioredis
 import socket
 from loguru import logger
-from pycentral.workflows.workflows_utils import get_conn_from_file
 from pycentral.monitoring import Sites
+from helpers.central_utils.connection import central_connection
+from helpers.central_utils.site_index import SiteIndex
+from helpers.central_utils.rate_limit import CentralRateLimiter
+from helpers.secret_cache import SecretCache
+from helpers.log_setup import setup_logging
+from helpers.stream_consumer import LaneConsumer
+from helpers.lanes import parse_weights
+from helpers.stage_timer import StageTimer
+from helpers import envelope
+from helpers import metrics
 
 VAULT_URL = os.environ["AZURE_KEYVAULT_URL"]
 credential = DefaultAzureCredential()
 client = SecretClient(vault_url=VAULT_URL, credential=credential)
+secrets = SecretCache(client)
 
 # Loguru settings
-logger.remove()
-logger.add(sys.stderr, format="{time} {level} {message}")
-logger.add("/logs/site.log")
-logger.add("/logs/site_retention.log", retention="5 days")
-logger.add("/logs/site_rotation.log", rotation="1 MB")
-logger.add("/logs/site_compressed.log", compression="zip")
+setup_logging('site')
 
 consumer=socket.gethostname()
 consumer_group = 'site'
 stream_key = f'{consumer_group}:alert'
 logger.info(f'The Consumer name is {consumer} within {consumer_group} and listening to {stream_key}')
 
+# Redis settings
+r_host = secrets.get('redis-server')
+r_password = secrets.get('redis-password')
+# Azure Cache for Redis listens for TLS on 6380
+r_port = int(os.environ.get('REDIS_PORT', 6380))
+r_ssl = os.environ.get('REDIS_SSL', 'true').lower() in ('1', 'true', 'yes')
+# surrogateescape keeps the binary body of stream envelopes intact
+r = aioredis.StrictRedis(host=r_host, port=r_port, encoding='utf-8', encoding_errors='surrogateescape',
+                         password=r_password, ssl=r_ssl, decode_responses=True)
+
+# Central calls of every replica share one token bucket in Redis
+central_connection.use_rate_limiter(CentralRateLimiter(
+    redis.StrictRedis(host=r_host, port=r_port, password=r_password, ssl=r_ssl, decode_responses=True),
+    customer=central_connection.account,
+    rate=float(os.environ.get('CENTRAL_RATE_PER_SECOND', 7)),
+    daily_limit=int(os.environ.get('CENTRAL_DAILY_LIMIT', 5000)),
+))
+
 site = Sites()
+site_index = SiteIndex(r, central_connection)
 
-@logger.catch
-def get_message_from_response(response):
-    return response[0][1][0]
+timer = StageTimer(observe=metrics.stage_observer(consumer_group))
 
-@logger.catch
+async def site_call(method, **kwargs):
+    # pycentral is blocking, keep it off the event loop
+    return await asyncio.to_thread(method, conn=central_connection.get(), **kwargs)
+
+def call_failed(resp):
+    return not isinstance(resp, dict) or resp.get('code') != 200
+
+# Not wrapped in logger.catch: a failure must leave the message pending to be retried
 async def process_message(msg):
-    central = get_conn_from_file(filename="/creds/central.json", account="us-2")
     logger.info(msg)
     match msg:
         case {'event': 'created', 'name': name, 'address': address, 'city': city, 'state': state, 'zipcode': zipcode,}:
@@ -47,8 +75,10 @@ async def process_message(msg):
                 "zipcode": zipcode
             }
             logger.info(site_info)
-            site_create = site.create_site(conn=central, site_name=f"JA {name}", site_address=site_info)
+            site_create = await site_call(site.create_site, site_name=f"JA {name}", site_address=site_info)
             logger.info(site_create)
+            if not call_failed(site_create) and 'site_id' in site_create['msg']:
+                await site_index.set(f"JA {name}", site_create['msg']['site_id'])
             return f'Site created: {name}'
 
         case {'event': 'updated', 'name': name, 'address': address, 'city': city, 'state': state, 'zipcode': zipcode,}:
@@ -59,72 +89,61 @@ async def process_message(msg):
                 "country": "United States",
                 "zipcode": zipcode
             }
-            site_id = site.find_site_id(conn=central, site_name=f"JA {name}")
+            site_id = await site_index.get(f"JA {name}")
             logger.info(site_id)
-            site_update = site.update_site(conn=central, site_id=site_id, site_name=f"JA {name}", site_address=site_info)
+            site_update = await site_call(site.update_site, site_id=site_id, site_name=f"JA {name}", site_address=site_info)
+            if call_failed(site_update):
+                # The indexed id may be stale, look it up again once
+                await site_index.remove(f"JA {name}")
+                site_id = await site_index.get(f"JA {name}")
+                site_update = await site_call(site.update_site, site_id=site_id, site_name=f"JA {name}", site_address=site_info)
             logger.info(site_update)
             return f'Site updated: {name}'
 
         case {'event': 'deleted', 'name': name}:
-            site_id = site.find_site_id(conn=central, site_name=f"JA {name}")
+            site_id = await site_index.get(f"JA {name}")
             logger.info(site_id)
-            site_delete = site.delete_site(conn=central, site_id=site_id)
+            site_delete = await site_call(site.delete_site, site_id=site_id)
             logger.info(site_delete)
+            await site_index.remove(f"JA {name}")
             return f'Site deleted: {name}'
 
+async def handle_message(msg_id, entry, lane='normal'):
+    logger.info(msg_id)
+    msg = entry.body
+    with timer.stage('process'):
+        msg_info = await process_message(msg)
+    logger.info(msg_info if msg_info else 'Match fell through')
+    metrics.count_message(consumer_group, msg.get('event', 'unknown') if msg_info else 'Match fell through')
+
 @logger.catch
 async def worker():
-    r_host = client.get_secret('redis-server')
-    r_password = client.get_secret('redis-password')
-    r = redis.StrictRedis(host=r_host.value, port=6380, charset='utf-8',
-                          password=r_password.value, ssl=True, decode_responses=True)
-    try:
-        r.xgroup_create(stream_key, consumer_group, mkstream=True)
-    except:
-        print('Group already exists!')
-
-    while True:
-        try:
-            response = r.xreadgroup(consumer_group, consumer, {stream_key: '>'}, count=1, block=0)
-
-            if response:
-                msg = get_message_from_response(response)
-                msg_id = msg[1]
-                logger.info(msg_id)
-                msg_info = await process_message(msg_id)
-                if 'Site created:' in msg_info:
-                    logger.info(msg_info)
-                    logger.info('Site created')
-                    r.xack(stream_key, consumer_group, msg[0])
-                    logger.info("Stream message ID {} read and processed successfuly by {}".format(msg[0],consumer))
-                    r.xdel(stream_key, msg[0])
-                    return {'result': 'ok'}
-                elif 'Site updated:' in msg_info:
-                    logger.info(msg_info)
-                    logger.info('Site updated')
-                    r.xack(stream_key, consumer_group, msg[0])
-                    logger.info("Stream message ID {} read and processed successfuly by {}".format(msg[0],consumer))
-                    r.xdel(stream_key, msg[0])
-                    return {'result': 'ok'} 
-                elif 'Site deleted:' in msg_info:
-                    logger.info(msg_info)
-                    logger.info('Site deleted')
-                    r.xack(stream_key, consumer_group, msg[0])
-                    logger.info("Stream message ID {} read and processed successfuly by {}".format(msg[0],consumer))
-                    r.xdel(stream_key, msg[0])
-                    return {'result': 'ok'}       
-                else:
-                    logger.info(msg_info)
-                    logger.info('Match fell through')
-                    r.xack(stream_key, consumer_group, msg[0])
-                    logger.info("Stream message ID {} read and processed successfuly by {}".format(msg[0],consumer))
-                    r.xdel(stream_key, msg[0]) 
-                    return {'result': 'ok'}
-
-
-        except Exception as e:
-            print(str(e))
-            time.sleep(1)
+    await site_index.load()
+    revalidate = asyncio.create_task(site_index.revalidate_forever(int(os.environ.get('SITE_INDEX_REVALIDATE', 3600))))
+    stream = LaneConsumer(
+        r, stream_key, consumer_group, consumer, handle_message,
+        weights=parse_weights(os.environ.get('LANE_WEIGHTS')),
+        max_wait=float(os.environ.get('LANE_MAX_WAIT', 5)),
+        batch_size=int(os.environ.get('CONSUMER_BATCH_SIZE', 50)),
+        max_deliveries=int(os.environ.get('CONSUMER_MAX_DELIVERIES', 5)),
+        claim_idle_ms=int(os.environ.get('CONSUMER_CLAIM_IDLE_MS', 60000)),
+        maxlen=int(os.environ.get('STREAM_MAXLEN', 100000)),
+        concurrency=int(os.environ.get('CONSUMER_CONCURRENCY', 4)),
+        key_func=lambda entry: entry.key,
+        decode=lambda fields: envelope.decode(fields, stream_key),
+        # Once the daily Central quota is used up, leave the alerts pending until it resets
+        hold_off=lambda: asyncio.to_thread(central_connection.rate_limiter.quota_reset_in),
+    )
+    stream.install_signal_handlers()
+    metrics.export_lane_consumer(stream)
+    metrics.export_stats('site_index', site_index.stats, counters=tuple(site_index.counters))
+    metrics.export_stats('central_rate_limiter', central_connection.rate_limiter.stats,
+                         counters=tuple(central_connection.rate_limiter.counters))
+    metrics.start_metrics_server()
+    await stream.run()
+    revalidate.cancel()
+    logger.info(f'Site index stats {site_index.stats()}')
+    await r.close()
 
 if __name__ == '__main__':
-    asyncio.run(worker())
\ No newline at end of file
+    asyncio.run(worker())
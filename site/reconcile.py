@@ -0,0 +1,81 @@
+"""Reconcile the Central sites with Netbox in one bulk run.
+
+Use after the site worker has been down or a stream was trimmed, instead of
+replaying webhooks. Start with a dry run to see the calls it would make:
+
+    python3 reconcile.py --dry-run
+    python3 reconcile.py
+"""
+import os
+import asyncio
+import argparse
+from azure.keyvault.secrets import SecretClient
+from azure.identity import DefaultAzureCredential
+import redis
+import redis.asyncio as aioredis
+import pynetbox
+from loguru import logger
+from helpers.central_utils.connection import central_connection
+from helpers.central_utils.site_index import SiteIndex
+from helpers.central_utils.site_reconcile import SiteReconciler
+from helpers.central_utils.rate_limit import CentralRateLimiter
+from helpers.secret_cache import SecretCache
+from helpers.log_setup import setup_logging
+
+VAULT_URL = os.environ["AZURE_KEYVAULT_URL"]
+credential = DefaultAzureCredential()
+client = SecretClient(vault_url=VAULT_URL, credential=credential)
+secrets = SecretCache(client)
+
+setup_logging('site-reconcile')
+
+
+async def reconcile(args):
+    # Redis settings
+    r_host = secrets.get('redis-server')
+    r_password = secrets.get('redis-password')
+    # Azure Cache for Redis listens for TLS on 6380
+    r_port = int(os.environ.get('REDIS_PORT', 6380))
+    r_ssl = os.environ.get('REDIS_SSL', 'true').lower() in ('1', 'true', 'yes')
+    r = aioredis.StrictRedis(host=r_host, port=r_port, encoding='utf-8', password=r_password, ssl=r_ssl,
+                             decode_responses=True)
+
+    # Shares the token bucket of the site workers, as bulk work
+    central_connection.use_rate_limiter(CentralRateLimiter(
+        redis.StrictRedis(host=r_host, port=r_port, password=r_password, ssl=r_ssl, decode_responses=True),
+        customer=central_connection.account,
+        rate=float(os.environ.get('CENTRAL_RATE_PER_SECOND', 7)),
+        daily_limit=int(os.environ.get('CENTRAL_DAILY_LIMIT', 5000)),
+    ))
+
+    nb = pynetbox.api(secrets.get('netbox-url'), token=secrets.get('netbox-token'))
+    nb.http_session.verify = False
+
+    reconciler = SiteReconciler(
+        nb, central_connection,
+        site_index=SiteIndex(r, central_connection),
+        max_parallel_calls=args.parallel,
+        max_delete_ratio=args.max_delete_ratio,
+    )
+    try:
+        summary = await reconciler.run(dry_run=args.dry_run)
+    finally:
+        await r.close()
+    logger.info(f'Central rate limiter stats {central_connection.rate_limiter.stats()}')
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile the Central sites with Netbox')
+    parser.add_argument('--dry-run', action='store_true', help='Only log the calls that would be made')
+    parser.add_argument('--parallel', type=int, default=int(os.environ.get('RECONCILE_PARALLEL_CALLS', 4)),
+                        help='Central calls in flight at once')
+    parser.add_argument('--max-delete-ratio', type=float, default=float(os.environ.get('RECONCILE_MAX_DELETE_RATIO', 0.2)),
+                        help='Hold back the deletes when they would remove more than this share of the sites')
+    summary = asyncio.run(reconcile(parser.parse_args()))
+    if summary.get('failed'):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
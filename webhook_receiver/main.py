@@ -1,42 +1,64 @@
 import os
-import sys
 import datetime
-import logging
-import json
 import asyncio
-import base64
 import hmac
-import hashlib
-from deepdiff import DeepDiff
+from contextlib import asynccontextmanager
 from loguru import logger
-from dataclasses import dataclass
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
-import redis
+import redis.asyncio as aioredis
 from typing import Optional
 from uuid import UUID
 from fastapi import FastAPI, Header, Request, Response
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel
-import uvicorn
+from helpers.secret_cache import SecretCache
+from helpers.stream_batcher import XaddBatcher
+from helpers.coalesce import Coalescer, StagedAlerts
+from helpers.lanes import LaneClassifier
+from helpers.dedup import DeliveryDeduplicator, body_key
+from helpers.stage_timer import StageTimer
+from helpers import metrics
+from helpers import fast_json
+from helpers import envelope
+from helpers.snapshot_diff import DEVICE_WATCH, diff_fields, full_diff
+from helpers.log_setup import setup_logging, log_payload, scrub_headers
+from helpers.signature import (CENTRAL_HEADERS, NETBOX_HEADERS, BodyTooLarge, missing_headers, central_hmac,
+                               central_signature, netbox_hmac, read_signed)
 
 # Loguru settings
-logger.remove()
-logger.add(sys.stderr, format="{time} {level} {message}")
-logger.add("/logs/webhook.log")
-logger.add("/logs/webhook_retention.log", retention="5 days")
-logger.add("/logs/webhook_rotation.log", rotation="1 MB")
-logger.add("/logs/webhook_compressed.log", compression="zip")
-
-# Azure Key vault authentication
+setup_logging('webhook')
+
+# Key Vault, Redis and everything built on them are set up by lifespan() in
+# each worker process, importing the app does not touch the network
 VAULT_URL = os.environ["AZURE_KEYVAULT_URL"]
-credential = DefaultAzureCredential()
-client = SecretClient(vault_url=VAULT_URL, credential=credential)
+secrets = None
+r = None
+batcher = None
+coalescer = None
+lanes = None
+dedup = None
+
+# Fetched by the parent before forking in multi-worker mode
+STARTUP_SECRETS = ('redis-server', 'redis-password', 'netbox-secret')
+# Number of worker processes, each with its own event loop
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Azure Cache for Redis listens for TLS on 6380
+r_port = int(os.environ.get('REDIS_PORT', 6380))
+r_ssl = os.environ.get('REDIS_SSL', 'true').lower() in ('1', 'true', 'yes')
+
+# Validating every body against WebhookData costs a second pass over large
+# Netbox snapshots, so it is opt-in
+VALIDATE_MODEL = os.environ.get('WEBHOOK_VALIDATE_MODEL', 'false').lower() in ('1', 'true', 'yes')
+timer = StageTimer(observe=metrics.stage_observer('webhook'))
+
+# Log a complete DeepDiff when an update touched none of the watched fields
+FULL_SNAPSHOT_DIFF = os.environ.get('FULL_SNAPSHOT_DIFF', 'false').lower() in ('1', 'true', 'yes')
 
-# Redis settings
-r_host = client.get_secret('redis-server').value
-r_password = client.get_secret('redis-password').value
-r = redis.StrictRedis(host=r_host, port=6380, charset='utf-8',
-                      password=r_password, ssl=True, decode_responses=True)
+# Largest webhook body accepted, checked against the bytes received as well as Content-Length
+MAX_BODY_BYTES = int(os.environ.get('WEBHOOK_MAX_BODY_BYTES', 1_000_000))
+
+# Site fields copied from the Netbox webhook into cmdb:alert entries
+SITE_SNAPSHOT_FIELDS = ('physical_address',)
 
 
 class WebhookResponse(BaseModel):
@@ -59,24 +81,102 @@ class WebhookData(BaseModel):
     cluster_hostname: Optional[str]  
    
 
+def key_vault_client():
+    """Azure Key Vault client, the Azure SDK is only imported when one is needed."""
+    from azure.identity import DefaultAzureCredential
+    from azure.keyvault.secrets import SecretClient
+    return SecretClient(vault_url=VAULT_URL, credential=DefaultAzureCredential())
+
+
+def load_secrets() -> SecretCache:
+    """Create the secret cache on first use."""
+    global secrets
+    if secrets is None:
+        secrets = SecretCache(key_vault_client(), ttls={'redis-server': 3600, 'redis-password': 3600})
+    return secrets
+
+
+def warm_secrets():
+    """Fetch the startup secrets once in the parent, so forked workers do not all ask Key Vault."""
+    loaded = load_secrets().warm(STARTUP_SECRETS)
+    logger.info(f'Secrets loaded before forking: {loaded}')
+
+
+def after_fork():
+    # Cached secrets are inherited, the Key Vault connection is not
+    secrets.after_fork(key_vault_client())
+
+
+async def write_alert(key, alert):
+    # Alerts are coalesced on the stream's key, then sent to the lane they belong in
+    return await batcher.xadd(lanes.stream_for(key, alert), envelope.stream_fields(key, alert))
+
+
+def connect():
+    """Connect to Redis and create the batcher, coalescer, lane classifier and deduplicator of this process."""
+    global r, batcher, coalescer, lanes, dedup
+    r = aioredis.StrictRedis(host=secrets.get('redis-server'), port=r_port, encoding='utf-8',
+                             password=secrets.get('redis-password'), ssl=r_ssl, decode_responses=True,
+                             max_connections=int(os.environ.get('REDIS_MAX_CONNECTIONS', 20)))
+    batcher = XaddBatcher(r, max_batch=int(os.environ.get('XADD_MAX_BATCH', 100)),
+                          max_delay=float(os.environ.get('XADD_MAX_DELAY', 0.002)),
+                          maxlen=int(os.environ.get('STREAM_MAXLEN', 100000)))
+    # Bursts of alerts for one serial, site or group are merged into one alert, a
+    # copy of what is held is kept in Redis until it has been written
+    coalescer = Coalescer(write_alert, window=float(os.environ.get('COALESCE_WINDOW', 1.0)),
+                          max_wait=float(os.environ.get('COALESCE_MAX_WAIT', 5.0)),
+                          staged=StagedAlerts(r, orphan_after=float(os.environ.get('COALESCE_ORPHAN_AFTER', 60))))
+    # Creates and deletes go ahead of updates, event types arriving in bulk go behind them
+    lanes = LaneClassifier(bulk_rate=int(os.environ.get('LANE_BULK_RATE', 20)),
+                           window=float(os.environ.get('LANE_BULK_WINDOW', 10.0)))
+    # Central and Netbox retry deliveries, each is only processed once
+    dedup = DeliveryDeduplicator(r, ttl=int(os.environ.get('WEBHOOK_DEDUP_TTL', 600)),
+                                 max_local=int(os.environ.get('WEBHOOK_DEDUP_MAX_LOCAL', 10000)))
+    # Component counters are read at scrape time, nothing is recorded per request
+    metrics.export_stats('secret_cache', secrets.stats, counters=tuple(secrets.counters))
+    metrics.export_stats('xadd_batcher', batcher.stats, counters=('entries', 'batches', 'errors'))
+    metrics.export_stats('coalescer', coalescer.stats,
+                         counters=('received', 'emitted', 'held_seconds', 'emit_retries', 'dropped',
+                                   'deferred', 'recovered'))
+    metrics.export_stats('lane_classifier', lanes.stats, counters=tuple(lanes.counters))
+    metrics.export_stats('webhook_dedup', dedup.stats, counters=tuple(dedup.counters))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    started = asyncio.get_running_loop().time()
+    # Key Vault calls block, a cache inherited from the parent answers from memory
+    await asyncio.to_thread(load_secrets)
+    await asyncio.to_thread(connect)
+    batcher.start()
+    recovery = asyncio.create_task(coalescer.recover_forever())
+    # Pre-forked workers copy their component stats to the shared metrics files
+    stats_sync = asyncio.create_task(metrics.sync_stats_forever()) if metrics.MULTIPROCESS else None
+    logger.info(f'Worker {os.getpid()} ready in {asyncio.get_running_loop().time() - started:.3f}s')
+    yield
+    recovery.cancel()
+    await coalescer.flush_all()
+    await batcher.stop()
+    await r.close()
+    if stats_sync:
+        stats_sync.cancel()
+        metrics.sync_stats()
+
+
 app = FastAPI(
     title='Webhook Listener',
     description='Universal Webhook Listener',
     version='1.0',
+    lifespan=lifespan,
 )
+logger.info(f'JSON backend {fast_json.BACKEND}, model validation {VALIDATE_MODEL}')
+
 
 # Functions for Netbox Webhook messages
 @logger.catch
-async def validate_netbox_signature(full_headers, encoded_body):
-    netbox_secret = client.get_secret('netbox-secret').value
-    logger.info(netbox_secret)
-    token = netbox_secret.encode()
-    logger.info(token)
+async def validate_netbox_signature(full_headers, encoded_hmac):
+    # encoded_hmac has been fed the body while it was read
     signature = full_headers['X-Hook-Signature']
-    logger.info(signature)
-    # Create hmac
-    encoded_hmac = hmac.new(token, msg=encoded_body, digestmod='sha512')
-    logger.info(encoded_hmac)
     if not hmac.compare_digest(
         encoded_hmac.hexdigest(),
         signature
@@ -89,28 +189,30 @@ async def validate_netbox_signature(full_headers, encoded_body):
 
 @logger.catch
 async def snapshot_compare(prechange, postchange):
-    device_diff = DeepDiff(prechange, postchange, ignore_order=True, exclude_paths={"root['last_updated']"})
-    match device_diff:
-        case {'values_changed': {"root['name']": {'new_value': new_hostname, 'old_value': old_hostname}}}:
-            return {'hostname': new_hostname}
-        case {'values_changed': {"root['custom_fields']['central_subscription']": {'new_value': new_subscription, 'old_value': old_subscription}}}:
-            return {'central_subscription': new_subscription}
-    logger.info(device_diff)
+    device_diff = diff_fields(prechange, postchange, DEVICE_WATCH)
+    if not device_diff and FULL_SNAPSHOT_DIFF:
+        logger.debug(full_diff(prechange, postchange))
+    # Nested values are kept, the stream envelope carries them as they are
     return device_diff
 
+def parse_body(encoded_body):
+    with timer.stage('parse'):
+        body = fast_json.loads(encoded_body)
+    if VALIDATE_MODEL:
+        with timer.stage('validate'):
+            WebhookData(**body)
+    return body
+
 @logger.catch
-async def determine_netbox_message(encoded_body):
-    decoded_body = encoded_body.decode('utf-8')
-    logger.info(decoded_body)
-    body = json.loads(decoded_body)
-    logger.info(body)
+async def determine_netbox_message(body):
+    log_payload('Netbox body', body)
     match body:
         case {'event': 'updated', 'data': {'serial': serial, 'device_role': {'name': device_type}}}:
             logger.info(f'Device in Netbox has been updated')
             prechange = body['snapshots']['prechange']
-            logger.info(f'prechange info sent for compare {prechange}')
+            log_payload('prechange info sent for compare', prechange)
             postchange = body['snapshots']['postchange']
-            logger.info(f'postchange info sent for compare {postchange}')
+            log_payload('postchange info sent for compare', postchange)
             diff = await snapshot_compare(prechange, postchange)
             logger.info(f'This was updated {diff}')
             return {'key': 'cmdb:alert', 'event': 'updated', 'device_type': device_type, 'serial': serial} | diff
@@ -119,45 +221,41 @@ async def determine_netbox_message(encoded_body):
             return {'key': 'cmdb:alert', 'event': event, 'model': model, 'serial': serial}
         case {'event': event, 'model': 'site', "data": {"name": site_name}}:
             logger.info(f'site {site_name} was {event}')
-            return {'key': 'cmdb:alert', 'event': event, 'model': 'site', 'name': site_name}
+            site_alert = {'key': 'cmdb:alert', 'event': event, 'model': 'site', 'name': site_name}
+            # Forward what the cmdb worker needs so it does not have to ask Netbox
+            for field in SITE_SNAPSHOT_FIELDS:
+                if body['data'].get(field) is not None:
+                    site_alert[field] = body['data'][field]
+            return site_alert
             
         case _:
             logger.info("Dead end")
             return f"{'DeadEnd'}:{'group'}"
 
 @logger.catch
-async def process_netbox_webhook(full_headers, encoded_body):
-    validated = await validate_netbox_signature(full_headers, encoded_body)
+async def process_netbox_webhook(full_headers, encoded_body, encoded_hmac):
+    with timer.stage('hmac'):
+        validated = await validate_netbox_signature(full_headers, encoded_hmac)
     logger.info(validated)
     match validated:
         case 'CMDB Alert Valid':
-            netbox_message = await determine_netbox_message(encoded_body)
+            body = parse_body(encoded_body)
+            with timer.stage('match'):
+                netbox_message = await determine_netbox_message(body)
+            metrics.count_alert('netbox', body.get('model') if isinstance(body, dict) else None, netbox_message)
             logger.info(netbox_message)
             return netbox_message
         case _:
+            metrics.count_alert('netbox', None, {'result': 'Webhook Sender not valid'})
             return {'result': 'Webhook Sender not valid'}     
 
 
 # Functions for Central Webhook messages
 @logger.catch
-async def validate_central_signature(full_headers, encoded_body):
-    cid = full_headers['X-Central-Customer-Id']
-    service = full_headers['X-Central-Service']
-    delivery = full_headers['X-Central-Delivery-Id']
-    timestamp = full_headers['X-Central-Delivery-Timestamp']
+async def validate_central_signature(full_headers, encoded_hmac):
     signature = full_headers['X-Central-Signature']
-    central_token = client.get_secret(f'central-{cid}-webhooktoken').value
-    token = central_token.encode('utf-8')
-    # Assign header values to variables
-    combined_header = service + delivery + timestamp
-    # Decode the encoded body
-    decoded_body = encoded_body.decode('utf-8')
-    # Combine everything and encode it
-    sign_data = str(decoded_body) + str(combined_header)
-    sign_data_encoded = sign_data.encode('utf-8')
-    # Find Message signature using HMAC algorithm and SHA256 digest mod
-    encoded_hmac = hmac.new(token, msg=sign_data_encoded, digestmod=hashlib.sha256).digest()
-    generated_signature = base64.b64encode(encoded_hmac).decode()       
+    # The body went into encoded_hmac while it was read, the headers follow it
+    generated_signature = central_signature(encoded_hmac, full_headers)
     if not hmac.compare_digest(
         signature,
         generated_signature
@@ -168,83 +266,176 @@ async def validate_central_signature(full_headers, encoded_body):
         return 'Central Alert Valid'
 
 @logger.catch
-async def determine_central_message(encoded_body):
-    decoded_body = encoded_body.decode('utf-8')
-    body = json.loads(decoded_body)
-    logger.info(body)
+async def determine_central_message(body):
+    log_payload('Central body', body)
     match body:
         case {'alert_type': 'DEVICE_CONFIG_CHANGE_DETECTED', 'details': {'group_name': group_name, 'dev_type': device_type}, "cluster_hostname": cluster}:
             logger.info(f'Config for {group_name} was changed.')
             return {'key': 'config:alert', 'group': group_name, 'device': device_type, 'cluster': cluster}
-        case {"alert_type": "New AP detected" | "New Switch connected", "details": {"group_name": group_name, "serial": serial, "dev_type": device_type, }, "cluster_hostname": cluster}:
+        case {"alert_type": "New AP detected" | "New Switch connected", "details": {"group_name": group_name, "serial": serial, "dev_type": device_type, } as details, "cluster_hostname": cluster}:
             logger.info(f"New {device_type} connected to {cluster}")
-            return {'key': 'device:alert', 'group': group_name, 'serial': serial, 'device': device_type, 'cluster': cluster}
+            alert = {'key': 'device:alert', 'group': group_name, 'serial': serial, 'device': device_type, 'cluster': cluster}
+            # The device worker needs the MAC address to add the device to the inventory
+            if details.get('macaddr'):
+                alert['macaddr'] = details['macaddr']
+            return alert
         case _:
             logger.info('Unsupported Webhook')
             return{'result': 'Unsupported Webhook'}
 
 @logger.catch
-async def process_central_webhook(full_headers, encoded_body):
-    logger.info(full_headers)
-    logger.info(encoded_body)
-    validated = await validate_central_signature(full_headers, encoded_body)
+async def process_central_webhook(full_headers, encoded_body, encoded_hmac):
+    with timer.stage('hmac'):
+        validated = await validate_central_signature(full_headers, encoded_hmac)
     logger.info(validated)
     match validated:
         case 'Central Alert Valid':
-            central_message = await determine_central_message(encoded_body)
+            body = parse_body(encoded_body)
+            with timer.stage('match'):
+                central_message = await determine_central_message(body)
+            metrics.count_alert('central', body.get('alert_type') if isinstance(body, dict) else None, central_message)
             logger.info(f"Central message information extracted")
             logger.info(central_message)
             return central_message
         case _:
+            metrics.count_alert('central', None, {'result': 'Webhook Sender not valid'})
             return {'result': 'Webhook Sender not valid'} 
 
 
+@logger.catch
+async def start_hmac(sender, full_headers):
+    """HMAC keyed with the sender's secret, or None when Key Vault has no secret for it."""
+    try:
+        if sender == 'central':
+            return central_hmac(await secrets.acentral_token(full_headers['X-Central-Customer-Id']))
+        return netbox_hmac(await secrets.aget('netbox-secret'))
+    except KeyError:
+        logger.info(f'No {sender} webhook secret for this delivery')
+        return None
+
+
 @app.post('/webhook', response_model=WebhookResponse, status_code=200)
 @logger.catch
 async def webhook(
-    webhook_input: WebhookData,
     request: Request,
     response: Response,
     content_length: int = Header(...)
 ):
 
-    if content_length > 1_000_000:
+    if content_length > MAX_BODY_BYTES:
       #  To prevent memory allocation attacks
         response.status_code = 400
         return {'result': 'Content too long'}
 
     full_headers = request.headers
-    logger.info('Full header information')
-    logger.info(full_headers)
-    encoded_body = await request.body()
-    logger.info('Encoded body information')
-    logger.info(encoded_body)
+    log_payload('Full header information', scrub_headers(full_headers))
 
     match full_headers:
         case {"X-Central-Signature": signature}:
             logger.info('Aruba Central webhook inbound')
-            central_webhook = await process_central_webhook(full_headers, encoded_body)
-            alert_info = central_webhook
-            key = alert_info.pop('key')
-            logger.info(key)
-            logger.info(alert_info)
+            sender, process, required = 'central', process_central_webhook, CENTRAL_HEADERS
+            delivery = full_headers.get('X-Central-Delivery-Id')
+            delivery_key = f"central:{full_headers.get('X-Central-Customer-Id')}:{delivery}" if delivery else None
         case {"X-Hook-Signature": signature}:
             logger.info('Netbox webhook inbound')
-            netbox_webhook = await process_netbox_webhook(full_headers, encoded_body)
-            alert_info = netbox_webhook
-            key = alert_info.pop('key')
-            logger.info(key)
-            logger.info(alert_info)
+            # Netbox has no delivery id, a retry repeats the exact body
+            sender, process, required, delivery_key = 'netbox', process_netbox_webhook, NETBOX_HEADERS, None
         case _:
             logger.info('Unknown Webhook Sender')
+            metrics.count_alert('unknown', None, {'result': 'Unknown Webhook Sender'})
             return {'result': 'Unknown Webhook Sender'}
 
-    pipe = r.pipeline()
-    alert_id = pipe.xadd(key, alert_info, id='*')
-    pipe.execute()
-    print(f"alert {alert_id} sent")
+    # Nothing below reads the body until the sender is known to be able to sign it
+    missing = missing_headers(full_headers, required)
+    if missing:
+        logger.info(f'{sender} webhook without {", ".join(missing)}')
+        metrics.count_alert(sender, None, {'result': 'Missing signature headers'})
+        response.status_code = 400
+        return {'result': 'Missing signature headers'}
+    encoded_hmac = await start_hmac(sender, full_headers)
+    if encoded_hmac is None:
+        metrics.count_alert(sender, None, {'result': 'Webhook Sender not valid'})
+        return {'result': 'Webhook Sender not valid'}
+
+    # Retries are answered before the body is signature checked, parsed or enqueued
+    if delivery_key and not await dedup.claim(delivery_key):
+        logger.info(f'Duplicate delivery {delivery_key}')
+        metrics.count_alert(sender, None, {'result': 'Duplicate delivery'})
+        return {'result': 'Duplicate delivery'}
+    # The body is signed chunk by chunk as it streams in and kept for the parser
+    try:
+        with timer.stage('read'):
+            encoded_body = await read_signed(request.stream(), encoded_hmac, MAX_BODY_BYTES)
+    except (BodyTooLarge, ClientDisconnect) as e:
+        if delivery_key:
+            await dedup.release(delivery_key)
+        if isinstance(e, ClientDisconnect):
+            logger.info(f'{sender} webhook sender disconnected')
+            return {'result': 'Client disconnected'}
+        logger.info(f'{sender} webhook body over {MAX_BODY_BYTES} bytes')
+        response.status_code = 400
+        return {'result': 'Content too long'}
+    log_payload('Encoded body information', encoded_body)
+    if delivery_key is None:
+        delivery_key = body_key(sender, encoded_body)
+        if not await dedup.claim(delivery_key):
+            logger.info(f'Duplicate delivery {delivery_key}')
+            metrics.count_alert(sender, None, {'result': 'Duplicate delivery'})
+            return {'result': 'Duplicate delivery'}
+
+    alert_info = await process(full_headers, encoded_body, encoded_hmac)
+
+    if not isinstance(alert_info, dict) or 'key' not in alert_info:
+        # Invalid sender, unsupported or dead end message, nothing to enqueue
+        logger.info(alert_info)
+        if alert_info is None or alert_info == {'result': 'Webhook Sender not valid'}:
+            # Failed or forged deliveries must not block the genuine retry
+            await dedup.release(delivery_key)
+        if isinstance(alert_info, dict) and 'result' in alert_info:
+            return alert_info
+        return {'result': 'Dead end'}
+    key = alert_info.pop('key')
+    logger.info(key)
+    logger.info(alert_info)
+
+    try:
+        with timer.stage('enqueue'):
+            # Alerts held for coalescing are answered once saved to Redis, not when written
+            alert_id = await coalescer.submit(key, alert_info, wait=False)
+    except Exception as e:
+        logger.error(f'Unable to enqueue alert on {key}: {e}')
+        await dedup.release(delivery_key)
+        response.status_code = 503
+        return {'result': 'Enqueue failed'}
+    logger.info(f"alert {alert_id} sent" if alert_id else f'alert on {key} staged')
     return {'result': 'ok'}
-    
+
+
+@app.get('/metrics')
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get('/stats')
+async def stats():
+    return {'secrets': secrets.stats(), 'xadd': batcher.stats(), 'coalesce': coalescer.stats(),
+            'lanes': lanes.stats(), 'dedup': dedup.stats(), 'stages': timer.stats()}
+
+
+def serve(host: str = '0.0.0.0', port: int = 5000, workers: int = WORKERS, **uvicorn_options):
+    """Serve the app in this process, or in ``workers`` processes forked after the secrets are loaded.
+
+    With several workers the parent also serves the metrics of all of them on $METRICS_PORT.
+    """
+    from helpers import prefork
+    started = None
+    if workers > 1 and metrics.MULTIPROCESS:
+        metrics.clear_multiprocess_dir()
+        started = metrics.start_metrics_server
+    prefork.serve(app, host=host, port=port, workers=workers, before_fork=warm_secrets,
+                  after_fork=after_fork, started=started, on_exit=metrics.process_exited, **uvicorn_options)
+
 
 if __name__ == '__main__':
-    uvicorn.run('main:app', host='0.0.0.0', port=5000)
\ No newline at end of file
+    serve()
\ No newline at end of file